@@ -0,0 +1,77 @@
+#this file benchmarks the chunker against langchain's RecursiveCharacterTextSplitter
+#run from backend/: python -m benchmarks.chunking [--mb 5] [--json]
+import sys
+import json
+import time
+import random
+import argparse
+from services.chunks import chunk_text
+
+WORDS = "the revenue report for quarter growth margin customer region sales cost forecast budget team".split()
+
+
+def synthetic_text(megabytes: float, seed: int = 0) -> str:
+    """Paragraphs of random words and lines, roughly like extracted PDF text."""
+    rng = random.Random(seed)
+    parts, size = [], 0
+    while size < megabytes * 1024 * 1024:
+        lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 25))) for _ in range(rng.randint(1, 8))]
+        paragraph = "\n".join(lines)
+        parts.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(parts)
+
+
+def measure(name: str, split, text: str, repeat: int) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = split(text)
+        best = min(best, time.perf_counter() - started)
+    return {
+        "splitter": name,
+        "seconds": round(best, 4),
+        "mb_per_sec": round(len(text) / 1024 / 1024 / best, 2),
+        "chunks": len(chunks),
+        "avg_chunk_chars": round(sum(map(len, chunks)) / max(len(chunks), 1), 1),
+    }
+
+
+def main(argv=None) -> list:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mb", type=float, default=5.0, help="size of the synthetic input in MB")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    text = synthetic_text(args.mb)
+    results = [
+        measure("chunks.chunk_text (chars)", lambda t: chunk_text(t, args.chunk_size, args.overlap, unit="chars"), text, args.repeat),
+        measure("chunks.chunk_text (tokens)", lambda t: chunk_text(t, args.chunk_size // 4, args.overlap // 4, unit="tokens"), text, args.repeat),
+    ]
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        RecursiveCharacterTextSplitter = None
+    if RecursiveCharacterTextSplitter is not None:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=args.chunk_size, chunk_overlap=args.overlap, length_function=len, separators=["\n\n", "\n", " ", ""],
+        )
+        results.append(measure("RecursiveCharacterTextSplitter", splitter.split_text, text, args.repeat))
+    else:
+        print("langchain is not installed; skipping RecursiveCharacterTextSplitter", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps({"input_mb": args.mb, "results": results}, indent=2))
+    else:
+        print(f"input: {args.mb} MB, chunk_size={args.chunk_size}, overlap={args.overlap}")
+        for result in results:
+            print(f"{result['splitter']:<34} {result['mb_per_sec']:>8} MB/s {result['chunks']:>8} chunks "
+                  f"{result['avg_chunk_chars']:>8} avg chars")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#this file provides deterministic stand-ins for the embedding model and the LLM so benchmarks run offline
+import re
+import time
+import hashlib
+from typing import Any, Iterator, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_words = re.compile(r"\w+")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words vectors: the same text always gets the same vector and texts sharing words
+    are similar, so retrieval behaves sensibly without a model.
+
+    Args:
+        dimension (int): Vector size (embedding-001 returns 768)
+        latency (float): Seconds slept per call, to stand in for the network round trip
+    """
+
+    def __init__(self, dimension: int = 768, latency: float = 0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+
+    def _vector(self, text: str) -> list:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in _words.findall(text.lower()):
+            vector[int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little") % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that answers with a fixed-length summary of its prompt after a configurable delay.
+
+    Args:
+        latency (float): Seconds before the first token
+        token_latency (float): Seconds between streamed tokens
+        answer_tokens (int): Words in each answer
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _answer(self, messages) -> list:
+        prompt = " ".join(str(message.content) for message in messages)
+        words = _words.findall(prompt)
+        return [words[i % len(words)] if words else "answer" for i in range(self.answer_tokens)]
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency + self.token_latency * self.answer_tokens)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(self._answer(messages))))])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for word in self._answer(messages):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
@@ -0,0 +1,362 @@
+#this file runs the offline benchmark suite over the ingest and query pipeline
+#run from backend/: python -m benchmarks.suite [--stages pdf,chat] [--clients 8] [--compare old.json]
+#embeddings, the LLM and the vector store are local stand-ins (see benchmarks/fakes.py); no API keys or network needed
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+
+STAGES = ("pdf", "whatsapp", "excel", "chunking", "embedding", "upsert", "chat")
+WORDS = ("the revenue report for quarter growth margin customer region sales cost forecast budget team "
+         "invoice payment north south order shipment delay meeting").split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _paragraphs(rng: random.Random, count: int) -> list:
+    return [_text(rng, rng.randint(30, 120)) for _ in range(count)]
+
+
+def _configure_environment(workdir: str, args) -> None:
+    """Points every cache and store at the scratch directory and selects the local backends, before any service is imported."""
+    os.environ.update({
+        "VECTOR_BACKEND": args.vector_backend,
+        "VECTOR_SEGMENT_DIR": os.path.join(workdir, "vectors"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embeddings.sqlite3"),
+        "SESSION_STORE_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        "LEXICAL_INDEX_PATH": os.path.join(workdir, "lexical.sqlite3"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "TABLE_DIR": os.path.join(workdir, "tables"),
+        "ANSWER_CACHE_THRESHOLD": "2" if not args.answer_cache else os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"),
+    })
+
+
+def _timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def _rate(count, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds else 0.0
+
+
+class _NullProgress:
+    def update(self, **counters) -> None:
+        pass
+
+
+#stages
+
+def bench_pdf(workdir: str, args) -> dict:
+    import pymupdf
+    from services.pdf_transcript import extract_pdf_transcript
+    rng = random.Random(args.seed)
+    path = os.path.join(workdir, "bench.pdf")
+    doc = pymupdf.open()
+    for _ in range(args.pdf_pages):
+        page = doc.new_page()
+        page.insert_textbox(pymupdf.Rect(50, 50, 550, 800), "\n\n".join(_paragraphs(rng, 4)), fontsize=9)
+    doc.save(path)
+    doc.close()
+    pages, text_seconds = _timed(extract_pdf_transcript, path, text_only=True)
+    _, markdown_seconds = _timed(extract_pdf_transcript, path, text_only=False)
+    return {
+        "pages": len(pages),
+        "text_seconds": round(text_seconds, 4),
+        "text_pages_per_sec": _rate(len(pages), text_seconds),
+        "markdown_seconds": round(markdown_seconds, 4),
+        "markdown_pages_per_sec": _rate(len(pages), markdown_seconds),
+    }
+
+
+def bench_whatsapp(workdir: str, args) -> dict:
+    from services.whatsapp import extract_whatsapp_chat
+    rng = random.Random(args.seed)
+    lines, minute = [], 0
+    for _ in range(args.chat_messages):
+        minute += rng.choice((1, 1, 2, 5, 45))
+        day, rest = divmod(minute, 24 * 60)
+        lines.append(f"{1 + day % 28:02d}/{1 + day // 28 % 12:02d}/2024, {rest // 60:02d}:{rest % 60:02d} - "
+                     f"{rng.choice(('Asha', 'Ravi', 'Meera'))}: {_text(rng, rng.randint(3, 25))}")
+    path = os.path.join(workdir, "chat.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("WhatsApp Chat with Team.txt", "\n".join(lines))
+    size = sum(len(line) + 1 for line in lines)
+    chunks, seconds = _timed(extract_whatsapp_chat, path)
+    return {
+        "messages": len(lines),
+        "chunks": len(chunks),
+        "seconds": round(seconds, 4),
+        "messages_per_sec": _rate(len(lines), seconds),
+        "mb_per_sec": _rate(size / 1024 / 1024, seconds),
+    }
+
+
+def bench_excel(workdir: str, args) -> dict:
+    import pandas as pd
+    from services.jobs import excel_job
+    rng = np.random.default_rng(args.seed)
+    rows = args.excel_rows
+    frame = pd.DataFrame({
+        "Region": rng.choice(["North", "South", "East", "West", None], rows),
+        "Account": rng.integers(10000, 99999, rows),
+        "Debit": rng.random(rows) * 1e5,
+        "Credit": np.where(rng.random(rows) < 0.1, np.nan, rng.random(rows) * 1e5),
+        "Sparse": np.where(rng.random(rows) < 0.9, None, "x"),
+    })
+    path = os.path.join(workdir, "bench.csv")
+    frame.to_csv(path, index=False)
+    _, seconds = _timed(excel_job, path, "bench.csv", _NullProgress())
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": _rate(rows, seconds),
+    }
+
+
+def bench_chunking(workdir: str, args) -> dict:
+    from services.chunks import chunk_documents
+    from benchmarks.chunking import synthetic_text
+    text = synthetic_text(args.chunk_mb, seed=args.seed)
+    chunks, seconds = _timed(chunk_documents, [{"text": text, "metadata": {"source": "pdf"}}])
+    return {
+        "input_mb": args.chunk_mb,
+        "chunks": len(chunks),
+        "seconds": round(seconds, 4),
+        "mb_per_sec": _rate(len(text) / 1024 / 1024, seconds),
+    }
+
+
+def _corpus(args) -> list:
+    from langchain_core.documents import Document
+    rng = random.Random(args.seed)
+    return [
+        Document(page_content=f"chunk {i}: {paragraph}", metadata={"source": "pdf", "page_num": i // 4 + 1})
+        for i, paragraph in enumerate(_paragraphs(rng, args.chunks))
+    ]
+
+
+def bench_embedding(workdir: str, args) -> dict:
+    from services.embedding_cache import CachedEmbeddings, EmbeddingCache
+    from services.ingestion import INGEST_BATCH_SIZE
+    from benchmarks.fakes import FakeEmbeddings
+    texts = [doc.page_content for doc in _corpus(args)]
+    model = FakeEmbeddings(latency=args.embed_latency)
+    embeddings = CachedEmbeddings(model, "benchmark", EmbeddingCache(os.path.join(workdir, "embedding-stage.sqlite3")))
+
+    def embed_all():
+        for start in range(0, len(texts), INGEST_BATCH_SIZE):
+            embeddings.embed_documents(texts[start:start + INGEST_BATCH_SIZE])
+
+    _, cold = _timed(embed_all)
+    calls = model.calls
+    _, warm = _timed(embed_all)
+    return {
+        "chunks": len(texts),
+        "cold_seconds": round(cold, 4),
+        "cold_chunks_per_sec": _rate(len(texts), cold),
+        "warm_seconds": round(warm, 4),
+        "warm_chunks_per_sec": _rate(len(texts), warm),
+        "model_calls_cold": calls,
+        "model_calls_warm": model.calls - calls,
+    }
+
+
+def bench_upsert(workdir: str, args) -> dict:
+    from services.vector_backend import LocalVectorStore
+    from services.ingestion import sync_documents, document_key
+    from benchmarks.fakes import FakeEmbeddings
+    documents = _corpus(args)
+    store = LocalVectorStore(FakeEmbeddings(latency=args.embed_latency), namespace="benchmark_upsert",
+                             persistent=args.vector_backend == "segments")
+    documents_by_key = {document_key("pdf", "benchmark"): documents}
+    stats, seconds = _timed(sync_documents, store, documents_by_key)
+    _, resync_seconds = _timed(sync_documents, store, documents_by_key)
+    query = store.embeddings.embed_query("revenue growth in the north region")
+    search_seconds = []
+    for _ in range(200):
+        _, elapsed = _timed(store.similarity_search_by_vector, query, 20)
+        search_seconds.append(elapsed)
+    return {
+        "chunks": len(documents),
+        "stored": stats["stored"],
+        "seconds": round(seconds, 4),
+        "chunks_per_sec": _rate(stats["stored"], seconds),
+        "resync_seconds": round(resync_seconds, 4),
+        "search_p50_ms": round(float(np.percentile(search_seconds, 50)) * 1000, 3),
+    }
+
+
+def _latency_summary(latencies: list) -> dict:
+    values = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+def bench_chat(workdir: str, args) -> dict:
+    """End-to-end /retrieval_chat through the ASGI app, with args.clients concurrent clients."""
+    import httpx
+    import main
+    import route
+    from services.embedding_cache import CachedEmbeddings, get_embedding_cache
+    from services.session_store import set_cached_result
+    from services.chunks import chunk_documents
+    from benchmarks.fakes import FakeEmbeddings, FakeChatModel
+
+    # Swap the hosted providers for the stand-ins (the chains pick up main.Model when first built)
+    embeddings = CachedEmbeddings(FakeEmbeddings(latency=args.embed_latency), "benchmark", get_embedding_cache())
+    route.get_embeddings = lambda: embeddings
+    main.Model = FakeChatModel(latency=args.llm_latency)
+
+    session = "benchmark"
+    rng = random.Random(args.seed)
+    # Chunked page by page and stored by reference, as the PDF job stores it
+    set_cached_result("pdf:benchmark", chunk_documents([
+        {"text": "\n\n".join(_paragraphs(rng, 6)), "metadata": {"page_num": page + 1, "source": "pdf"}}
+        for page in range(max(args.chunks // 6, 1))
+    ]))
+    route.save_extracted(session, "pdf_text", "benchmark", "pdf:benchmark")
+    ingest, ingest_seconds = _timed(route.store_embeddings, session)
+    if "error" in ingest:
+        raise RuntimeError(ingest["error"])
+
+    queries = [f"what happened to {_text(rng, 6)}?" for _ in range(args.requests)]
+    latencies, errors = [], 0
+
+    async def run():
+        nonlocal errors
+        transport = httpx.ASGITransport(app=route.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            pending = iter(queries)
+
+            async def worker():
+                nonlocal errors
+                for query in pending:
+                    started = time.perf_counter()
+                    response = await client.post("/retrieval_chat", data={"query": query}, headers={"X-Session-Id": session})
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200 or "error" in response.json():
+                        errors += 1
+
+            await asyncio.gather(*(worker() for _ in range(args.clients)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    wall = time.perf_counter() - started
+    return {
+        "clients": args.clients,
+        "requests": len(latencies),
+        "errors": errors,
+        "ingest_chunks": ingest["stats"]["chunks"],
+        "ingest_seconds": round(ingest_seconds, 4),
+        "requests_per_sec": _rate(len(latencies), wall),
+        **_latency_summary(latencies),
+    }
+
+
+#reporting
+
+def _metadata(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def compare(current: dict, previous: dict) -> list:
+    """Lines with the relative change of every numeric metric present in both runs."""
+    lines = []
+    for stage, metrics in current["stages"].items():
+        before = previous.get("stages", {}).get(stage, {})
+        for name, value in metrics.items():
+            old = before.get(name)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                lines.append(f"{stage}.{name}: {old} -> {value} ({(value - old) / old * 100:+.1f}%)")
+    return lines
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the ingest and query pipeline")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--out", help="JSON results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to print changes against")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pdf-pages", type=int, default=40)
+    parser.add_argument("--chat-messages", type=int, default=100000)
+    parser.add_argument("--excel-rows", type=int, default=100000)
+    parser.add_argument("--chunk-mb", type=float, default=5.0)
+    parser.add_argument("--chunks", type=int, default=2000, help="chunks embedded, upserted and queried")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent /retrieval_chat clients")
+    parser.add_argument("--requests", type=int, default=200, help="total /retrieval_chat requests")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per fake embedding call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--vector-backend", choices=("local", "segments"), default="local",
+                        help="vector engine of the upsert and chat stages")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache on during the chat stage")
+    args = parser.parse_args(argv)
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    benches = {
+        "pdf": bench_pdf, "whatsapp": bench_whatsapp, "excel": bench_excel, "chunking": bench_chunking,
+        "embedding": bench_embedding, "upsert": bench_upsert, "chat": bench_chat,
+    }
+    results = {"metadata": _metadata(args), "stages": {}}
+    with tempfile.TemporaryDirectory(prefix="insightify-bench-") as workdir:
+        _configure_environment(workdir, args)
+        cwd = os.getcwd()
+        os.chdir(workdir)  # extraction side files (e.g. rendered images) stay in the scratch directory
+        sys.path.insert(0, cwd)
+        try:
+            for stage in stages:
+                print(f"running {stage} ...", file=sys.stderr)
+                try:
+                    results["stages"][stage] = benches[stage](workdir, args)
+                except Exception as e:
+                    results["stages"][stage] = {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            os.chdir(cwd)
+
+    out = args.out or os.path.join("benchmarks", "results", datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results["stages"], indent=2))
+    print(f"results written to {out}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as file:
+            for line in compare(results, json.load(file)):
+                print(line)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,114 +1,232 @@
 import os
+import threading
 from dotenv import load_dotenv
-from services.youtube_transcript import extract_transcript
-from services.pdf_transcript import extract_pdf_transcript
-from services.vector_store import vector_store, retriver_data, get_embeddings
-from langchain.schema import Document
-from langchain_groq import ChatGroq
-from langchain.chains import RetrievalQA
-from langchain.memory import ConversationBufferMemory
-from langchain_community.vectorstores.utils import filter_complex_metadata
 import warnings
-from langchain_google_genai import ChatGoogleGenerativeAI
-from services.excel import preprocessing_func
+from services.lru import LRUCache
+from services import metrics
+from services.context_builder import CONTEXT_TOKEN_BUDGET, ContextRetriever
+from services.chunks import count_tokens
+from services.table_store import AGGREGATIONS, FILTER_OPS, describe_table, format_result, run_table_query
+import re
+import json
+import time
+from contextlib import contextmanager
 warnings.filterwarnings("ignore")
-import google.generativeai as genai
 
 # Load environment variables
 load_dotenv()
 
-print("..... Loading Keys .....")
-groq_api_key = os.getenv("GROQ_API_KEY")
-google_api_key = os.getenv("GOOGLE_API_KEY")
-langchain_api_key = os.getenv("langchain_api_key")
-huggingface_api_key = os.getenv("HUGGINGFACE_API_KEY")
-
-print("..... Set Environment Variables .....")
-os.environ["GOOGLE_API_KEY"] = google_api_key
-os.environ["GROQ_API_KEY"] = groq_api_key
-os.environ["langchain_api_key"] = langchain_api_key
-os.environ["HUGGINGFACE_API_KEY"] = huggingface_api_key
-
-genai.configure(api_key=google_api_key)
-
-# Load the LLM model
-Model = ChatGroq(
-    model_name="deepseek-r1-distill-llama-70b",
-    api_key=groq_api_key,
-    temperature=0.2,
-    max_tokens=2000,  # Reduce this value
-    streaming=True,
-    max_retries=3,
-)
-
-# Gemini = genai.GenerativeModel(
-#     "gemini-1.5-flash")
-    
-
-# Global variable to store retriever
-retriever = None
-
-
-from langchain.schema import Document
-
-def final_texts(transcript, pdf_text, whatsapp_text):
-    if not transcript and not pdf_text and not whatsapp_text:
-        raise ValueError("All inputs cannot be None.")
-
-    final_texts = []
-
-    #Append YouTube transcript
-    if transcript:
-        final_texts.append(Document(page_content=transcript, metadata={"source": "youtube"}))
-
-    #Append PDF text 
-    if pdf_text:
-        final_texts.append(Document(page_content=pdf_text, metadata={"source": "pdf"}))
-    
-    #Append WhatsApp text
-    if whatsapp_text:
-        final_texts.append(Document(page_content=whatsapp_text, metadata={"source": "whatsapp"}))
-    
-
-
-    complex_metadata = filter_complex_metadata(final_texts)
-
-    return complex_metadata
-
-
-def process_vector_store(youtube_data, pdf_data, whatsapp_data):
-    """Processes embeddings, stores data in vector DB, and initializes retriever."""
-    global retriever  # Use global variable
-    # Ensure we have data before processing
-    if not pdf_data and not youtube_data and not whatsapp_data:
-        return {"error": "No data available for vector store processing."}
-    # Extract final texts
-    text_data = final_texts(youtube_data, pdf_data,whatsapp_data)
-    # Ensure extracted data is not empty
-    if not text_data:
-        return {"error": "No text extracted from provided files."}
-    # Generate embeddings and store in vector DB
-    vector = vector_store(text_data)
-    if vector is None:
-        raise ValueError("Vector store creation failed. Check input data and embeddings.")
-    # Initialize retriever
-    retriever = retriver_data(vector)
-    if retriever is None:
-        raise ValueError("Retriever initialization failed. Ensure vector store is working.")
-    return {"message": "Vector store and retriever initialized successfully."}
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-r1-distill-llama-70b")
+
+# The LLM client (and langchain_groq) is loaded on first use, so importing this module stays cheap
+# and the server starts without a Groq key; assign Model to use a different chat model
+Model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Returns the chat model, building the Groq client on first use."""
+    global Model
+    if Model is None:
+        with _model_lock:
+            if Model is None:
+                groq_api_key = os.getenv("GROQ_API_KEY")
+                if not groq_api_key:
+                    raise ValueError("GROQ_API_KEY is not set.")
+                from langchain_groq import ChatGroq
+                Model = ChatGroq(
+                    model_name=LLM_MODEL,
+                    api_key=groq_api_key,
+                    temperature=0.2,
+                    max_tokens=2000,  # Reduce this value
+                    streaming=True,
+                    max_retries=3,
+                )
+    return Model
+
+
+def _stuff_prompt(model):
+    """The "stuff" QA prompt for the model: the chat prompt for chat models, the completion prompt otherwise."""
+    # Imported on first use: langchain.chains pulls in most of langchain
+    from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR
+    return PROMPT_SELECTOR.get_prompt(model)
+
+
+# Retrievers are built once per vector store and stuff chains once per chat model, and reused across requests.
+# Cached values keep a reference to their key object, so its id() is not reused while cached.
+CHAIN_CACHE_SIZE = int(os.getenv("CHAIN_CACHE_SIZE", "64"))
+_retrievers = LRUCache(CHAIN_CACHE_SIZE)
+_chains = LRUCache(CHAIN_CACHE_SIZE)
+
+
+def get_retriever(vector_store, token_budget=None):
+    """Returns a cached retriever for the vector store that packs up to token_budget tokens of context."""
+    token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+    return _retrievers.get_or_create(
+        (id(vector_store), token_budget),
+        lambda: ContextRetriever(vector_store=vector_store, token_budget=token_budget),
+    )
+
+
+def _select_context(query, retriever, query_vector=None):
+    """Retrieved documents plus context counters (the retriever's own selection when it has one)."""
+    with metrics.stage("retrieval"):
+        if hasattr(retriever, "select"):
+            return retriever.select(query, query_vector=query_vector)
+        docs = retriever.invoke(query)
+        return {"documents": docs, "context_tokens": sum(count_tokens(doc.page_content) for doc in docs), "candidates": len(docs)}
+
+
+@contextmanager
+def _llm_call():
+    """Times one LLM call and counts it as in flight; failures are counted as upstream errors."""
+    try:
+        with metrics.stage("llm"), metrics.in_flight(work="llm"):
+            yield
+    except Exception:
+        metrics.upstream_error("llm")
+        raise
+
+
+def _usage(selection, prompt_tokens, retriever):
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "context_tokens": selection["context_tokens"],
+        "chunks": len(selection["documents"]),
+        "candidates": selection["candidates"],
+        "dropped_duplicates": selection.get("dropped_duplicates", 0),
+        "token_budget": getattr(retriever, "token_budget", None),
+    }
+    metrics.add_items("prompt_tokens", usage["prompt_tokens"])
+    metrics.add_items("context_tokens", usage["context_tokens"])
+    metrics.add_items("context_chunks", usage["chunks"])
+    return usage
+
+
+def _build_chain(model):
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    prompt = _stuff_prompt(model)
+    return prompt, create_stuff_documents_chain(model, prompt)
+
+
+def stuff_chain():
+    """
+    Returns the cached "stuff" documents chain for the current model together with its prompt.
+    The chain holds no per-request state, so one chain per model is shared by concurrent requests.
+    """
+    model = get_model()
+    return _chains.get_or_create(id(model), lambda: _build_chain(model))
+
+
+def _prompt_tokens(prompt, docs, query):
+    """Counts the tokens of the messages the stuff chain sends for these documents and question."""
+    context = "\n\n".join(doc.page_content for doc in docs)
+    messages = prompt.format_prompt(context=context, question=query).to_messages()
+    return sum(count_tokens(message.content) for message in messages)
+
 
 # Define retrieval chain
-def retrieval_chain(query,retriever):
-    """Retrieves relevant context from the vector DB and uses LLM for answering queries."""
+def retrieval_chain(query, retriever, query_vector=None):
+    """
+    Retrieves relevant context from the vector DB and uses LLM for answering queries.
+    Reports the prompt size under "usage" so context cost is visible per request.
+    Pass query_vector when the query was already embedded, so retrieval does not embed it again.
+    """
     if retriever is None:
         raise ValueError("Retriever is not initialized.")
 
-    chain = RetrievalQA.from_chain_type(
-        llm=Model,
-        retriever=retriever,
-        chain_type="stuff",
-        memory=ConversationBufferMemory(memory_key="chat_history", return_messages=True),
-    )
-    return chain.invoke(query)
-
+    prompt, chain = stuff_chain()
+    # Context is selected here (not inside a retrieval chain) so its counters can be reported
+    selection = _select_context(query, retriever, query_vector)
+    docs = selection["documents"]
+    with _llm_call():
+        answer = chain.invoke({"context": docs, "question": query})
+    return {
+        "query": query,
+        "result": answer,
+        "sources": [{"text": doc.page_content, "metadata": doc.metadata} for doc in docs],
+        "usage": _usage(selection, _prompt_tokens(prompt, docs, query), retriever),
+    }
+
+
+def stream_retrieval_chain(query, retriever, query_vector=None):
+    """
+    Streams an answer: yields ("sources", [...]) once the context is retrieved, then ("usage", {...})
+    with the prompt size, then ("token", text) for each piece of the answer as the LLM generates it.
+    Uses the same stuff chain as retrieval_chain.
+    """
+    if retriever is None:
+        raise ValueError("Retriever is not initialized.")
 
+    prompt, chain = stuff_chain()
+    selection = _select_context(query, retriever, query_vector)
+    docs = selection["documents"]
+    yield "sources", [{"text": doc.page_content, "metadata": doc.metadata} for doc in docs]
+
+    yield "usage", _usage(selection, _prompt_tokens(prompt, docs, query), retriever)
+    started = time.perf_counter()
+    first = True
+    with _llm_call():
+        for text in chain.stream({"context": docs, "question": query}):
+            if text:
+                if first:
+                    metrics.observe("stage_seconds", time.perf_counter() - started, stage="llm_first_token")
+                    first = False
+                yield "token", text
+
+
+TABLE_PLAN_PROMPT = """You translate questions about a table into a JSON query. Use only these columns.
+{schema}
+
+Reply with one JSON object and nothing else:
+{{"filters": [{{"column": ..., "op": one of {ops}, "value": ...}}],
+ "group_by": [columns],
+ "aggregations": [{{"column": column or "*", "func": one of {funcs}}}],
+ "select": [columns, only when not aggregating],
+ "order_by": {{"column": column or an aggregation name like "sum(<column>)", "descending": true}},
+ "limit": number}}
+Leave out keys you do not need. Match filter values to the common values listed above.
+
+Question: {question}"""
+
+TABLE_ANSWER_PROMPT = """Answer the question using only this query result, computed over the full table.
+Query: {spec}
+Result:
+{result}
+
+Question: {question}
+Answer briefly:"""
+
+
+def _parse_json_object(text):
+    """Pulls the JSON object out of an LLM reply, skipping any <think> section and code fences."""
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("The model did not return a table query")
+    return json.loads(text[start:end + 1])
+
+
+def plan_table_query(question, stats):
+    """Asks the LLM for a structured query; it sees the column statistics, never the rows."""
+    prompt = TABLE_PLAN_PROMPT.format(
+        schema=describe_table(stats), ops=list(FILTER_OPS), funcs=list(AGGREGATIONS), question=question,
+    )
+    with _llm_call():
+        reply = get_model().invoke(prompt).content
+    return _parse_json_object(reply)
+
+
+def table_query_chain(question, table_id, stats, spec=None):
+    """
+    Answers a question about a stored table: the filters and aggregations run locally over the
+    Parquet table and only the (small) result goes to the LLM. Pass spec to skip the planning call.
+    """
+    if spec is None:
+        spec = plan_table_query(question, stats)
+    with metrics.stage("table_query"):
+        table = run_table_query(table_id, spec)
+    prompt = TABLE_ANSWER_PROMPT.format(spec=json.dumps(spec), result=format_result(table), question=question)
+    with _llm_call():
+        answer = get_model().invoke(prompt).content
+    return {"query": question, "result": answer, "table_query": spec, "table": table}
@@ -1,17 +1,27 @@
 import os
-import shutil
-from fastapi import FastAPI, UploadFile, File, Form
-from services.pdf_transcript import extract_pdf_transcript
+import json
+import time
+import hashlib
+from fastapi import FastAPI, UploadFile, File, Form, Header, Depends, Request
+from fastapi.responses import PlainTextResponse, FileResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from services.pdf_transcript import PDF_TEXT_ONLY
 from services.youtube_transcript import extract_transcript
-from main import final_texts, retrieval_chain
-from services.vector_store import get_embeddings, vector_store, retriver_data
-from main import filter_complex_metadata
-from langchain.schema import Document
-from services.whatsapp import extract_whatsapp_chat
-from langchain_pinecone import Pinecone
-from services.pinecone_init import create_pinecone_index
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from services.excel import preprocessing_func
+from main import retrieval_chain, stream_retrieval_chain, get_retriever, table_query_chain, get_model, stuff_chain
+from services.vector_store import get_embeddings
+from langchain_core.documents import Document
+from services.vector_backend import check_worker_backends, get_vector_store, get_store_namespace
+from services.answer_cache import answer_cache
+from services.hybrid_search import HYBRID_SEARCH, is_keyword_query
+from services.embedding_cache import get_embedding_cache
+from services.session_store import DEFAULT_SESSION, get_session_value, get_session_values, set_session_value, set_session_values, get_cached_result, set_cached_result, has_cached_result, fail_orphaned_jobs
+from services.upload_store import save_upload
+from services.ingestion import sync_documents, document_key
+from services.table_store import get_table_stats
+from services.jobs import submit_job, complete_job, get_job, shutdown_jobs, pdf_job, excel_job, whatsapp_job
+from services.chunks import chunk_documents, load_tokenizer, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_UNIT
+from services import metrics, profiler, warmup
+from sse_starlette.sse import EventSourceResponse
 import warnings
 import uvicorn
 warnings.filterwarnings("ignore")
@@ -21,65 +31,177 @@ warnings.filterwarnings("ignore")
 app = FastAPI()
 
 
-#chunk the text
-def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> dict:
-    """
-    Splits text into smaller overlapping chunks for better processing.
-    
-    Args:
-        text (str): The input text to be chunked
-        chunk_size (int): Maximum size of each chunk in characters
-        chunk_overlap (int): Number of characters to overlap between chunks         
-        
-    Returns:
-        dict: Dictionary containing the text chunks and the number of chunks
-    """
+#profile a sample of requests (and any slower than PROFILE_SLOW_MS) into the on-disk profile ring buffer
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    if not profiler.PROFILING_ENABLED or request.url.path.startswith("/profiles"):
+        return await call_next(request)
+    size = request.headers.get("content-length")
+    profile = profiler.start_profile(f"{request.method} {request.url.path}", int(size) if size and size.isdigit() else None)
+    if profile is None:
+        return await call_next(request)
     try:
-        # Initialize text splitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        
-        # Split text into chunks
-        chunks = text_splitter.split_text(text)
-        return chunks
-        
-    except Exception as e:
-        print(f"Error chunking text: {e}")
-        return {"error": f"Failed to chunk text: {e}"}
+        response = await call_next(request)
+    except Exception:
+        await run_in_threadpool(profile.finish, 500)
+        raise
+    body = response.body_iterator
+
+    # The profile ends when the body is sent, so streamed answers are covered too
+    async def profiled_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            route = getattr(request.scope.get("route"), "path", None)
+            await run_in_threadpool(profile.finish, response.status_code, route)
+
+    response.body_iterator = profiled_body()
+    return response
 
 
+#time every request, count it per route and status, and report its stage timings in a Server-Timing header
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if not metrics.METRICS_ENABLED:
+        return await call_next(request)
+    timings = metrics.start_request()
+    start = time.perf_counter()
+    with metrics.in_flight(work="http_requests"):
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    # The route template keeps the label set bounded (unknown paths share one label)
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    metrics.observe("request_seconds", elapsed, path=path)
+    metrics.inc("requests_total", path=path, status=response.status_code)
+    response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed)
+    return response
+
+
+# The key of the extracted text ("<key>_result" for "pdf_text", "transcript", "whatsapp_text", "excel_text";
+# the text itself is in the extraction cache), the id of the document it came from ("<key>_document": the
+# upload's sha256) and the active namespace are kept per session in the shared session store, so any
+# worker process can serve any session. The vectors are shared by workers on the pinecone and segments
+# backends (see check_worker_backends).
+# Clients send an X-Session-Id header; requests without one share the "default" session.
+def get_session_id(x_session_id: str = Header(None)) -> str:
+    return x_session_id or DEFAULT_SESSION
+
+
+#vector store of the namespace the session last embedded into
+def get_active_vector_store(session_id: str):
+    active = get_session_value(session_id, "active_namespace")
+    if active is None:
+        return None
+    return get_vector_store(get_embeddings(), active["user_id"], active["is_private"])
+
+
+
+@app.on_event("startup")
+def check_vector_backends():
+    check_worker_backends()
+
+
+@app.on_event("startup")
+def fail_stale_jobs():
+    # Jobs of an API process that died (crash, restart) would otherwise stay queued or running forever
+    fail_orphaned_jobs()
+
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    shutdown_jobs()
+
+
+# Providers and heavy libraries load on first use; these steps load them ahead of traffic (see /ready)
+def _warm_embeddings():
+    if get_embeddings() is None:
+        raise ValueError("Embedding client could not be created (is GOOGLE_API_KEY set?)")
+
+
+def _warm_libraries(*modules):
+    def warm():
+        for module in modules:
+            __import__(module)
+    return warm
+
+
+warmup.register("llm", get_model)
+warmup.register("prompts", stuff_chain)
+warmup.register("tokenizer", load_tokenizer)
+warmup.register("embeddings", _warm_embeddings)
+warmup.register("vector_store", lambda: get_vector_store(get_embeddings()))
+warmup.register("pdf", _warm_libraries("pymupdf", "pymupdf4llm"))
+warmup.register("tables", _warm_libraries("pandas", "pyarrow.parquet"))
+
+
+@app.on_event("startup")
+def warm_providers():
+    if warmup.WARMUP_ON_STARTUP:
+        warmup.start_warmup()
+
+
+#readiness probe: 503 while providers are warming; warm=true starts warming them in the background
+@app.get("/ready")
+async def ready(warm: bool = False):
+    if warm:
+        warmup.start_warmup()
+    status = warmup.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 
-# Store extracted text globally
-extracted_data = {"pdf_text": None, "transcript": None, "whatsapp_text": None, "excel_text": None}
-retrieved_vector = None  # Global retriever
+#point the session at a stored extraction result (kept once, in the extraction cache) and the id of its document
+def save_extracted(session_id: str, key: str, document_id: str, result_key: str):
+    set_session_values(session_id, {f"{key}_result": result_key, f"{key}_document": document_id})
 
 
+#the session's extracted result for key; sessions written before results were stored by reference hold it inline
+def load_extracted(extracted_data: dict, key: str):
+    result_key = extracted_data.get(f"{key}_result")
+    if result_key is not None:
+        return get_cached_result(result_key)
+    return extracted_data.get(key)
+
+
+#store the upload content-addressed and extract it on the job pool, unless the same bytes were extracted before
+async def start_extraction(file: UploadFile, kind: str, job_func, session_id: str, session_key: str, *options, cache_tag: str = None) -> dict:
+    # Streamed to disk and hashed in a thread so the event loop is not blocked
+    digest, file_location = await run_in_threadpool(save_upload, file)
+    # cache_tag names settings the result depends on besides the job options (e.g. the chunk size)
+    result_key = ":".join([kind, digest, *map(str, options), *([cache_tag] if cache_tag else [])])
+    cached = await run_in_threadpool(has_cached_result, result_key)
+    if cached:
+        await run_in_threadpool(save_extracted, session_id, session_key, digest, result_key)
+        job_id = await run_in_threadpool(complete_job, kind, result_key, session_id)
+        return {"message": f"{kind} already processed", "job_id": job_id, "cached": True, "upload_id": digest}
+
+    # Extraction runs on the job worker pool; poll /jobs/{job_id} for progress, and fetch the extracted
+    # text once with include_result. The result is stored once under result_key; session and job refer to it.
+    job_id = submit_job(kind, job_func, file_location, *options, session_id=session_id, result_key=result_key,
+                        on_done=lambda result: save_extracted(session_id, session_key, digest, result_key))
+    return {"message": f"{kind} queued for processing", "job_id": job_id, "cached": False, "upload_id": digest}
+
 
 #fr pdf transcript download
 @app.post("/pdf")
-async def preprocess_pdf(file: UploadFile = File(...)):
-    save_dir = "temp_files"
-    os.makedirs(save_dir, exist_ok=True)
-    file_location = os.path.join(save_dir, file.filename)
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    pdf_text = extract_pdf_transcript(file_location)
-    extracted_data["pdf_text"] = pdf_text  # Save extracted text globally
-    return {"message": "PDF processed successfully", "text": pdf_text}
+async def preprocess_pdf(file: UploadFile = File(...), text_only: bool = PDF_TEXT_ONLY, session_id: str = Depends(get_session_id)):
+    # The job returns chunks, so results cached under other chunk settings are not reused
+    return await start_extraction(file, "pdf", pdf_job, session_id, "pdf_text", text_only,
+                                  cache_tag=f"chunks-{CHUNK_UNIT}-{CHUNK_SIZE}-{CHUNK_OVERLAP}")
 
 
 
 
 #fr youtube transcript download
 @app.post("/youtube")
-async def process_youtube(url: str = Form(...)):
-    transcript = extract_transcript(url)
-    extracted_data["transcript"] = transcript  # Save transcript globally
+async def process_youtube(url: str = Form(...), session_id: str = Depends(get_session_id)):
+    transcript = await run_in_threadpool(extract_transcript, url)
+    # Save the transcript and point the session at it; the video URL identifies its document
+    document_id = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    result_key = f"youtube:{document_id}"
+    await run_in_threadpool(set_cached_result, result_key, transcript)
+    await run_in_threadpool(save_extracted, session_id, "transcript", document_id, result_key)
     return {"message": "YouTube transcript processed successfully", "text": transcript}
 
 
@@ -87,118 +209,229 @@ async def process_youtube(url: str = Form(...)):
 
 #for load embeddings and vector store
 @app.post("/embedding_vector_store_whatsapp")
-async def embedding_vector_store_whatsapp(file: UploadFile = File(...)):
-    save_dir = "temp_files"
-    os.makedirs(save_dir, exist_ok=True)
-    file_location = os.path.join(save_dir, file.filename)
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    whatsapp_text = extract_whatsapp_chat(file_location)
-    extracted_data["whatsapp_text"] = whatsapp_text if whatsapp_text is not None else []
-    # Ensure at least one source of text is available
-    if not whatsapp_text:
-        return {"error": "No WhatsApp text available for processing."}
-    # Convert whatsapp_text to a string
-    whatsapp_text_str = " ".join(whatsapp_text) if isinstance(whatsapp_text, list) else whatsapp_text
-    return {"message": "WhatsApp text processed successfully", "text": whatsapp_text_str}
+async def embedding_vector_store_whatsapp(file: UploadFile = File(...), session_id: str = Depends(get_session_id)):
+    # The stored file is named after its content hash; a bare .txt chat is named after the uploaded file instead
+    return await start_extraction(file, "whatsapp", whatsapp_job, session_id, "whatsapp_text", os.path.basename(file.filename or ""))
     
 
 #for excel file
 @app.post("/excel")
-async def process_excel(file: UploadFile = File(...)):
-    save_dir = "temp_files"
-    os.makedirs(save_dir, exist_ok=True)
-    file_location = os.path.join(save_dir, file.filename or "")
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    excel_text = preprocessing_func(file_location)
-    extracted_data["excel_text"] = excel_text if excel_text is not None else []
-    return {"message": "Excel processed successfully", "text": excel_text}
+async def process_excel(file: UploadFile = File(...), session_id: str = Depends(get_session_id)):
+    response = await start_extraction(file, "excel", excel_job, session_id, "excel_text", os.path.basename(file.filename or ""))
+    # The job stores the cleaned rows as a table named after the upload, queried by /table_query;
+    # only a description of the table is embedded
+    set_session_value(session_id, "excel_table", response["upload_id"])
+    return response
+
+
+#statistics of the session's spreadsheet table
+@app.get("/table_stats")
+async def table_stats(session_id: str = Depends(get_session_id)):
+    table_id = get_session_value(session_id, "excel_table")
+    stats = await run_in_threadpool(get_table_stats, table_id) if table_id else None
+    if stats is None:
+        return {"error": "No table available. Upload an Excel or CSV file and wait for its job to finish."}
+    return stats
+
+
+#answer aggregation/filter questions over the spreadsheet by computing them locally instead of retrieving row chunks
+@app.post("/table_query")
+async def table_query(query: str = Form(...), spec: str = Form(None), session_id: str = Depends(get_session_id)):
+    table_id = get_session_value(session_id, "excel_table")
+    stats = await run_in_threadpool(get_table_stats, table_id) if table_id else None
+    if stats is None:
+        return {"error": "No table available. Upload an Excel or CSV file and wait for its job to finish."}
+    try:
+        # An explicit JSON query spec skips the planning call to the LLM
+        result = await run_in_threadpool(table_query_chain, query, table_id, stats, json.loads(spec) if spec else None)
+    except ValueError as e:
+        return {"error": f"Failed to run table query: {e}"}
+    return {"message": "Table query processed successfully", "retriever": result}
+
+
+#status and progress of a background job; include_result=true adds its result once it is done
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, include_result: bool = False):
+    job = await run_in_threadpool(get_job, job_id, include_result)
+    if job is None:
+        return {"error": f"Job '{job_id}' not found."}
+    return job
 
 
 
 @app.post("/embedding_vector_store_final_text")
-async def embedding_vector_store_final_text(user_id: str = None, is_private: bool = False):
+async def embedding_vector_store_final_text(user_id: str = None, is_private: bool = False, background: bool = False, session_id: str = Depends(get_session_id)):
     """
     Processes extracted text from PDF, YouTube transcript, or WhatsApp, 
-    generates embeddings, and stores them in Pinecone.
+    generates embeddings, and stores them in the configured vector backend.
     
     Args:
         user_id (str, optional): User ID for private RAG.
         is_private (bool, optional): Whether to use private RAG.
+        background (bool, optional): Return a job id immediately and embed in the background.
 
     Returns:
-        dict: Success message or error details.
+        dict: Success message or error details (or the job id when background is set).
     """
-    global retrieved_vector
+    if background:
+        # Runs on a thread, not a job worker process, because the local backend keeps vectors in this process
+        job_id = submit_job("embedding", store_embeddings, session_id, user_id, is_private, in_process=False, session_id=session_id)
+        return {"message": "Embedding queued", "job_id": job_id}
+    return await run_in_threadpool(store_embeddings, session_id, user_id, is_private)
+
+
+def store_embeddings(session_id: str, user_id: str = None, is_private: bool = False, progress=None) -> dict:
+    """Chunks the session's extracted text, embeds it and stores it; blocking, so called off the event loop."""
     # Ensure at least one text source is available
-    pdf_text = extracted_data.get("pdf_text")
-    transcript = extracted_data.get("transcript")
-    whatsapp_text = extracted_data.get("whatsapp_text")
-    excel_text  = extracted_data.get("excel_text")
+    extracted_data = get_session_values(session_id)
+    pdf_text = load_extracted(extracted_data, "pdf_text")
+    transcript = load_extracted(extracted_data, "transcript")
+    whatsapp_text = load_extracted(extracted_data, "whatsapp_text")
+    excel_text  = load_extracted(extracted_data, "excel_text")
 
     # Process WhatsApp text if available
     if not any([pdf_text, transcript, whatsapp_text, excel_text]):
         return {"error": "No text available for processing. Upload a PDF or provide a YouTube URL."}
-    # Convert lists to strings (handling None values safely)
-    def text_to_string(text):
-        if isinstance(text, list):
-            return " ".join([item.get("text", "") if isinstance(item, dict) else str(item) for item in text])
-        return text or ""
-
-    pdf_text = text_to_string(pdf_text)
-    transcript = text_to_string(transcript)
-    whatsapp_text = text_to_string(whatsapp_text)
-    excel_text = text_to_string([excel_text])
-
-
-    # Combine all texts into a single list of documents
-    final_texts = [pdf_text, transcript, whatsapp_text, excel_text]
-    final_texts = [text.strip() for text in final_texts if text.strip()]  # Remove empty strings
-    # Chunk the combined texts
-    chunked_texts = []
-    for text in final_texts:
-        chunks = chunk_text(text)
-        if chunks:  
-            chunked_texts.extend(chunks)
-    
-    final_texts = chunked_texts  # Replace original texts with chunked versions
-
-    if not final_texts:
+    # Chunk ids are scoped to the document, so each upload only ever replaces its own chunks
+    def key_of(session_key, source, text):
+        document_id = extracted_data.get(f"{session_key}_document")
+        if document_id is None:
+            # Sessions written before documents had ids: identify the document by its content
+            document_id = hashlib.sha256(json.dumps(text, sort_keys=True).encode("utf-8")).hexdigest()
+        return document_key(source, document_id)
+
+    # The transcript is chunked whole and converted into LangChain Document format
+    documents_by_key = {}
+    chunks = chunk_documents([{"text": transcript, "metadata": {"source": "youtube"}}] if transcript else [])
+    if chunks:
+        documents_by_key[key_of("transcript", "youtube", transcript)] = [
+            Document(page_content=chunk["text"], metadata=chunk["metadata"]) for chunk in chunks
+        ]
+    # PDFs (chunked page by page in the job, so every chunk keeps its page number), WhatsApp chats and
+    # spreadsheet descriptions arrive already chunked
+    for session_key, source, chunks in (("pdf_text", "pdf", pdf_text), ("whatsapp_text", "whatsapp", whatsapp_text), ("excel_text", "excel", excel_text)):
+        if chunks:
+            documents_by_key[key_of(session_key, source, chunks)] = [
+                Document(page_content=chunk["text"], metadata=chunk["metadata"]) for chunk in chunks if chunk.get("text")
+            ]
+
+    if not documents_by_key:
         return {"error": "Final texts are empty, cannot proceed with vector storage."}
 
-    # Convert text into LangChain Document format
-    documents = [Document(page_content=text, metadata={"source": "uploaded_data"}) for text in final_texts]
-
-    # Get Pinecone index & namespace
+    # Get the vector store for the public or private namespace (Pinecone or local, see VECTOR_BACKEND)
     try:
-        pinecone_info = create_pinecone_index(user_id, is_private)
-        index = pinecone_info["index"]
-        namespace = pinecone_info["namespace"]
+        embedding_function = get_embeddings()
+        vector_store = get_vector_store(embedding_function, user_id, is_private)
     except Exception as e:
-        return {"error": f"Failed to initialize Pinecone index: {e}"}
+        return {"error": f"Failed to initialize vector store: {e}"}
 
     try:
-        # Initialize Pinecone vector store
-        embedding_function = get_embeddings()
-        vector_store = Pinecone(index, embedding_function, namespace=namespace)
-        # Store documents in Pinecone
-        vector_store.add_documents(documents)
-        retrieved_vector = vector_store  # Set retriever
-
-        return {"message": "Embeddings, vector store, and final text processed successfully"}
+        # Embed and store only new chunks (deterministic ids), then delete chunks these documents no longer have
+        stats = sync_documents(vector_store, documents_by_key, progress=progress)
+        if stats["failed_batches"] and not stats["stored"]:
+            return {"error": "Failed to embed and store any chunks.", "stats": stats}
+        set_session_value(session_id, "active_namespace", {"user_id": user_id, "is_private": is_private})  # Set retriever
+        if stats["added"] or stats["deleted"]:
+            # Answers cached for this namespace may be stale now that it holds new documents
+            answer_cache.invalidate(get_store_namespace(vector_store))
+
+        return {"message": "Embeddings, vector store, and final text processed successfully", "stats": stats}
     except Exception as e:
-        return {"error": f"Failed to create Pinecone vector store: {e}"}
+        return {"error": f"Failed to create vector store: {e}"}
+
 
 
+#answer a query from the semantic answer cache, or run the retrieval chain and cache its answer
+def answer_query(query: str, vector_store, token_budget: int = None) -> tuple:
+    if HYBRID_SEARCH and is_keyword_query(query):
+        # Keyword queries are served from the keyword index; skipping the cache avoids embedding them
+        return retrieval_chain(query, get_retriever(vector_store, token_budget)), False
+    namespace = get_store_namespace(vector_store)
+    with metrics.stage("query_embedding"):
+        query_vector = vector_store.embeddings.embed_query(query)
+    with metrics.stage("answer_cache"):
+        # Read before retrieval: an answer is not cached if the namespace changes while it is generated
+        generation = answer_cache.generation(namespace)
+        cached = answer_cache.lookup(namespace, query_vector, token_budget, generation)
+    if cached is not None:
+        return {**cached, "query": query}, True
+    result = retrieval_chain(query, get_retriever(vector_store, token_budget), query_vector)
+    answer_cache.store(namespace, query_vector, result, token_budget, generation)
+    return result, False
+
 
 @app.post("/retrieval_chat")
-async def retrieval(query: str = Form(...)):
-    if retrieved_vector is None:
+async def retrieval(query: str = Form(...), token_budget: int = Form(None), session_id: str = Depends(get_session_id)):
+    vector_store = await run_in_threadpool(get_active_vector_store, session_id)
+    if vector_store is None:
+        return {"error": "Retriever is not initialized. Run '/embedding_vector_store_final_text' first."}
+    result, cached = await run_in_threadpool(answer_query, query, vector_store, token_budget)  # Perform retrieval off the event loop
+    return {"message": "Retrieval processed successfully", "retriever": result, "cached": cached}
+
+#stream the retrieved sources, then the answer tokens, as server-sent events
+@app.post("/retrieval_chat_stream")
+async def retrieval_stream(query: str = Form(...), token_budget: int = Form(None), session_id: str = Depends(get_session_id)):
+    vector_store = await run_in_threadpool(get_active_vector_store, session_id)
+    if vector_store is None:
         return {"error": "Retriever is not initialized. Run '/embedding_vector_store_final_text' first."}
-    retriever = retrieved_vector.as_retriever(search_kwargs={"k": 1})
-    result = retrieval_chain(query,retriever)  # Perform retrieval
-    return {"message": "Retrieval processed successfully", "retriever": result}
+
+    def events():
+        try:
+            # Sync generator: sse-starlette iterates it in a threadpool, so the event loop is not blocked
+            namespace = get_store_namespace(vector_store)
+            keyword_only = HYBRID_SEARCH and is_keyword_query(query)
+            query_vector = cached = generation = None
+            if not keyword_only:
+                with metrics.stage("query_embedding"):
+                    query_vector = vector_store.embeddings.embed_query(query)
+                with metrics.stage("answer_cache"):
+                    generation = answer_cache.generation(namespace)
+                    cached = answer_cache.lookup(namespace, query_vector, token_budget, generation)
+            if cached is not None:
+                yield {"event": "sources", "data": json.dumps(cached.get("sources", []))}
+                yield {"event": "token", "data": json.dumps(cached.get("result", ""))}
+                yield {"event": "done", "data": json.dumps({"cached": True})}
+                return
+            sources, tokens, usage = [], [], None
+            for event, data in stream_retrieval_chain(query, get_retriever(vector_store, token_budget), query_vector):
+                if event == "sources":
+                    sources = data
+                elif event == "usage":
+                    usage = data
+                elif event == "token":
+                    tokens.append(data)
+                yield {"event": event, "data": json.dumps(data)}
+            if query_vector is not None:
+                answer = {"query": query, "result": "".join(tokens), "sources": sources, "usage": usage}
+                answer_cache.store(namespace, query_vector, answer, token_budget, generation)
+            yield {"event": "done", "data": json.dumps({"cached": False})}
+        except Exception as e:
+            yield {"event": "error", "data": json.dumps(str(e))}
+
+    return EventSourceResponse(events())
+
+#hit rates and sizes of the embedding and answer caches
+@app.get("/cache_stats")
+async def cache_stats():
+    return {"embeddings": get_embedding_cache().stats(), "answers": answer_cache.stats()}
+
+#per-stage latency histograms, item counts, upstream errors and in-flight gauges of this worker process
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+#newest request profiles (endpoint, duration, input size, sample count), newest first
+@app.get("/profiles")
+async def profiles(limit: int = 50):
+    return {"profiles": await run_in_threadpool(profiler.list_profiles, limit)}
+
+#download one profile as collapsed stacks (flamegraph.pl / speedscope), or its metadata with format=json
+@app.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str = "folded"):
+    path = profiler.profile_path(profile_id, ".json" if format == "json" else ".folded")
+    if path is None:
+        return {"error": f"Profile '{profile_id}' not found."}
+    return FileResponse(path, filename=os.path.basename(path), media_type="application/json" if format == "json" else "text/plain")
 
 # Run the FastAPI server
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+#this file caches answers for repeated and near-duplicate questions per namespace
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from services.session_store import get_namespace_generation, bump_namespace_generation
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity for a hit
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+class SemanticAnswerCache:
+    """
+    Stores answers keyed by namespace, token budget and query embedding. A new query hits when its
+    embedding is within the similarity threshold of a cached query in the same namespace with the
+    same budget.
+
+    The answers live in this process, but each namespace has a generation counter in the shared
+    session store that is bumped when its documents change. Lookups compare it with the generation
+    the cached answers were computed at, so an ingest on any worker invalidates every worker's answers.
+
+    Args:
+        threshold (float): Minimum cosine similarity for a hit
+        max_entries (int): Answers kept across all namespaces before the least recently used is evicted
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # entry id -> ((namespace, token_budget), normalized vector, answer)
+        self._matrices = {}  # (namespace, token_budget) -> (entry ids, stacked vectors), rebuilt after changes
+        self._generations = {}  # namespace -> generation the cached answers belong to
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matrix(self, scope: tuple):
+        if scope not in self._matrices:
+            ids = [entry_id for entry_id, entry in self._entries.items() if entry[0] == scope]
+            vectors = np.stack([self._entries[entry_id][1] for entry_id in ids]) if ids else None
+            self._matrices[scope] = (ids, vectors)
+        return self._matrices[scope]
+
+    def _drop(self, namespace: str) -> None:
+        for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry[0][0] == namespace]:
+            del self._entries[entry_id]
+        for scope in [scope for scope in self._matrices if scope[0] == namespace]:
+            del self._matrices[scope]
+
+    def _sync_generation(self, namespace: str, generation: int) -> None:
+        """Drops the namespace's answers when another worker (or this one) changed its documents."""
+        if self._generations.get(namespace) != generation:
+            self._drop(namespace)
+            self._generations[namespace] = generation
+
+    def generation(self, namespace: str) -> int:
+        """Current generation of a namespace; pass it to lookup() and store() for one query."""
+        return get_namespace_generation(namespace)
+
+    def lookup(self, namespace: str, query_vector, token_budget: int = None, generation: int = None):
+        """Returns the cached answer closest to the query, or None if nothing is within the threshold."""
+        if generation is None:
+            generation = self.generation(namespace)
+        query_vector = self._normalize(query_vector)
+        with self._lock:
+            self._sync_generation(namespace, generation)
+            ids, vectors = self._matrix((namespace, token_budget))
+            if vectors is not None:
+                scores = vectors @ query_vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    self._entries.move_to_end(ids[best])
+                    return self._entries[ids[best]][2]
+            self.misses += 1
+            return None
+
+    def store(self, namespace: str, query_vector, answer, token_budget: int = None, generation: int = None) -> None:
+        """
+        Caches an answer. generation is the one the answer was retrieved at (see generation()); the answer
+        is discarded when the namespace has changed since, as it may be built from outdated documents.
+        """
+        current = self.generation(namespace)
+        if generation is not None and generation != current:
+            return
+        scope = (namespace, token_budget)
+        with self._lock:
+            self._sync_generation(namespace, current)
+            self._entries[self._next_id] = (scope, self._normalize(query_vector), answer)
+            self._next_id += 1
+            self._matrices.pop(scope, None)
+            while len(self._entries) > self.max_entries:
+                _, (evicted_scope, _, _) = self._entries.popitem(last=False)
+                self._matrices.pop(evicted_scope, None)
+
+    def invalidate(self, namespace: str) -> None:
+        """Drops every answer for a namespace in every worker, e.g. after new documents were added to it."""
+        generation = bump_namespace_generation(namespace)
+        with self._lock:
+            self._sync_generation(namespace, generation)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+        }
+
+
+answer_cache = SemanticAnswerCache()
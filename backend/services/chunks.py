@@ -1,34 +1,189 @@
 #this file is used to chunk the text into smaller chunks
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import os
+import re
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from services import metrics
 
-def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> dict:
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "chars")  # "chars" or "tokens"
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "cl100k_base")  # tiktoken encoding used for token budgets
+# tiktoken downloads an encoding on first use; keeping it here lets later (and offline) runs load it from disk
+TIKTOKEN_CACHE_DIR = os.getenv("TIKTOKEN_CACHE_DIR", "cache/tiktoken")
+
+# Break points, best first: paragraph break, line break, space (as the recursive splitter's separators)
+_separators = ("\n\n", "\n", " ")
+_whitespace = re.compile(r"\s+")
+# Fallback token boundaries when tiktoken is not installed: words, numbers and single punctuation marks
+_approximate_tokens = re.compile(r"\w+|[^\w\s]")
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+_encoding_error = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """
+    Loads the tiktoken encoding once per process, or returns False when tokens have to be approximated.
+    Concurrent first callers wait for the one load (and download) instead of each starting their own.
+    """
+    global _encoding, _encoding_error
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    os.environ.setdefault("TIKTOKEN_CACHE_DIR", TIKTOKEN_CACHE_DIR)
+                    _encoding = tiktoken.get_encoding(CHUNK_TOKENIZER)
+                except Exception as e:
+                    # Not installed, or the encoding is not cached and cannot be downloaded (offline)
+                    logger.warning("tiktoken unavailable, approximating tokens: %s", e)
+                    _encoding_error = str(e) or type(e).__name__
+                    _encoding = False
+    return _encoding
+
+
+def load_tokenizer() -> None:
+    """Warm-up step: loads the encoding ahead of the first request, raising if tokens will be approximated."""
+    if not _get_encoding():
+        raise RuntimeError(f"tiktoken unavailable, approximating tokens: {_encoding_error}")
+
+
+def _token_offsets(text: str) -> list:
+    """Start offset of every token in text, in one pass."""
+    encoding = _get_encoding()
+    if encoding:
+        _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+        return offsets
+    return [match.start() for match in _approximate_tokens.finditer(text)]
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in text, counted the same way as token chunk budgets."""
+    return len(_token_offsets(text)) if text else 0
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of text with at most max_tokens tokens, counted as count_tokens() does."""
+    offsets = _token_offsets(text) if text else []
+    return text if len(offsets) <= max_tokens else text[:offsets[max(max_tokens, 0)]].rstrip()
+
+
+def _break_before(text: str, start: int, half: int, end_limit: int):
+    """
+    Position of the best separator in text[start:end_limit]: the strongest one in the second half,
+    else the last one in the first half, else None. Uses str.rfind, so only this window is scanned.
+    """
+    for separator in _separators:
+        position = text.rfind(separator, half, end_limit)
+        if position != -1:
+            return position
+    for separator in _separators:
+        position = text.rfind(separator, start + 1, half)
+        if position != -1:
+            return position
+    return None
+
+
+def _spans(text: str, size: int, overlap: int, unit: str):
+    """
+    Yields (start, end) character spans of the chunks. Every chunk ends at the best break point
+    that keeps it within the budget and at least half full (and past the end of the previous chunk),
+    falling back to a hard cut. Each step only scans the window of the current chunk, so the work is
+    linear in the text length.
+    """
+    if size <= 0 or not 0 <= overlap < size:
+        raise ValueError(f"Chunk overlap ({overlap}) must be at least 0 and smaller than the chunk size ({size})")
+    n = len(text)
+    if unit == "tokens":
+        offsets = _token_offsets(text)
+
+        def limit(start):
+            # Character position after `size` tokens from start
+            first = bisect_right(offsets, start) - 1
+            last = max(first, 0) + size
+            return offsets[last] if last < len(offsets) else n
+
+        def back(end):
+            last = bisect_left(offsets, end)
+            return offsets[max(last - overlap, 0)] if offsets else 0
+    elif unit == "chars":
+        limit = lambda start: start + size
+        back = lambda end: end - overlap
+    else:
+        raise ValueError(f"Unknown chunk unit: {unit}")
+
+    leading = _whitespace.match(text)
+    start = leading.end() if leading else 0
+    resume = 0  # first non-space position after the previous chunk
+    while start < n:
+        end_limit = limit(start)
+        if end_limit >= n:
+            end = len(text.rstrip())
+            if end > resume:
+                yield start, end
+            return
+        # A break before the text that follows the previous chunk would yield a chunk inside that one
+        floor = max(start, resume)
+        position = _break_before(text, floor, max(start + (end_limit - start) // 2, floor + 1), end_limit)
+        end = position if position is not None else start
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > floor:
+            next_piece = _whitespace.match(text, position).end()
+        else:
+            end = next_piece = end_limit  # no usable break point: hard cut
+        yield start, end
+        resume = next_piece
+        # The next chunk starts overlap units back, on a word boundary, but always moves forward
+        gap = _whitespace.search(text, max(back(end), start + 1), end)
+        start = max(gap.end() if gap and gap.end() < end else next_piece, start + 1)
+        leading = _whitespace.match(text, start)
+        start = leading.end() if leading else start
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP, unit: str = CHUNK_UNIT) -> list:
     """
     Splits text into smaller overlapping chunks for better processing.
-    
+
     Args:
         text (str): The input text to be chunked
-        chunk_size (int): Maximum size of each chunk in characters
-        chunk_overlap (int): Number of characters to overlap between chunks         
-        
+        chunk_size (int): Maximum size of each chunk, in characters or tokens
+        chunk_overlap (int): Amount of text repeated between consecutive chunks, in the same unit
+        unit (str): "chars" or "tokens"
+
     Returns:
-        dict: Dictionary containing the text chunks and the number of chunks
-    """
-    try:
-        # Initialize text splitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        
-        # Split text into chunks
-        chunks = text_splitter.split_text(text)
-        return chunks
-        
-    except Exception as e:
-        print(f"Error chunking text: {e}")
-        return []
+        list: The text chunks
+    """
+    return [text[start:end] for start, end in _spans(text or "", chunk_size, chunk_overlap, unit)]
 
 
+def chunk_documents(documents, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP, unit: str = CHUNK_UNIT) -> list:
+    """
+    Chunks many documents in one call. Each chunk keeps its document's metadata (e.g. the PDF page
+    number) and adds its position in the document.
 
+    Args:
+        documents: Iterable of {"text", "metadata"} dicts or plain strings
+
+    Returns:
+        list: {"text", "metadata": {..., "chunk_index", "start_offset", "end_offset"}} dicts
+    """
+    chunks = []
+    with metrics.stage("chunking"):
+        for document in documents:
+            if isinstance(document, str):
+                document = {"text": document, "metadata": {}}
+            text = document.get("text") or ""
+            metadata = document.get("metadata") or {}
+            for index, (start, end) in enumerate(_spans(text, chunk_size, chunk_overlap, unit)):
+                chunks.append({
+                    "text": text[start:end],
+                    "metadata": {**metadata, "chunk_index": index, "start_offset": start, "end_offset": end},
+                })
+    metrics.add_items("chunks", len(chunks))
+    return chunks
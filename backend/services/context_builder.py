@@ -0,0 +1,194 @@
+#this file selects and packs retrieved chunks into a context that fits a token budget
+import os
+import re
+import json
+from typing import Any
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+from services.chunks import count_tokens, truncate_tokens
+from services.hybrid_search import HYBRID_SEARCH, hybrid_candidates, is_keyword_query
+from services.vector_backend import fetch_vectors, search_by_vector
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # tokens of retrieved text per prompt
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))  # chunks retrieved before selection
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # 1.0 = relevance only, 0.0 = diversity only
+DUPLICATE_OVERLAP = 0.5  # chunks sharing at least this share of their word 5-grams with a chosen chunk are dropped
+
+_offset_keys = ("chunk_index", "start_offset", "end_offset")
+_words = re.compile(r"\w+")
+
+
+def _shingles(text: str) -> set:
+    words = _words.findall(text.lower())
+    return {" ".join(words[i:i + 5]) for i in range(max(len(words) - 4, 1))}
+
+
+def _term_similarity(texts: list) -> np.ndarray:
+    """Jaccard similarity of the word sets, used when the candidates' vectors are not known."""
+    terms = [set(_words.findall(text.lower())) for text in texts]
+    matrix = np.eye(len(texts), dtype=np.float32)
+    for i in range(len(texts)):
+        for j in range(i + 1, len(texts)):
+            union = len(terms[i] | terms[j])
+            matrix[i, j] = matrix[j, i] = len(terms[i] & terms[j]) / union if union else 0.0
+    return matrix
+
+
+def mmr_order(relevance, similarity, lambda_mult: float = MMR_LAMBDA) -> list:
+    """
+    Orders candidates by maximal marginal relevance: each step picks the candidate with the best
+    lambda * relevance - (1 - lambda) * (highest similarity to an already picked candidate).
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    remaining = list(range(len(relevance)))
+    order = []
+    closest = np.zeros(len(relevance), dtype=np.float32)
+    while remaining:
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * closest[remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        order.append(best)
+        closest = np.maximum(closest, similarity[best])
+    return order
+
+
+def _span_key(doc):
+    """Chunks from the same document (same metadata apart from their position) share a key."""
+    metadata = doc.metadata
+    if not all(key in metadata for key in ("start_offset", "end_offset")):
+        return None
+    return json.dumps({key: value for key, value in metadata.items() if key not in _offset_keys}, sort_keys=True, default=str)
+
+
+def _trim_overlap(doc, chosen_spans: list):
+    """
+    Removes the part of a chunk that a chosen chunk of the same document already covers (the chunker's overlap).
+    Returns the remaining (text, start_offset, end_offset), or None if the chunk is covered entirely.
+    """
+    # Pinecone returns numeric metadata as floats, and floats cannot slice the text
+    start, end = int(doc.metadata["start_offset"]), int(doc.metadata["end_offset"])
+    text = doc.page_content
+    for chosen_start, chosen_end in chosen_spans:
+        if chosen_start <= start and end <= chosen_end:
+            return None
+        if chosen_start <= start < chosen_end:
+            text, start = text[chosen_end - start:], chosen_end
+        elif chosen_start < end <= chosen_end:
+            text, end = text[:chosen_start - start], chosen_start
+    return (text, start, end) if text.strip() else None
+
+
+def build_context(candidates: list, vectors: list = None, query_vector=None, token_budget: int = CONTEXT_TOKEN_BUDGET, lambda_mult: float = MMR_LAMBDA) -> dict:
+    """
+    Picks chunks for the prompt: orders the candidates by maximal marginal relevance, drops
+    near-duplicates, trims the overlap between neighbouring chunks of one document, and packs
+    chunks until the token budget is spent. Nothing is embedded here.
+
+    Args:
+        candidates (list): Retrieved Documents, best first
+        vectors (list): The candidates' stored vectors, in the same order; without a vector for every
+                        candidate their similarity is the overlap of their words
+        query_vector: The query's embedding, for relevance; without it the retrieval rank is used
+        token_budget (int): Tokens of chunk text allowed in the context
+
+    Returns:
+        dict: {"documents": chosen Documents, "context_tokens": int, "candidates": int, "dropped_duplicates": int}
+    """
+    if not candidates:
+        return {"documents": [], "context_tokens": 0, "candidates": 0, "dropped_duplicates": 0}
+    if vectors is not None and all(vector is not None for vector in vectors):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        similarity = matrix @ matrix.T
+    else:
+        matrix = None
+        similarity = _term_similarity([doc.page_content for doc in candidates])
+    if matrix is not None and query_vector is not None:
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        relevance = matrix @ (query_vector / max(np.linalg.norm(query_vector), 1e-12))
+    else:
+        relevance = 1.0 / (np.arange(len(candidates)) + 1.0)
+
+    chosen, spans, shingles = [], {}, []
+    used = dropped = 0
+    for index in mmr_order(relevance, similarity, lambda_mult):
+        doc = candidates[index]
+        key = _span_key(doc)
+        trimmed = _trim_overlap(doc, spans.get(key, [])) if key else (doc.page_content, None, None)
+        text = trimmed[0] if trimmed else None
+        doc_shingles = _shingles(text) if text else set()
+        if text is None or any(len(doc_shingles & other) >= DUPLICATE_OVERLAP * len(doc_shingles) for other in shingles):
+            dropped += 1
+            continue
+        tokens = count_tokens(text)
+        if used + tokens > token_budget:
+            if chosen:
+                continue  # a smaller chunk further down may still fit
+            # The best chunk alone is over the budget: its beginning is better than an empty context
+            text = truncate_tokens(text, token_budget)
+            if not text:
+                continue
+            tokens = count_tokens(text)
+            if key:
+                trimmed = (text, trimmed[1], trimmed[1] + len(text))
+        used += tokens
+        shingles.append(doc_shingles)
+        if key:
+            spans.setdefault(key, []).append((trimmed[1], trimmed[2]))
+        if text != doc.page_content:
+            metadata = {**doc.metadata, "start_offset": trimmed[1], "end_offset": trimmed[2]} if key else doc.metadata
+            doc = doc.model_copy(update={"page_content": text, "metadata": metadata})
+        chosen.append(doc)
+    return {"documents": chosen, "context_tokens": used, "candidates": len(candidates), "dropped_duplicates": dropped}
+
+
+def retrieve_candidates(vector_store, query: str, candidates: int = CONTEXT_CANDIDATES, query_vector=None) -> tuple:
+    """
+    Retrieves candidate chunks together with their stored vectors, so selection does not embed them.
+
+    Returns:
+        tuple: (Documents best first, their vectors in the same order or None when the query was only
+        answered by the keyword index). Keyword hits the vector search did not return are fetched by id.
+    """
+    if HYBRID_SEARCH:
+        docs, vectors = hybrid_candidates(vector_store, query, k=candidates, candidates=candidates, query_vector=query_vector)
+    else:
+        if query_vector is None:
+            query_vector = vector_store.embeddings.embed_query(query)
+        hits = search_by_vector(vector_store, query_vector, k=candidates)
+        docs, vectors = [doc for doc, _ in hits], {doc.id: vector for doc, vector in hits}
+    if not vectors:
+        return docs, None
+    missing = [doc.id for doc in docs if doc.id not in vectors]
+    if missing:
+        vectors.update(fetch_vectors(vector_store, missing))
+    return docs, [vectors.get(doc.id) for doc in docs]
+
+
+class ContextRetriever(BaseRetriever):
+    """
+    Retriever that returns a token-budgeted, diversified set of chunks instead of a fixed k.
+
+    Args:
+        vector_store: Store returned by get_vector_store()
+        token_budget (int): Tokens of chunk text handed to the LLM
+        candidates (int): Chunks retrieved before selection
+    """
+
+    vector_store: Any
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    candidates: int = CONTEXT_CANDIDATES
+    lambda_mult: float = MMR_LAMBDA
+
+    def select(self, query: str, query_vector=None) -> dict:
+        """
+        Runs retrieval and context selection, returning build_context()'s documents and counters.
+        query_vector is the query's embedding when the caller already computed it (e.g. for the answer cache).
+        """
+        # Keyword queries are served without an embedding call; selection keeps it that way
+        if query_vector is None and not (HYBRID_SEARCH and is_keyword_query(query)):
+            query_vector = self.vector_store.embeddings.embed_query(query)
+        docs, vectors = retrieve_candidates(self.vector_store, query, self.candidates, query_vector)
+        return build_context(docs, vectors, query_vector, self.token_budget, self.lambda_mult)
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list:
+        return self.select(query)["documents"]
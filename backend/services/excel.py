@@ -1,37 +1,322 @@
-    # preprocessing_func
+#this file streams Excel/CSV uploads in row batches and cleans them: sparse columns are dropped, missing
+#values filled with the column mean (numbers) or mode (other values) and duplicate rows removed
+import os
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
 
-def preprocessing_func(file_path):
-    """
-    Preprocess financial data from an Excel or CSV file.
-    - Loads the data
-    - Drops columns with more than 80% missing values
-    - Fills missing numerical values with the mean
-    - Fills missing categorical values with the mode
-    - Removes duplicate rows
-    - Converts data into a structured format
-    """
-    # Load the file based on extension
-    if file_path.endswith('.xlsx'):
-        df = pd.read_excel(file_path)
-    elif file_path.endswith('.csv'):
-        df = pd.read_csv(file_path)
+EXCEL_BATCH_ROWS = int(os.getenv("EXCEL_BATCH_ROWS", "50000"))
+# Values tracked per column for its mode; the counters of rarer values are dropped beyond this
+EXCEL_MODE_CANDIDATES = int(os.getenv("EXCEL_MODE_CANDIDATES", "10000"))
+# Row hashes kept in memory for de-duplication; larger sorted runs are spilled to temporary files
+EXCEL_DEDUPE_MEMORY_ROWS = int(os.getenv("EXCEL_DEDUPE_MEMORY_ROWS", "1000000"))
+
+
+def _unique_columns(header):
+    """Names header cells the way pandas does: blanks become "Unnamed: i", repeats get ".1", ".2"."""
+    columns, seen = [], {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None or str(name).strip() == "" else str(name)
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen.setdefault(name, 0)
+        columns.append(name)
+    return columns
+
+
+def iter_table_batches(file_path, batch_rows=EXCEL_BATCH_ROWS):
+    """
+    Reads an Excel or CSV file in DataFrames of at most batch_rows rows.
+    CSV uses the multithreaded pyarrow reader when it is installed and yields every column as text
+    (see _parse_text); Excel is streamed with openpyxl in read-only mode.
+    """
+    if file_path.endswith('.csv'):
+        try:
+            import pyarrow.csv as pa_csv
+        except ImportError:
+            pa_csv = None
+        if pa_csv is not None:
+            import csv
+            import pyarrow as pa
+            with open(file_path, newline="", encoding="utf-8", errors="replace") as file:
+                columns = _unique_columns(next(csv.reader(file), []))
+            # Every column is read as text: pyarrow would fix the types from the first block and fail on a
+            # later cell that does not fit. The statistics pass types the columns over the whole file.
+            reader = pa_csv.open_csv(
+                file_path,
+                read_options=pa_csv.ReadOptions(block_size=1 << 24, column_names=columns, skip_rows=1),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types={col: pa.string() for col in columns},
+                    strings_can_be_null=True,  # empty cells are missing, as in pandas
+                ),
+            )
+            pending = []
+            for record_batch in reader:
+                pending.append(record_batch.to_pandas())
+                if sum(len(df) for df in pending) >= batch_rows:
+                    yield pd.concat(pending, ignore_index=True)
+                    pending = []
+            if pending:
+                yield pd.concat(pending, ignore_index=True)
+            return
+        yield from pd.read_csv(file_path, chunksize=batch_rows, dtype=str)
+    elif file_path.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            columns = _unique_columns(next(rows, []))
+            batch = []
+            for row in rows:
+                batch.append(row[:len(columns)])
+                if len(batch) >= batch_rows:
+                    yield pd.DataFrame.from_records(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+        finally:
+            workbook.close()
     else:
         raise ValueError("Unsupported file format. Please provide an Excel (.xlsx) or CSV (.csv) file.")
 
-    # Drop columns with more than 80% missing values
-    df.dropna(thresh=0.2 * len(df), axis=1, inplace=True)
 
-    # Fill missing values
-    df.fillna(df.mean(numeric_only=True), inplace=True)  # Numerical: Fill with mean
-    
-    for col in df.select_dtypes(include=['object']).columns:  # Categorical: Fill with mode
-        df[col] = df[col].fillna(df[col].mode()[0])
+def _column_kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_integer_dtype(series):
+        return "int"
+    if pd.api.types.is_numeric_dtype(series):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    return "string"
+
+
+def _parse_text(series):
+    """
+    Types a CSV column read as text the way pandas.read_csv would: numbers (integers when every value
+    is one), then true/false, otherwise strings.
+
+    Returns:
+        tuple: (kind, series converted to that kind)
+    """
+    present = series.notna()
+    values = series[present].str.strip()
+    if values.empty:
+        return "string", series
+    try:
+        numbers = pd.to_numeric(values)
+    except (ValueError, TypeError):
+        lowered = values.str.lower()
+        if lowered.isin(("true", "false")).all():
+            return "bool", (lowered == "true").reindex(series.index)
+        return "string", series
+    return ("int" if pd.api.types.is_integer_dtype(numbers) else "float"), numbers.reindex(series.index)
+
+
+def _convert_text(series, kind):
+    """Converts a CSV column read as text to the kind settled for the whole file."""
+    if kind in ("int", "float"):
+        return pd.to_numeric(series.str.strip())
+    if kind == "bool":
+        return series.str.strip().str.lower().map({"true": True, "false": False})
+    return series
+
+
+class _ValueCounts:
+    """
+    Misra-Gries summary of a column's values: at most capacity counters. When a batch brings more
+    distinct values, every counter is lowered by the (capacity + 1)-th largest count and those at zero
+    are dropped, so any value in more than 1/(capacity + 1) of the rows is kept. Counts stay exact
+    until the first such pruning.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or EXCEL_MODE_CANDIDATES
+        self.counts = {}
+        self.exact = True
+
+    def update(self, series) -> None:
+        counts = self.counts
+        for value, count in series.value_counts().items():
+            counts[value] = counts.get(value, 0) + int(count)
+        if len(counts) > self.capacity:
+            cut = sorted(counts.values(), reverse=True)[self.capacity]
+            self.counts = {value: count - cut for value, count in counts.items() if count > cut}
+            self.exact = False
+
+    def count_candidates(self, series) -> None:
+        """Adds exact counts of the values already tracked (the second pass of a pruned summary)."""
+        counts = self.counts
+        present = series[series.isin(list(counts))]
+        for value, count in present.value_counts().items():
+            counts[value] += int(count)
+
+    def mode(self):
+        if not self.counts:
+            return None
+        top = max(self.counts.values())
+        candidates = [value for value, count in self.counts.items() if count == top]
+        try:
+            return min(candidates)  # pandas' mode() returns the smallest of tied values
+        except TypeError:
+            return candidates[0]
+
+
+def _column_statistics(file_path, batch_rows):
+    """
+    Collects what cleaning needs: row count, non-null counts, sums for the numeric means and value
+    counts for the modes of the other columns. Also settles one type per column ("int", "float",
+    "datetime", "bool" or "string") so every batch is cast the same way.
+
+    Reads the file once, and a second time only for columns whose mode is not settled by the first
+    read: a column whose batches disagree on the type (its mode is taken over the raw values) and a
+    column with more than EXCEL_MODE_CANDIDATES distinct values (the surviving candidates are counted
+    exactly). The mode is exact unless a column has both; then it is the most frequent candidate.
+    Memory is bounded by the columns times EXCEL_MODE_CANDIDATES, not by the rows.
+    """
+    text = file_path.endswith('.csv')
+    rows = 0
+    non_null, sums, numeric_counts, value_counts, batch_kinds = {}, {}, {}, {}, {}
+    for df in iter_table_batches(file_path, batch_rows):
+        rows += len(df)
+        for col in df.columns:
+            series = df[col]
+            non_null[col] = non_null.get(col, 0) + int(series.notna().sum())
+            kind, series = _parse_text(series) if text else (_column_kind(series), series)
+            # Batches without values in a column say nothing about its type
+            if series.notna().any():
+                batch_kinds.setdefault(col, set()).add(kind)
+            if kind in ("int", "float"):
+                sums[col] = sums.get(col, 0.0) + float(series.sum())
+                numeric_counts[col] = numeric_counts.get(col, 0) + int(series.count())
+            else:
+                value_counts.setdefault(col, _ValueCounts()).update(series)
+    keep = [col for col in non_null if non_null[col] >= 0.2 * rows]
+    fill, kinds = {}, {}
+    for col in keep:
+        seen = batch_kinds.get(col, set())
+        if seen and seen <= {"int", "float"}:
+            # Missing values are filled with the mean, which makes an integer column float (as in pandas)
+            kinds[col] = "int" if seen == {"int"} and non_null[col] == rows else "float"
+        elif len(seen) == 1:
+            kinds[col] = next(iter(seen))
+        else:
+            kinds[col] = "string"
+    # A column whose batches disagree on the type ends up as text, so its values are counted again raw
+    recount = [col for col in keep if kinds[col] == "string" and batch_kinds.get(col, set()) - {"string"}]
+    verify = [
+        col for col in keep
+        if col not in recount and kinds[col] not in ("int", "float") and col in value_counts and not value_counts[col].exact
+    ]
+    if recount or verify:
+        for col in recount:
+            value_counts[col] = _ValueCounts()
+        for col in verify:
+            value_counts[col].counts = dict.fromkeys(value_counts[col].counts, 0)
+        for df in iter_table_batches(file_path, batch_rows):
+            for col in recount:
+                value_counts[col].update(df[col])
+            for col in verify:
+                series = _convert_text(df[col], kinds[col]) if text else df[col]
+                value_counts[col].count_candidates(series)
+    for col in keep:
+        if kinds[col] in ("int", "float") and numeric_counts.get(col):
+            fill[col] = sums[col] / numeric_counts[col]
+        elif col in value_counts and value_counts[col].counts:
+            fill[col] = value_counts[col].mode()
+    return rows, keep, fill, kinds
+
+
+class _SeenRows:
+    """
+    Set of 64-bit row hashes for de-duplication, kept as sorted NumPy runs (8 bytes per row instead of
+    about 70 in a Python set). Small runs are merged as they pile up, so each hash is copied O(log rows)
+    times; runs of EXCEL_DEDUPE_MEMORY_ROWS hashes or more are written to a temporary file and memory-mapped.
+    """
+
+    def __init__(self, memory_rows=None):
+        self.memory_rows = memory_rows or EXCEL_DEDUPE_MEMORY_ROWS
+        self.runs = []
+        self._spill_dir = None
+
+    def contains(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    def add(self, hashes) -> None:
+        """Adds hashes that are distinct and not yet in the set."""
+        if not len(hashes):
+            return
+        run = np.sort(hashes)
+        while self.runs and not isinstance(self.runs[-1], np.memmap) and len(self.runs[-1]) <= len(run):
+            run = np.sort(np.concatenate([self.runs.pop(), run]))
+        if len(run) >= self.memory_rows:
+            run = self._spill(run)
+        self.runs.append(run)
+
+    def _spill(self, run):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="excel-dedupe-")
+        spilled = np.memmap(
+            os.path.join(self._spill_dir, f"run-{len(self.runs)}.u64"), dtype=run.dtype, mode="w+", shape=run.shape,
+        )
+        spilled[:] = run
+        spilled.flush()
+        return spilled
+
+    def close(self) -> None:
+        self.runs = []
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+
+_casts = {"int": "int64", "float": "float64", "bool": "bool", "datetime": "datetime64[ns]", "string": "str"}
+
+
+def iter_clean_batches(file_path, batch_rows=EXCEL_BATCH_ROWS):
+    """
+    Cleans an Excel or CSV file batch by batch: drops columns with more than 80% missing values, fills
+    missing numbers with the column mean and other missing values with the column mode, and removes
+    duplicate rows across the whole file. The file is read two or three times (see _column_statistics).
+
+    Memory holds one batch of batch_rows rows, EXCEL_MODE_CANDIDATES counters per column and the
+    de-duplication hashes: 8 bytes per distinct row, in memory up to EXCEL_DEDUPE_MEMORY_ROWS rows at a
+    time and in memory-mapped temporary files beyond that.
+
+    Yields:
+        DataFrame: Cleaned rows with one dtype per column across batches, indexed by 1-based data row number
+    """
+    _, keep, fill, kinds = _column_statistics(file_path, batch_rows)
+    seen_rows = _SeenRows()
+    try:
+        yield from _clean_batches(file_path, batch_rows, keep, fill, kinds, seen_rows)
+    finally:
+        seen_rows.close()
 
-    # Remove duplicate rows
-    df.drop_duplicates(inplace=True)
 
-    # Convert to dictionary format for LLM processing
-    finance_data = df.to_dict(orient='records')
-    
-    return finance_data
\ No newline at end of file
+def _clean_batches(file_path, batch_rows, keep, fill, kinds, seen_rows):
+    text = file_path.endswith('.csv')
+    row_offset = 0
+    for df in iter_table_batches(file_path, batch_rows):
+        df = df.reindex(columns=keep)
+        if text:
+            df = df.apply(lambda series: _convert_text(series, kinds[series.name]))
+        df.index = range(row_offset + 1, row_offset + len(df) + 1)
+        row_offset += len(df)
+        df = df.fillna(fill).astype({col: _casts[kind] for col, kind in kinds.items()})
+        # Remove duplicate rows across the whole file by hashing each row
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        first_in_batch = ~pd.Series(hashes).duplicated().to_numpy()
+        fresh = first_in_batch & ~seen_rows.contains(hashes)
+        seen_rows.add(hashes[fresh])
+        df = df[fresh]
+        if not df.empty:
+            yield df
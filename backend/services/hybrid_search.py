@@ -0,0 +1,89 @@
+#this file combines BM25 keyword search with vector search using reciprocal rank fusion
+import os
+import re
+from typing import Any
+from langchain_core.retrievers import BaseRetriever
+from services import lexical_index
+from services.vector_backend import get_store_namespace, search_by_vector
+
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # results taken from each search before fusion
+RRF_K = int(os.getenv("RRF_K", "60"))  # rank constant of reciprocal rank fusion
+
+# Identifier-like terms: contain a digit (invoice numbers, dates) or are short all-caps words (tickers)
+_identifier = re.compile(r"^(?=.*\d)[\w\-/.#]+$|^[A-Z]{2,6}$")
+
+
+def is_keyword_query(query: str) -> bool:
+    """
+    True for queries the keyword index answers on its own: a quoted phrase, or only identifier-like
+    terms such as INV-2024-0012. These skip the embedding call; short natural-language queries
+    ("late fees", "who paid") still go through vector search, where synonyms and paraphrases match.
+    """
+    query = query.strip()
+    if len(query) > 2 and query[0] == query[-1] == '"':
+        return True
+    words = query.split()
+    return bool(words) and all(_identifier.match(word) for word in words)
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> list:
+    """
+    Fuses ranked result lists: each document scores sum(1 / (k + rank)) over the lists it appears in.
+
+    Args:
+        rankings (list): Lists of Documents, best first
+        k (int): Rank constant; larger values flatten the difference between top ranks
+
+    Returns:
+        list: (Document, fused score) pairs, best first
+    """
+    scores, documents = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            # The chunk text identifies a chunk across both indexes
+            key = doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, doc)
+    return [(documents[key], score) for key, score in sorted(scores.items(), key=lambda item: -item[1])]
+
+
+def hybrid_candidates(vector_store, query: str, k: int = 4, candidates: int = HYBRID_CANDIDATES, query_vector=None) -> tuple:
+    """
+    Returns the top k Documents for a query from the keyword and vector indexes of the store's namespace,
+    and the stored vectors of the vector hits (id -> vector). Keyword queries with keyword hits are
+    answered without embedding the query; otherwise query_vector is used when the caller has it.
+    """
+    keyword_hits = [doc for doc, _ in lexical_index.search(get_store_namespace(vector_store), query, max(candidates, k))]
+    if keyword_hits and is_keyword_query(query):
+        return keyword_hits[:k], {}
+    if query_vector is None:
+        query_vector = vector_store.embeddings.embed_query(query)
+    hits = search_by_vector(vector_store, query_vector, k=max(candidates, k))
+    vectors = {doc.id: vector for doc, vector in hits}
+    vector_hits = [doc for doc, _ in hits]
+    if not keyword_hits:
+        return vector_hits[:k], vectors
+    return [doc for doc, _ in reciprocal_rank_fusion([keyword_hits, vector_hits])[:k]], vectors
+
+
+def hybrid_search(vector_store, query: str, k: int = 4, candidates: int = HYBRID_CANDIDATES) -> list:
+    """Returns the top k Documents for a query, see hybrid_candidates()."""
+    return hybrid_candidates(vector_store, query, k, candidates)[0]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    LangChain retriever over hybrid_search(), used by the RetrievalQA chain in place of the vector store retriever.
+
+    Args:
+        vector_store: Store returned by get_vector_store()
+        k (int): Documents returned per query
+    """
+
+    vector_store: Any
+    k: int = 4
+    candidates: int = HYBRID_CANDIDATES
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list:
+        return hybrid_search(self.vector_store, query, k=self.k, candidates=self.candidates)
@@ -0,0 +1,199 @@
+#this file embeds and upserts chunks in concurrent batches
+import os
+import time
+import uuid
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.vector_backend import add_embeddings, list_ids, delete_ids, get_store_namespace
+from services import lexical_index, metrics
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+INGEST_MAX_RPS = float(os.getenv("INGEST_MAX_RPS", "0"))  # 0 disables the ceiling
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "3"))
+
+
+class RateLimiter:
+    """Spaces calls so that no more than max_rps start per second across all threads."""
+
+    def __init__(self, max_rps: float):
+        self.interval = 1.0 / max_rps if max_rps > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _with_retries(func, max_retries: int, limiter: RateLimiter = None, service: str = "upstream"):
+    """Calls func, retrying with exponential backoff; re-raises the last error."""
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.wait()
+        try:
+            with metrics.in_flight(work=service):
+                return func()
+        except Exception as e:
+            if attempt == max_retries:
+                metrics.upstream_error(service)
+                raise
+            metrics.upstream_retry(service)
+            delay = min(2 ** attempt * 0.5, 8.0)
+            print(f"Batch failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def ingest_documents(
+    vector_store,
+    documents: list,
+    ids: list = None,
+    batch_size: int = INGEST_BATCH_SIZE,
+    concurrency: int = INGEST_CONCURRENCY,
+    max_rps: float = INGEST_MAX_RPS,
+    max_retries: int = INGEST_MAX_RETRIES,
+    progress=None,
+) -> dict:
+    """
+    Embeds documents in batches on a pool of workers and upserts each batch as soon as it is embedded,
+    so the upsert of one batch overlaps the embedding of the next ones.
+
+    Args:
+        vector_store: Vector store returned by get_vector_store()
+        documents (list): LangChain Documents to store
+        ids (list, optional): One id per document; random ids are used when omitted
+        batch_size (int): Chunks per embedding call
+        concurrency (int): Embedding calls in flight at once
+        max_rps (float): Ceiling on embedding requests per second (0 = unlimited)
+        max_retries (int): Retries per failed batch before it is reported as failed
+        progress (JobProgress, optional): Receives chunks_embedded/chunks_total as batches are stored
+
+    Returns:
+        dict: Chunk, batch and failure counts plus throughput
+    """
+    start = time.perf_counter()
+    ids = list(ids) if ids else [str(uuid.uuid4()) for _ in documents]
+    batches = [
+        (ids[i:i + batch_size], documents[i:i + batch_size])
+        for i in range(0, len(documents), max(batch_size, 1))
+    ]
+    embeddings = vector_store.embeddings
+    limiter = RateLimiter(max_rps)
+    stored = 0
+    failed_batches = []
+
+    def embed(batch_docs):
+        texts = [doc.page_content for doc in batch_docs]
+        with metrics.stage("embedding"):
+            return _with_retries(lambda: embeddings.embed_documents(texts), max_retries, limiter, service="embedding")
+
+    namespace = get_store_namespace(vector_store)
+
+    def upsert(batch_ids, batch_docs, vectors):
+        with metrics.stage("upsert"):
+            _with_retries(lambda: add_embeddings(vector_store, batch_ids, batch_docs, vectors), max_retries, service="vector_store")
+        # The keyword index only gets chunks the vector store accepted, so both hold the same chunks
+        with metrics.stage("lexical_index"):
+            lexical_index.index_documents(namespace, batch_ids, batch_docs)
+        return len(batch_docs)
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as embed_pool, \
+            ThreadPoolExecutor(max_workers=max(concurrency, 1)) as upsert_pool:
+        # Each task runs in a copy of the caller's context so its stage timings reach the request's header
+        embed_futures = {embed_pool.submit(contextvars.copy_context().run, embed, docs): (n, batch_ids, docs) for n, (batch_ids, docs) in enumerate(batches)}
+        upsert_futures = {}
+        for future in as_completed(embed_futures):
+            n, batch_ids, docs = embed_futures[future]
+            try:
+                vectors = future.result()
+            except Exception as e:
+                print(f"Embedding batch {n} failed: {e}")
+                failed_batches.append(n)
+                continue
+            upsert_futures[upsert_pool.submit(contextvars.copy_context().run, upsert, batch_ids, docs, vectors)] = n
+        for future in as_completed(upsert_futures):
+            try:
+                stored += future.result()
+            except Exception as e:
+                print(f"Upsert batch {upsert_futures[future]} failed: {e}")
+                failed_batches.append(upsert_futures[future])
+            if progress:
+                progress.update(chunks_embedded=stored, chunks_total=len(documents))
+
+    elapsed = time.perf_counter() - start
+    metrics.add_items("chunks_embedded", stored)
+    return {
+        "chunks": len(documents),
+        "stored": stored,
+        "batches": len(batches),
+        "failed_batches": sorted(failed_batches),
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(stored / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def document_key(source: str, document_id: str) -> str:
+    """Key of one ingested document, e.g. "pdf#<upload sha256>"; it prefixes the ids of all its chunks."""
+    return f"{source}#{document_id}"
+
+
+def chunk_id(document: str, text: str) -> str:
+    """Deterministic chunk id: the document key plus a hash of the chunk content."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+    return f"{document}#{digest}"
+
+
+def sync_documents(vector_store, documents_by_key: dict, progress=None, **ingest_kwargs) -> dict:
+    """
+    Brings the chunks of each document in the namespace in line with documents_by_key: only chunks
+    that are not stored yet are embedded and upserted, and stored chunks of that document that are no
+    longer produced (e.g. after a chunk size change) are deleted once the upsert succeeded. Other
+    documents, including other uploads of the same source type, are left untouched, so repeating an
+    ingest leaves the index the same size and ingesting a second document keeps the first.
+
+    Args:
+        vector_store: Vector store returned by get_vector_store()
+        documents_by_key (dict): {document_key(): list of Documents}
+        progress (JobProgress, optional): Passed on to ingest_documents()
+
+    Returns:
+        dict: ingest_documents() stats plus added/unchanged/deleted counts
+    """
+    namespace = get_store_namespace(vector_store)
+    new_documents, new_ids, stale = [], [], set()
+    unchanged = 0
+    for key, documents in documents_by_key.items():
+        wanted = {}
+        for doc in documents:
+            wanted.setdefault(chunk_id(key, doc.page_content), doc)
+        existing = list_ids(vector_store, f"{key}#")
+        stale |= existing - wanted.keys()
+        for doc_id, doc in wanted.items():
+            if doc_id in existing:
+                unchanged += 1
+            else:
+                new_ids.append(doc_id)
+                new_documents.append(doc)
+        # Chunks stored before the keyword index existed are added to it without re-embedding
+        stored = [doc_id for doc_id in wanted if doc_id in existing]
+        missing = set(stored) - lexical_index.indexed_ids(namespace, stored)
+        if missing:
+            lexical_index.index_documents(namespace, list(missing), [wanted[doc_id] for doc_id in missing])
+
+    stats = ingest_documents(vector_store, new_documents, ids=new_ids, progress=progress, **ingest_kwargs)
+    # Stale chunks are only removed once the new ones are all stored, so a failed ingest never leaves less than before
+    deleted = 0
+    if stale and not stats["failed_batches"]:
+        delete_ids(vector_store, stale)
+        lexical_index.remove_documents(namespace, stale)
+        deleted = len(stale)
+    stats.update(added=stats["stored"], unchanged=unchanged, deleted=deleted)
+    return stats
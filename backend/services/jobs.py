@@ -0,0 +1,215 @@
+#this file runs blocking ingestion work as background jobs and tracks their progress
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from services import metrics
+from services.session_store import create_job, update_job_progress, set_job_status, finish_job, get_job_record, set_cached_result
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(max((os.cpu_count() or 2) - 1, 1))))
+# Extra processes all jobs together may start (e.g. PDF page-range workers); shared by every job worker
+JOB_HELPER_PROCESSES = int(os.getenv("JOB_HELPER_PROCESSES", str(os.cpu_count() or 1)))
+
+_pools_lock = threading.Lock()
+_process_pool = None
+_thread_pool = None
+_helper_slots = None  # semaphore of JOB_HELPER_PROCESSES, set in each job worker process
+
+
+class JobProgress:
+    """
+    Progress reporter handed to job functions. Counters are written to the shared
+    session store, so they are visible from every API worker process.
+
+    Args:
+        job_id (str): Job being reported on
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    def update(self, **counters) -> None:
+        update_job_progress(self.job_id, counters)
+
+
+def _pools():
+    """Creates the worker pools on first use so importing this module stays cheap."""
+    global _process_pool, _thread_pool
+    with _pools_lock:
+        if _process_pool is None:
+            # spawn avoids forking the API process with its open connections and threads
+            context = multiprocessing.get_context("spawn")
+            _process_pool = ProcessPoolExecutor(
+                max_workers=JOB_WORKERS, mp_context=context,
+                initializer=_init_worker, initargs=(context.BoundedSemaphore(max(JOB_HELPER_PROCESSES, 1)),),
+            )
+            _thread_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+    return _process_pool, _thread_pool
+
+
+def _init_worker(helper_slots) -> None:
+    global _helper_slots
+    _helper_slots = helper_slots
+
+
+@contextmanager
+def helper_processes(wanted: int):
+    """
+    Reserves up to `wanted` helper processes from the budget shared by all job workers and yields how
+    many were granted (at least 1: the job's own process). Never waits, so a busy pool degrades to
+    serial work instead of stalling; outside a job worker there is no budget and `wanted` is granted.
+    """
+    if _helper_slots is None:
+        yield max(wanted, 1)
+        return
+    granted = 0
+    while granted < wanted and _helper_slots.acquire(block=False):
+        granted += 1
+    try:
+        yield max(granted, 1)
+    finally:
+        for _ in range(granted):
+            _helper_slots.release()
+
+
+def submit_job(kind: str, func, *args, on_done=None, in_process: bool = True, session_id: str = None, result_key: str = None) -> str:
+    """
+    Queues func(*args, progress) on the process pool (or a thread when in_process is False).
+
+    Args:
+        kind (str): Job type shown in the status, e.g. "pdf"
+        func: Top-level function taking the positional args plus a JobProgress
+        on_done: Called in the API process with the job result when it succeeds
+        in_process (bool): Run on the process pool; use False for work that must share API process state
+        session_id (str, optional): Session the job belongs to
+        result_key (str, optional): Store the result once under this extraction cache key (before on_done
+            runs) and keep only the key with the job, for results too large to copy around
+
+    Returns:
+        str: The job id
+    """
+    process_pool, thread_pool = _pools()
+    job_id = uuid.uuid4().hex
+    create_job(job_id, kind, session_id)
+    pool = process_pool if in_process else thread_pool
+    future = pool.submit(_run_in_worker if in_process else _run, func, args, job_id)
+
+    def _finish(future):
+        try:
+            result = future.result()
+            if in_process:
+                result, samples = result
+                metrics.merge(samples)
+            if result_key is not None:
+                set_cached_result(result_key, result)
+            if on_done:
+                on_done(result)
+            if result_key is not None:
+                finish_job(job_id, result_key=result_key)
+            else:
+                finish_job(job_id, result=result)
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            finish_job(job_id, error=str(e) or type(e).__name__)
+
+    future.add_done_callback(_finish)
+    return job_id
+
+
+def complete_job(kind: str, result_key: str, session_id: str = None) -> str:
+    """Records a job that is already finished, e.g. when a re-upload reuses the result stored under result_key."""
+    job_id = uuid.uuid4().hex
+    create_job(job_id, kind, session_id)
+    finish_job(job_id, result_key=result_key)
+    return job_id
+
+
+def _run(func, args, job_id: str):
+    set_job_status(job_id, "running")
+    progress = JobProgress(job_id)
+    progress.update(started=time.time())
+    return func(*args, progress)
+
+
+def _run_in_worker(func, args, job_id: str):
+    # A pool worker runs one job at a time, so everything it recorded since the last job belongs to this one
+    result = _run(func, args, job_id)
+    return result, metrics.drain()
+
+
+def get_job(job_id: str, include_result: bool = False) -> dict:
+    """Returns the status and progress of a job (plus its result when asked for and finished), or None if unknown."""
+    return get_job_record(job_id, include_result)
+
+
+def shutdown_jobs() -> None:
+    """Stops the worker pools; called when the API shuts down."""
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+    _process_pool = _thread_pool = None
+
+
+# Job functions run in pool workers, so they import their service lazily and take a JobProgress last
+
+def pdf_job(file_location: str, text_only: bool, progress: JobProgress):
+    from services.pdf_transcript import PDF_WORKERS, count_pdf_pages, iter_pdf_transcript
+    from services.chunks import chunk_documents
+    progress.update(pages_total=count_pdf_pages(file_location), pages_done=0)
+    # Each page is chunked as soon as it is extracted, so the job holds one page of text plus the chunks
+    chunks, pages_done = [], 0
+    with helper_processes(PDF_WORKERS) as workers, metrics.stage("pdf_extract"):
+        pages = iter_pdf_transcript(
+            file_location,
+            text_only=text_only,
+            workers=workers,
+            progress=lambda pages_done: progress.update(pages_done=pages_done),
+        )
+        for page in pages:
+            chunks.extend(chunk_documents([page]))
+            pages_done += 1
+    metrics.add_items("pdf_pages", pages_done)
+    return chunks
+
+
+def excel_job(file_location: str, upload_name: str, progress: JobProgress):
+    from services.excel import iter_clean_batches
+    from services.table_store import TableWriter, table_id_for, describe_table
+    from services.chunks import chunk_documents
+    # Rows are not embedded: the cleaned batches go straight into a Parquet table that /table_query
+    # computes over, so the job holds one batch at a time
+    name = upload_name or os.path.basename(file_location)
+    table = TableWriter(table_id_for(file_location), source=name)
+    rows_done = 0
+    try:
+        with metrics.stage("excel_preprocess"):
+            for df in iter_clean_batches(file_location):
+                table.write(df)
+                rows_done += len(df)
+                progress.update(rows_done=rows_done)
+            stats = table.close()
+    except Exception:
+        table.abort()
+        raise
+    metrics.add_items("excel_rows", rows_done)
+    # Only a description of the table is embedded, so retrieval can tell which spreadsheet holds what
+    summary = f"Spreadsheet {name}. Use a table query to compute over its rows.\n" + describe_table(stats)
+    chunks = chunk_documents([{
+        "text": summary,
+        "metadata": {"source": "excel", "file": name, "table_id": stats["table_id"], "rows": stats["rows"]},
+    }])
+    progress.update(rows_done=rows_done, chunks_done=len(chunks))
+    return chunks
+
+
+def whatsapp_job(file_location: str, upload_name: str, progress: JobProgress):
+    from services.whatsapp import extract_whatsapp_chat
+    with metrics.stage("whatsapp_parse"):
+        whatsapp_text = extract_whatsapp_chat(file_location, upload_name)
+    metrics.add_items("whatsapp_chunks", len(whatsapp_text or []))
+    progress.update(chunks_done=len(whatsapp_text or []))
+    return whatsapp_text
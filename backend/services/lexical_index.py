@@ -0,0 +1,128 @@
+#this file keeps a BM25 keyword index of the stored chunks per namespace (SQLite FTS5), updated at ingest time
+import os
+import re
+import json
+import hashlib
+import sqlite3
+import threading
+from langchain_core.documents import Document
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "cache/lexical.sqlite3")
+LEXICAL_MAX_QUERY_TERMS = 32
+
+_conn = None
+_conn_pid = None
+_lock = threading.Lock()
+_terms = re.compile(r"\w+", re.UNICODE)
+
+
+def _connection() -> sqlite3.Connection:
+    """Opens one connection per process (re-opened after a fork)."""
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        if os.path.dirname(LEXICAL_INDEX_PATH):
+            os.makedirs(os.path.dirname(LEXICAL_INDEX_PATH), exist_ok=True)
+        _conn = sqlite3.connect(LEXICAL_INDEX_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        # The namespace is an indexed column so a query only touches the postings of its namespace;
+        # it gets weight 0 in bm25() below, so only the chunk text is scored
+        _conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            " namespace, text, metadata UNINDEXED,"
+            " tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # Maps (namespace, chunk id) to the FTS rowid, so upserts and deletes are lookups, not scans
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_ids ("
+            " row INTEGER PRIMARY KEY,"
+            " namespace TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " UNIQUE (namespace, doc_id))"
+        )
+        _conn.commit()
+        _conn_pid = os.getpid()
+    return _conn
+
+
+def _namespace_token(namespace: str) -> str:
+    """Namespaces are stored as one opaque token so "public" can never match inside "user_public"."""
+    return "ns" + hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:20]
+
+
+def query_terms(query: str) -> list:
+    """Distinct lowercase word terms of a query, in order."""
+    return list(dict.fromkeys(term.lower() for term in _terms.findall(query)))[:LEXICAL_MAX_QUERY_TERMS]
+
+
+def _rows(conn, namespace: str, ids: list) -> dict:
+    """FTS rowids of the given chunk ids that are indexed in the namespace."""
+    found = {}
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        found.update(conn.execute(
+            f"SELECT doc_id, row FROM chunk_ids WHERE namespace = ? AND doc_id IN ({','.join('?' * len(batch))})",
+            [namespace, *batch],
+        ).fetchall())
+    return found
+
+
+def index_documents(namespace: str, ids: list, documents: list) -> None:
+    """Adds (or replaces) chunks in a namespace's index."""
+    token = _namespace_token(namespace)
+    with _lock:
+        conn = _connection()
+        existing = _rows(conn, namespace, list(ids))
+        conn.executemany("DELETE FROM chunks WHERE rowid = ?", [(row,) for row in existing.values()])
+        for doc_id, doc in zip(ids, documents):
+            row = existing.get(doc_id)
+            if row is None:
+                row = conn.execute("INSERT INTO chunk_ids (namespace, doc_id) VALUES (?, ?)", (namespace, doc_id)).lastrowid
+                existing[doc_id] = row
+            conn.execute(
+                "INSERT INTO chunks (rowid, namespace, text, metadata) VALUES (?, ?, ?, ?)",
+                (row, token, doc.page_content, json.dumps(doc.metadata, default=str)),
+            )
+        conn.commit()
+
+
+def remove_documents(namespace: str, ids) -> None:
+    with _lock:
+        conn = _connection()
+        rows = [(row,) for row in _rows(conn, namespace, list(ids)).values()]
+        conn.executemany("DELETE FROM chunks WHERE rowid = ?", rows)
+        conn.executemany("DELETE FROM chunk_ids WHERE row = ?", rows)
+        conn.commit()
+
+
+def indexed_ids(namespace: str, ids) -> set:
+    """Returns which of the given ids are already in the namespace's index."""
+    with _lock:
+        return set(_rows(_connection(), namespace, list(ids)))
+
+
+def search(namespace: str, query: str, k: int = 4) -> list:
+    """
+    BM25 keyword search within a namespace.
+
+    Returns:
+        list: (Document, score) pairs, best first; higher scores are better
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    # Terms are quoted so FTS5 operators in user input are treated as plain words
+    quoted = " OR ".join('"' + term + '"' for term in terms)
+    match = f"namespace : {_namespace_token(namespace)} AND text : ({quoted})"
+    with _lock:
+        rows = _connection().execute(
+            # bm25() weights follow the column order; it returns lower-is-better scores
+            "SELECT chunk_ids.doc_id, chunks.text, chunks.metadata, bm25(chunks, 0.0, 1.0) AS rank"
+            " FROM chunks JOIN chunk_ids ON chunk_ids.row = chunks.rowid"
+            " WHERE chunks MATCH ? ORDER BY rank LIMIT ?",
+            (match, k),
+        ).fetchall()
+    return [
+        (Document(id=doc_id, page_content=text, metadata=json.loads(metadata)), -rank)
+        for doc_id, text, metadata, rank in rows
+    ]
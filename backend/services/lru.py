@@ -0,0 +1,51 @@
+#this file holds a small thread-safe LRU cache for objects that are expensive to build
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that keeps the most recently used max_size entries.
+
+    Args:
+        max_size (int): Entries kept before the least recently used one is evicted
+    """
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get_or_create(self, key, build):
+        """Returns the cached value for key, building and caching it with build() on a miss."""
+        value = self.get(key)
+        if value is None:
+            # Built outside the lock; if two requests race, both values are valid and the last one is kept
+            value = build()
+            self.put(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
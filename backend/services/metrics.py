@@ -0,0 +1,196 @@
+#this file records per-stage latency, item counts, upstream errors and in-flight work, exported as Prometheus text
+import os
+import time
+import threading
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_PREFIX = "insightify"
+# Upper bounds (seconds) of the latency buckets: from cache lookups to long ingest jobs
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+HELP = {
+    "stage_seconds": "Duration of one pipeline stage",
+    "request_seconds": "Duration of one HTTP request",
+    "requests_total": "HTTP requests by route and status code",
+    "items_total": "Items processed (pages, rows, chunks, tokens, ...)",
+    "upstream_errors_total": "Failed calls to an upstream service (after retries for retried calls)",
+    "upstream_retries_total": "Retried calls to an upstream service",
+    "in_flight": "Requests or upstream calls currently running",
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {}    # (name, labels) -> value
+_gauges = {}      # (name, labels) -> value
+# Stage durations of the current request, for its Server-Timing header (None outside a request)
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Adds one observation to a latency histogram."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    index = bisect_left(STAGE_BUCKETS, seconds)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0] * (len(STAGE_BUCKETS) + 2)
+        series[index] += 1
+        series[-1] += seconds
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    """Adds amount to a counter."""
+    if not METRICS_ENABLED or not amount:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def add_items(item: str, amount: int) -> None:
+    inc("items_total", amount, item=item)
+
+
+def upstream_error(service: str) -> None:
+    inc("upstream_errors_total", service=service)
+
+
+def upstream_retry(service: str) -> None:
+    inc("upstream_retries_total", service=service)
+
+
+def _gauge_add(key, amount: int) -> None:
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + amount
+
+
+@contextmanager
+def in_flight(**labels):
+    """Counts the enclosed work in the in_flight gauge while it runs."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    key = ("in_flight", tuple(sorted(labels.items())))
+    _gauge_add(key, 1)
+    try:
+        yield
+    finally:
+        _gauge_add(key, -1)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the enclosed block as pipeline stage `name`: the duration goes to the stage histogram
+    and, inside a request, to that request's Server-Timing header. Exceptions propagate unchanged.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_seconds", elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            # Ingest batches of one request run on several threads
+            with _lock:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed(name: str):
+    """Decorator form of stage()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def start_request() -> dict:
+    """Starts collecting stage timings for the current request; returns the dict they are added to."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing(timings: dict, total: float) -> str:
+    """Server-Timing header value: one entry per stage plus the total, in milliseconds."""
+    entries = [f"{name.replace(' ', '_')};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def drain() -> dict:
+    """
+    Returns and clears this process's histograms and counters. Job pool workers send these back
+    with each job result so the API process can merge() them into the metrics it serves.
+    """
+    global _histograms, _counters
+    with _lock:
+        samples = {"histograms": _histograms, "counters": _counters}
+        _histograms, _counters = {}, {}
+    return samples
+
+
+def merge(samples: dict) -> None:
+    if not samples:
+        return
+    with _lock:
+        for key, values in samples.get("histograms", {}).items():
+            series = _histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                series[i] += value
+        for key, value in samples.get("counters", {}).items():
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    lines = []
+
+    def header(name, kind):
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+
+    for name in sorted({key[0] for key in histograms}):
+        header(name, "histogram")
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*STAGE_BUCKETS, "+Inf"), values):
+                cumulative += count
+                bucket_labels = _labels(labels, f'le="{bound}"')
+                lines.append(f"{METRICS_PREFIX}_{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{METRICS_PREFIX}_{name}_sum{_labels(labels)} {values[-1]:.6f}")
+            lines.append(f"{METRICS_PREFIX}_{name}_count{_labels(labels)} {cumulative}")
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({key[0] for key in series}):
+            header(name, kind)
+            for (metric, labels), value in sorted(series.items()):
+                if metric == name:
+                    lines.append(f"{METRICS_PREFIX}_{name}{_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
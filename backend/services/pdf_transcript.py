@@ -1,37 +1,145 @@
-import pymupdf4llm
-def extract_pdf_transcript(doc_path):
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from services import metrics
+# pymupdf and pymupdf4llm are imported inside the functions: the API process only needs the settings
+# below, and extraction runs in job workers
+
+PDF_TEXT_ONLY = os.getenv("PDF_TEXT_ONLY", "false").lower() == "true"
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))  # per document; jobs are also capped by JOB_HELPER_PROCESSES
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))  # smaller documents are extracted serially
+
+
+def count_pdf_pages(doc_path):
+    """Returns the number of pages in a PDF without extracting it."""
+    import pymupdf
+    with pymupdf.open(doc_path) as doc:
+        return doc.page_count
+
+
+def _iter_pages(doc, page_indexes, text_only, hdr_info):
+    for page_index in page_indexes:
+        if text_only:
+            text = doc[page_index].get_text("text", sort=True)
+        else:
+            import pymupdf4llm
+            md_pages = pymupdf4llm.to_markdown(
+                doc=doc,
+                pages=[page_index],
+                hdr_info=hdr_info,
+                page_chunks=True,
+                write_images=True,
+                image_path="images",
+                image_format="png",
+                dpi=300,
+                show_progress=False,
+            )
+            text = "".join(page.get("text", "") for page in md_pages)
+        yield {
+            "text": text,
+            "metadata": {
+                "page_num": page_index + 1,
+                "source": "pdf"
+            }
+        }
+
+
+def iter_pdf_pages(doc_path, text_only=PDF_TEXT_ONLY):
+    """
+    Yield the pages of a document one at a time so callers can start on page 1
+    while later pages are still being parsed; only the current page is held in memory.
+
+    Args:
+        doc_path (str): Path to the document file
+        text_only (bool): Skip markdown layout analysis and image rendering and return plain page text
+
+    Yields:
+        dict: {"text": ..., "metadata": {"page_num": ..., "source": "pdf"}} per page
+    """
+    import pymupdf
+    with pymupdf.open(doc_path) as doc:
+        # Header sizes are learned from the whole document once, as a single to_markdown call would
+        hdr_info = None
+        if not text_only:
+            import pymupdf4llm
+            hdr_info = pymupdf4llm.IdentifyHeaders(doc)
+        yield from _iter_pages(doc, range(doc.page_count), text_only, hdr_info)
+
+
+def _extract_page_range(doc_path, start, stop, text_only, hdr_info):
+    """Extracts pages [start, stop) in a worker process."""
+    import pymupdf
+    with pymupdf.open(doc_path) as doc:
+        return list(_iter_pages(doc, range(start, stop), text_only, hdr_info))
+
+
+def _iter_parallel(doc_path, page_count, text_only, workers, progress):
+    hdr_info = None
+    if not text_only:
+        import pymupdf
+        import pymupdf4llm
+        with pymupdf.open(doc_path) as doc:
+            hdr_info = pymupdf4llm.IdentifyHeaders(doc)
+    # Several ranges per worker so one slow range (e.g. image-heavy pages) does not hold up the rest
+    range_size = max(page_count // (workers * 4), 1)
+    ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+    pages_done = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(_extract_page_range, doc_path, start, stop, text_only, hdr_info) for start, stop in ranges]
+        # Ranges are handed on in page order as soon as they (and all earlier ones) are done
+        for future in futures:
+            pages = future.result()
+            pages_done += len(pages)
+            if progress:
+                progress(pages_done)
+            yield from pages
+
+
+def iter_pdf_transcript(doc_path, text_only=PDF_TEXT_ONLY, workers=PDF_WORKERS, progress=None):
     """
-    Load a document and convert it to markdown format with images
-    
+    Yield the pages of a document in page order. Documents with at least PDF_PARALLEL_MIN_PAGES
+    pages are split into page ranges and converted on a process pool; each range is yielded as
+    soon as it and the ranges before it are done.
+
     Args:
         doc_path (str): Path to the document file
-        
+        text_only (bool): Extract plain text only, without rendering images
+        workers (int): Worker processes for large documents (1 = always serial)
+        progress (callable, optional): Called with the number of pages extracted so far
+
+    Yields:
+        dict: {"text": ..., "metadata": {"page_num": ..., "source": "pdf"}} per page
+    """
+    page_count = count_pdf_pages(doc_path)
+    if workers > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+        yield from _iter_parallel(doc_path, page_count, text_only, min(workers, page_count), progress)
+        return
+    for pages_done, page in enumerate(iter_pdf_pages(doc_path, text_only=text_only), start=1):
+        if progress:
+            progress(pages_done)
+        yield page
+
+
+def extract_pdf_transcript(doc_path, text_only=PDF_TEXT_ONLY, workers=PDF_WORKERS, progress=None):
+    """
+    Load a document and convert it to markdown format with images, see iter_pdf_transcript().
+
+    Args:
+        doc_path (str): Path to the document file
+        text_only (bool): Extract plain text only, without rendering images
+        workers (int): Worker processes for large documents (1 = always serial)
+        progress (callable, optional): Called with the number of pages extracted so far
+
     Returns:
-        str: Markdown text with embedded images
+        list: Text and metadata for each page, in page order
     """
     try:
-        # Get the MD text
-        md_text_images = pymupdf4llm.to_markdown(
-            doc=doc_path,
-            page_chunks=True,
-            write_images=True,
-            image_path="images",
-            image_format="png",
-            dpi=300,
-        )
-        # Extract text and metadata from markdown
-        text_metadata = []
-        for page in md_text_images:
-            # Create dictionary for each page
-            page_dict = {
-                "text": page.get("text", ""),
-                "metadata": {
-                    "page_num": page.get("page"),
-                    "source": "pdf"
-                }
-            }
-            text_metadata.append(page_dict)    
-        return text_metadata
+        with metrics.stage("pdf_extract"):
+            pages = list(iter_pdf_transcript(doc_path, text_only=text_only, workers=workers, progress=progress))
     except Exception as e:
+        # Re-raised so a job records the failure instead of finishing without text
         print(f"Error loading document: {str(e)}")
-        return None
+        raise
+    metrics.add_items("pdf_pages", len(pages))
+    return pages
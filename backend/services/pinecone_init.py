@@ -1,8 +1,9 @@
-import pinecone
-from pinecone import Pinecone, ServerlessSpec
 import os
+import time
+import threading
 from dotenv import load_dotenv
 import logging
+from services.vector_backend import get_namespace
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -10,18 +11,114 @@ logger = logging.getLogger(__name__)
 
 # Load API Key from .env
 load_dotenv()
-api_key = os.getenv("PINECONE_API_KEY")
 
-if not api_key:
-    raise ValueError("Pinecone API key is missing!")
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_pinecone_client():
+    """
+    Returns the Pinecone client, created on first use so that importing this module needs neither
+    the pinecone package loaded nor the API key set.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            api_key = os.getenv("PINECONE_API_KEY")
+            if not api_key:
+                raise ValueError("Pinecone API key is missing!")
+            from pinecone import Pinecone
+            _client = Pinecone(api_key=api_key)
+    return _client
+
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "rag-database")  # shared index for public & private RAG
+PINECONE_DIMENSION = int(os.getenv("PINECONE_DIMENSION", "768"))  # must match the embedding model (embedding-001: 768)
+PINECONE_CLOUD = os.getenv("PINECONE_CLOUD", "aws")
+PINECONE_REGION = os.getenv("PINECONE_REGION", "us-east-1")
+PINECONE_INDEX_TTL_SECONDS = int(os.getenv("PINECONE_INDEX_TTL_SECONDS", "3600"))  # re-resolve the index after this
+
+
+class IndexRegistry:
+    """
+    Resolves the Pinecone index once per process and hands out one shared handle, so the data path
+    makes no control-plane calls (list/describe/create). The handle keeps its HTTP connection pool
+    across requests. It is re-resolved when the TTL expires or after invalidate(), which callers
+    use when a data-plane call fails.
+
+    Args:
+        index_name (str): Index to use, created when missing
+        dimension (int): Vector size the index must have
+        ttl_seconds (int): Age after which the handle is re-resolved
+    """
+
+    def __init__(self, index_name: str, dimension: int, ttl_seconds: int = PINECONE_INDEX_TTL_SECONDS):
+        self.index_name = index_name
+        self.dimension = dimension
+        self.ttl_seconds = ttl_seconds
+        self._index = None
+        self._resolved_at = 0.0
+        self._dimension_checked = False
+        self._lock = threading.Lock()
+
+    def get_index(self):
+        """Returns the cached index handle, resolving it on first use, after the TTL or after invalidate()."""
+        index = self._index
+        if index is not None and time.monotonic() - self._resolved_at < self.ttl_seconds:
+            return index
+        with self._lock:
+            if self._index is None or time.monotonic() - self._resolved_at >= self.ttl_seconds:
+                self._index = self._resolve()
+                self._resolved_at = time.monotonic()
+            return self._index
+
+    def invalidate(self) -> None:
+        """Drops the handle so the next get_index() resolves the index again."""
+        with self._lock:
+            self._index = None
+
+    def _resolve(self):
+        import pinecone
+        from pinecone import ServerlessSpec
+        pc = get_pinecone_client()
+
+        if self.index_name not in pc.list_indexes().names():
+            logger.info(f"Creating index '{self.index_name}'...")
+            try:
+                pc.create_index(
+                    name=self.index_name,
+                    dimension=self.dimension,
+                    metric="cosine",
+                    spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION),
+                )
+                logger.info(f"Index '{self.index_name}' created successfully.")
+            except pinecone.PineconeException as e:
+                if "ALREADY_EXISTS" in str(e):
+                    logger.info(f"Index '{self.index_name}' already exists. Using the existing index.")
+                else:
+                    logger.error(f"Failed to create index: {e}")
+                    raise e  # Re-raise the error if it's something else
+
+        description = pc.describe_index(self.index_name)
+        if not self._dimension_checked:
+            # Checked once: a mismatch is a configuration error, not something a refresh fixes
+            if description.dimension != self.dimension:
+                raise ValueError(
+                    f"Pinecone index '{self.index_name}' has dimension {description.dimension}, "
+                    f"but the embeddings have {self.dimension} (PINECONE_DIMENSION)."
+                )
+            self._dimension_checked = True
+        # Passing the host skips the describe call Index() would otherwise make
+        return pc.Index(self.index_name, host=description.host)
+
+
+index_registry = IndexRegistry(PINECONE_INDEX_NAME, PINECONE_DIMENSION)
 
-# Initialize Pinecone client
-pc = Pinecone(api_key=api_key)
 
 def create_pinecone_index(user_id: str = None, is_private: bool = False) -> dict:
     """
     - Public RAG: Uses a shared database.
     - Private RAG: Creates a unique namespace for each user.
+    The index is resolved (and created if missing) once per process, see IndexRegistry.
 
     Args:
         user_id (str, optional): Unique identifier for the user.
@@ -30,38 +127,5 @@ def create_pinecone_index(user_id: str = None, is_private: bool = False) -> dict
     Returns:
         dict: Contains the index and namespace.
     """
-    index_name = "rag-database"  # Shared index for both public & private RAG
-    namespace = "public" if not is_private else f"user_{user_id}"  # Public namespace OR per-user namespace
-
-    # Validate user_id for private namespaces
-    if is_private and not user_id:
-        raise ValueError("user_id must be provided for private namespaces!")
-
-    # List existing indexes
-    existing_indexes = pc.list_indexes()
-
-    # Check if index exists
-    if index_name not in existing_indexes:
-        logger.info(f"Creating index '{index_name}'...")
-        try:
-            pc.create_index(
-                name=index_name,
-                dimension=768,  # Ensure this matches your vector dimensionality
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud="aws",
-                    region="us-east-1"
-                )
-            )
-            logger.info(f"Index '{index_name}' created successfully.")
-        except pinecone.PineconeException as e:
-            if "ALREADY_EXISTS" in str(e):
-                logger.info(f"Index '{index_name}' already exists. Using the existing index.")
-            else:
-                logger.error(f"Failed to create index: {e}")
-                raise e  # Re-raise the error if it's something else
-
-    # Get the index reference
-    index = pc.Index(index_name)
-
-    return {"index": index, "namespace": namespace}
\ No newline at end of file
+    namespace = get_namespace(user_id, is_private)  # Public namespace OR per-user namespace (validates user_id)
+    return {"index": index_registry.get_index(), "namespace": namespace}
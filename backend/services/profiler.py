@@ -0,0 +1,223 @@
+#this file profiles a sample of requests (and slow ones) with a shared stack sampler and keeps the profiles in an on-disk ring buffer
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import tempfile
+import threading
+from collections import Counter, deque
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # fraction of requests profiled; 0 disables
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # also keep any request slower than this; 0 disables
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))  # time between stack samples
+PROFILE_WINDOW_SECONDS = float(os.getenv("PROFILE_WINDOW_SECONDS", "60"))  # stack samples kept in the shared ring
+PROFILE_DIR = os.getenv("PROFILE_DIR", "cache/profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))  # oldest profiles are deleted beyond this
+PROFILE_MAX_DEPTH = 128
+
+PROFILING_ENABLED = PROFILE_SAMPLE_RATE > 0 or PROFILE_SLOW_MS > 0
+
+_profile_id = re.compile(r"^[0-9]{13}-[0-9a-f]{8}$")
+# Innermost frames of threads that are parked, not working (idle pool threads, the idle event loop)
+_idle_frames = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("thread.py", "_worker"), ("connection.py", "_poll"), ("connection.py", "wait"),
+}
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Sampler:
+    """
+    One background thread that, while at least one tracked request is in flight, takes a snapshot of
+    every working thread's stack each interval and appends it, time-stamped, to a shared ring of the
+    last PROFILE_WINDOW_SECONDS. Requests run on the event loop and on threadpool threads, so all working
+    threads are sampled. Each snapshot is taken once however many requests overlap; a request copies
+    the samples of its own time span out of the ring only when its profile is kept.
+    """
+
+    def __init__(self, interval: float, window: float):
+        self.interval = interval
+        self.ring = deque(maxlen=max(int(window / interval), 1))  # (time, stacks, requests in flight)
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        with self.lock:
+            self.in_flight += 1
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def stop(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+    def samples_since(self, start: float) -> list:
+        """Samples taken after start (a time.perf_counter() value), oldest first."""
+        samples = []
+        with self.lock:
+            for sample in reversed(self.ring):
+                if sample[0] < start:
+                    break
+                samples.append(sample)
+        samples.reverse()
+        return samples
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            with self.lock:
+                in_flight = self.in_flight
+            if not in_flight:
+                # Parked until the next tracked request
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _idle_frames:
+                    continue
+                names = []
+                while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+                    names.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                # Interned, so the ring holds each distinct stack once
+                stacks.append(sys.intern(";".join(reversed(names))))
+            with self.lock:
+                self.ring.append((time.perf_counter(), stacks, in_flight))
+            time.sleep(self.interval)
+
+
+_sampler = _Sampler(PROFILE_INTERVAL_MS / 1000, PROFILE_WINDOW_SECONDS)
+
+
+class RequestProfile:
+    """
+    Marks the time span of one request in the shared sample ring. Starting and finishing a request
+    only counts it in flight; its stacks are collected from the ring when it was sampled or slow.
+
+    Args:
+        endpoint (str): Method and path, e.g. "POST /excel"
+        input_bytes (int): Request body size (Content-Length), or None
+        sampled (bool): Picked by the sample rate (otherwise kept only if slow)
+    """
+
+    def __init__(self, endpoint: str, input_bytes: int = None, sampled: bool = False):
+        self.endpoint = endpoint
+        self.input_bytes = input_bytes
+        self.sampled = sampled
+        self.started = time.time()
+        self._start = time.perf_counter()
+        _sampler.start()
+
+    def finish(self, status: int = None, route: str = None):
+        """Stops tracking the request and saves its profile if it was sampled or slow; returns its id or None."""
+        _sampler.stop()
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        slow = PROFILE_SLOW_MS > 0 and duration_ms >= PROFILE_SLOW_MS
+        if not (self.sampled or slow):
+            return None
+        samples = _sampler.samples_since(self._start)
+        stacks = Counter()
+        for _, sample_stacks, _ in samples:
+            stacks.update(sample_stacks)
+        if not stacks:
+            return None
+        meta = {
+            "endpoint": self.endpoint,
+            "route": route,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "input_bytes": self.input_bytes,
+            "reason": "sampled" if self.sampled else "slow",
+            "samples": len(samples),
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "concurrent_requests": max(in_flight for _, _, in_flight in samples),
+            # Requests longer than the ring only keep their last PROFILE_WINDOW_SECONDS
+            "truncated": duration_ms > PROFILE_WINDOW_SECONDS * 1000,
+            "started": self.started,
+        }
+        return save_profile(meta, stacks)
+
+
+def start_profile(endpoint: str, input_bytes: int = None):
+    """Returns a RequestProfile when this request may be profiled (sampled, or slow profiling is on), else None."""
+    sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    if not sampled and PROFILE_SLOW_MS <= 0:
+        return None
+    return RequestProfile(endpoint, input_bytes, sampled)
+
+
+def _write_atomic(path: str, text: str) -> None:
+    fd, temp_path = tempfile.mkstemp(dir=PROFILE_DIR, prefix=".tmp-")
+    with os.fdopen(fd, "w") as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+def save_profile(meta: dict, stacks: Counter) -> str:
+    """
+    Writes a profile as <id>.json (metadata) plus <id>.folded (collapsed stacks, one "frame;frame;... count"
+    line each, readable by flamegraph.pl and speedscope), then drops the oldest profiles beyond PROFILE_MAX_FILES.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # Millisecond timestamp first, so names sort oldest first
+    profile_id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+    _write_atomic(os.path.join(PROFILE_DIR, profile_id + ".folded"),
+                  "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
+    _write_atomic(os.path.join(PROFILE_DIR, profile_id + ".json"), json.dumps({"id": profile_id, **meta}))
+    _trim()
+    return profile_id
+
+
+def _profile_ids() -> list:
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith(".json") and _profile_id.match(name[:-5]))
+
+
+def _trim() -> None:
+    if PROFILE_MAX_FILES <= 0:
+        return
+    for profile_id in _profile_ids()[:-PROFILE_MAX_FILES]:
+        for extension in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + extension))
+            except FileNotFoundError:
+                pass  # another worker removed it first
+
+
+def list_profiles(limit: int = 50) -> list:
+    """Metadata of the newest profiles, newest first."""
+    profiles = []
+    for profile_id in reversed(_profile_ids()):
+        if len(profiles) >= limit:
+            break
+        try:
+            with open(os.path.join(PROFILE_DIR, profile_id + ".json")) as file:
+                profiles.append(json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue  # trimmed or being written by another worker
+    return profiles
+
+
+def profile_path(profile_id: str, extension: str = ".folded"):
+    """Path of a stored profile file, or None for unknown or malformed ids."""
+    if not _profile_id.match(profile_id or ""):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + extension)
+    return path if os.path.exists(path) else None
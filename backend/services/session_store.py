@@ -0,0 +1,272 @@
+#this file keeps per-session ingestion state and job status in SQLite so every worker process sees it
+import os
+import json
+import time
+import sqlite3
+import threading
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "cache/sessions.sqlite3")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))  # sessions idle this long and old jobs are evicted
+SESSION_TOUCH_SECONDS = 60  # reads refresh a session's last access at most this often
+DEFAULT_SESSION = "default"
+
+_conn = None
+_conn_pid = None
+_lock = threading.Lock()
+_last_eviction = 0.0
+
+
+def _connection() -> sqlite3.Connection:
+    """Opens one connection per process (re-opened after a fork)."""
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        if os.path.dirname(SESSION_STORE_PATH):
+            os.makedirs(os.path.dirname(SESSION_STORE_PATH), exist_ok=True)
+        _conn = sqlite3.connect(SESSION_STORE_PATH, check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_values ("
+            " session_id TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT,"
+            " updated REAL NOT NULL,"  # last write or read of the session
+            " PRIMARY KEY (session_id, key))"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " session_id TEXT,"
+            " kind TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " progress TEXT NOT NULL DEFAULT '{}',"
+            " result TEXT,"
+            " error TEXT,"
+            " created REAL NOT NULL,"
+            " finished REAL)"
+        )
+        # Columns added after the first release; older files get them here
+        for column in ("result_key TEXT", "owner_pid INTEGER"):
+            try:
+                _conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass  # already there
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS namespace_generations ("
+            " namespace TEXT PRIMARY KEY,"
+            " generation INTEGER NOT NULL)"
+        )
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT,"
+            " updated REAL NOT NULL)"
+        )
+        _conn.commit()
+        _conn_pid = os.getpid()
+    return _conn
+
+
+def _execute(sql: str, params=()) -> list:
+    with _lock:
+        conn = _connection()
+        rows = conn.execute(sql, params).fetchall()
+        conn.commit()
+    return rows
+
+
+def evict_expired(force: bool = False) -> None:
+    """Drops sessions, finished jobs and cached extraction results older than SESSION_TTL_SECONDS; runs at most once a minute."""
+    global _last_eviction
+    now = time.time()
+    if not force and now - _last_eviction < 60:
+        return
+    _last_eviction = now
+    cutoff = now - SESSION_TTL_SECONDS
+    with _lock:
+        conn = _connection()
+        # A session expires as a whole, based on its most recent access (write or read)
+        conn.execute(
+            "DELETE FROM session_values WHERE session_id IN ("
+            " SELECT session_id FROM session_values GROUP BY session_id HAVING MAX(updated) < ?)",
+            (cutoff,),
+        )
+        conn.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,))
+        # Results a live session still refers to (see save_extracted in route.py) are kept
+        conn.execute(
+            "DELETE FROM extraction_results WHERE updated < ? AND key NOT IN ("
+            " SELECT json_extract(value, '$') FROM session_values WHERE key LIKE '%\\_result' ESCAPE '\\')",
+            (cutoff,),
+        )
+        conn.commit()
+
+
+#session values
+
+def _touch(session_id: str) -> None:
+    """Marks a session as in use, so a user who only reads (keeps chatting) is not evicted."""
+    now = time.time()
+    _execute(
+        "UPDATE session_values SET updated = ? WHERE session_id = ? AND updated < ?",
+        (now, session_id, now - SESSION_TOUCH_SECONDS),
+    )
+
+
+def get_session_value(session_id: str, key: str, default=None):
+    rows = _execute("SELECT value FROM session_values WHERE session_id = ? AND key = ?", (session_id, key))
+    if rows:
+        _touch(session_id)
+    return json.loads(rows[0][0]) if rows else default
+
+
+def get_session_values(session_id: str) -> dict:
+    rows = _execute("SELECT key, value FROM session_values WHERE session_id = ?", (session_id,))
+    if rows:
+        _touch(session_id)
+    return {key: json.loads(value) for key, value in rows}
+
+
+def set_session_value(session_id: str, key: str, value) -> None:
+    evict_expired()
+    _execute(
+        "INSERT OR REPLACE INTO session_values (session_id, key, value, updated) VALUES (?, ?, ?, ?)",
+        (session_id, key, json.dumps(value, default=str), time.time()),
+    )
+
+
+def set_session_values(session_id: str, values: dict) -> None:
+    """Writes several values of a session in one transaction, so readers never see half of them."""
+    evict_expired()
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO session_values (session_id, key, value, updated) VALUES (?, ?, ?, ?)",
+            [(session_id, key, json.dumps(value, default=str), now) for key, value in values.items()],
+        )
+        conn.commit()
+
+
+#extraction results, keyed by upload content hash so re-uploads skip extraction; the one copy of each
+#result, which sessions and jobs refer to by key
+
+def get_cached_result(key: str):
+    rows = _execute("SELECT value FROM extraction_results WHERE key = ?", (key,))
+    if not rows:
+        return None
+    _execute("UPDATE extraction_results SET updated = ? WHERE key = ?", (time.time(), key))
+    return json.loads(rows[0][0])
+
+
+def has_cached_result(key: str) -> bool:
+    """Whether a result is stored under key, without loading it."""
+    rows = _execute("SELECT 1 FROM extraction_results WHERE key = ?", (key,))
+    if rows:
+        _execute("UPDATE extraction_results SET updated = ? WHERE key = ?", (time.time(), key))
+    return bool(rows)
+
+
+def set_cached_result(key: str, value) -> None:
+    evict_expired()
+    _execute(
+        "INSERT OR REPLACE INTO extraction_results (key, value, updated) VALUES (?, ?, ?)",
+        (key, json.dumps(value, default=str), time.time()),
+    )
+
+
+#namespace generations, bumped whenever a namespace's documents change so every worker can tell its cached answers are stale
+
+def get_namespace_generation(namespace: str) -> int:
+    rows = _execute("SELECT generation FROM namespace_generations WHERE namespace = ?", (namespace,))
+    return rows[0][0] if rows else 0
+
+
+def bump_namespace_generation(namespace: str) -> int:
+    _execute(
+        "INSERT INTO namespace_generations (namespace, generation) VALUES (?, 1)"
+        " ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1",
+        (namespace,),
+    )
+    return get_namespace_generation(namespace)
+
+
+#jobs
+
+def create_job(job_id: str, kind: str, session_id: str = None) -> None:
+    evict_expired()
+    # The creating API process runs the job's completion, so the job dies with it (see fail_orphaned_jobs)
+    _execute(
+        "INSERT INTO jobs (job_id, session_id, kind, status, created, owner_pid) VALUES (?, ?, ?, 'queued', ?, ?)",
+        (job_id, session_id, kind, time.time(), os.getpid()),
+    )
+
+
+def update_job_progress(job_id: str, counters: dict) -> None:
+    _execute("UPDATE jobs SET progress = json_patch(progress, ?) WHERE job_id = ?", (json.dumps(counters), job_id))
+
+
+def set_job_status(job_id: str, status: str) -> None:
+    _execute("UPDATE jobs SET status = ? WHERE job_id = ?", (status, job_id))
+
+
+def finish_job(job_id: str, result=None, error: str = None, result_key: str = None) -> None:
+    """Marks a job done or failed. Large results are stored once with set_cached_result() and passed as result_key."""
+    _execute(
+        "UPDATE jobs SET status = ?, result = ?, result_key = ?, error = ?, finished = ? WHERE job_id = ?",
+        ("failed" if error else "done", None if result is None else json.dumps(result, default=str), result_key, error, time.time(), job_id),
+    )
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def fail_orphaned_jobs() -> int:
+    """
+    Marks queued and running jobs whose API process no longer exists as failed, so they do not stay
+    pending forever; called when an API process starts. Returns how many were failed.
+    """
+    rows = _execute("SELECT job_id, owner_pid FROM jobs WHERE status IN ('queued', 'running')")
+    orphaned = [job_id for job_id, pid in rows if pid is None or not _process_alive(pid)]
+    for job_id in orphaned:
+        _execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE job_id = ? AND status IN ('queued', 'running')",
+            ("The API process running this job stopped", time.time(), job_id),
+        )
+    return len(orphaned)
+
+
+def get_job_record(job_id: str, include_result: bool = False) -> dict:
+    """
+    Status and progress of a job. The result (possibly a whole document's chunks) is only loaded
+    when include_result is set, so polling stays cheap.
+    """
+    rows = _execute(
+        "SELECT job_id, session_id, kind, status, progress, result, result_key, error, created, finished FROM jobs WHERE job_id = ?",
+        (job_id,),
+    )
+    if not rows:
+        return None
+    job_id, session_id, kind, status, progress, result, result_key, error, created, finished = rows[0]
+    job = {
+        "id": job_id,
+        "session_id": session_id,
+        "kind": kind,
+        "status": status,
+        "progress": json.loads(progress),
+        "error": error,
+        "created": created,
+        "finished": finished,
+    }
+    if include_result:
+        if result_key is not None:
+            job["result"] = get_cached_result(result_key)
+        else:
+            job["result"] = json.loads(result) if result is not None else None
+    return job
@@ -0,0 +1,259 @@
+#this file persists cleaned spreadsheets as Parquet with per-column statistics and answers structured queries over them
+import os
+import json
+import math
+# pandas and pyarrow are imported where they are used, so the API process loads them on the first table
+
+TABLE_DIR = os.getenv("TABLE_DIR", "cache/tables")
+TABLE_QUERY_MAX_ROWS = int(os.getenv("TABLE_QUERY_MAX_ROWS", "50"))  # rows of a result handed to the LLM
+TABLE_TOP_VALUES = 20  # most frequent values kept per text column
+TABLE_TRACK_DISTINCT = 1000  # text columns with more distinct values only report that they exceed this
+
+FILTER_OPS = ("==", "!=", ">", ">=", "<", "<=", "in", "not in", "contains")
+AGGREGATIONS = ("sum", "mean", "min", "max", "count", "nunique", "median")
+
+
+def table_id_for(file_location: str) -> str:
+    """Uploads are stored under their content hash, which also names their table."""
+    return os.path.splitext(os.path.basename(file_location))[0]
+
+
+def _paths(table_id: str) -> tuple:
+    if not table_id or not table_id.replace("-", "").replace("_", "").isalnum():
+        raise ValueError("Invalid table id")
+    base = os.path.join(TABLE_DIR, table_id)
+    return base + ".parquet", base + ".stats.json"
+
+
+class TableWriter:
+    """
+    Appends cleaned DataFrame batches to a Parquet file and accumulates per-column statistics
+    (count, min, max, sum, distinct and most frequent values) along the way, so no pass over the
+    finished table is needed. Files are written under a temporary name and moved into place on close,
+    so readers never see a partial table.
+
+    Args:
+        table_id (str): Name of the table, normally the upload's content hash
+        source (str): Original file name, kept in the statistics
+    """
+
+    def __init__(self, table_id: str, source: str = ""):
+        import pyarrow.parquet as pq
+        self.table_id = table_id
+        self.source = source
+        self.path, self.stats_path = _paths(table_id)
+        os.makedirs(TABLE_DIR, exist_ok=True)
+        self._tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self._pq = pq
+        self._writer = None
+        self._schema = None
+        self.rows = 0
+        self._columns = {}
+
+    def write(self, df: "pd.DataFrame") -> None:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = self._pq.ParquetWriter(self._tmp_path, self._schema, compression="zstd")
+        self._writer.write_table(table)
+        self.rows += len(df)
+        for col in df.columns:
+            self._update_stats(col, df[col])
+
+    def _update_stats(self, col: str, series: "pd.Series") -> None:
+        import pandas as pd
+        stats = self._columns.setdefault(col, {"type": str(series.dtype), "count": 0, "min": None, "max": None})
+        values = series.dropna()
+        if values.empty:
+            return
+        stats["count"] += len(values)
+        low, high = (value.item() if hasattr(value, "item") else value for value in (values.min(), values.max()))
+        stats["min"] = low if stats["min"] is None else min(stats["min"], low)
+        stats["max"] = high if stats["max"] is None else max(stats["max"], high)
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            stats["sum"] = stats.get("sum", 0.0) + float(values.sum())
+        else:
+            counts = stats.setdefault("_counts", {})
+            if counts is not None:
+                for value, count in values.astype(str).value_counts().items():
+                    counts[value] = counts.get(value, 0) + int(count)
+                if len(counts) > TABLE_TRACK_DISTINCT:
+                    stats["_counts"] = None
+
+    def close(self) -> dict:
+        """Finishes the Parquet file, writes the statistics next to it and returns them."""
+        import pyarrow as pa
+        if self._writer is None:
+            # Empty upload: still produce a readable (empty) table
+            self._writer = self._pq.ParquetWriter(self._tmp_path, pa.schema([]))
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+        stats = {"table_id": self.table_id, "source": self.source, "rows": self.rows, "columns": {}}
+        for col, column in self._columns.items():
+            column = dict(column)
+            counts = column.pop("_counts", None)
+            if "sum" in column:
+                column["mean"] = column["sum"] / column["count"] if column["count"] else None
+            if counts is not None:
+                column["distinct"] = len(counts)
+                top = sorted(counts.items(), key=lambda item: -item[1])[:TABLE_TOP_VALUES]
+                column["top_values"] = [{"value": value, "count": count} for value, count in top]
+            elif "sum" not in column:
+                column["distinct"] = f">{TABLE_TRACK_DISTINCT}"
+            stats["columns"][col] = column
+        with open(self.stats_path, "w") as file:
+            json.dump(stats, file, default=str)
+        return stats
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def get_table_stats(table_id: str) -> dict:
+    """Returns the precomputed statistics of a table, or None if it has not been written (yet)."""
+    _, stats_path = _paths(table_id)
+    try:
+        with open(stats_path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def describe_table(stats: dict) -> str:
+    """Compact text description of a table's columns, small enough to put in a prompt."""
+    lines = [f"Table with {stats['rows']} rows. Columns:"]
+    for col, column in stats["columns"].items():
+        line = f"- {json.dumps(col)} ({column['type']}): min={column['min']}, max={column['max']}"
+        if column.get("mean") is not None:
+            line += f", mean={column['mean']:.4g}"
+        if column.get("top_values"):
+            values = [value["value"] for value in column["top_values"][:10]]
+            line += f", distinct={column['distinct']}, common values={json.dumps(values)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _coerce(value, column: dict):
+    """Converts a filter value to the column's type so comparisons are not done between strings and numbers."""
+    if isinstance(value, (list, tuple)):
+        return [_coerce(item, column) for item in value]
+    kind = column["type"]
+    if kind.startswith(("int", "uint")):
+        # float() would round integers above 2**53, e.g. account numbers, and miss exact matches
+        try:
+            return int(str(value).strip())
+        except ValueError:
+            return float(value)
+    if kind.startswith("float"):
+        return float(value)
+    if kind.startswith("datetime"):
+        import pandas as pd
+        return pd.Timestamp(value)
+    if kind == "bool":
+        return str(value).lower() in ("true", "1", "yes")
+    return str(value)
+
+
+def _validate(spec: dict, stats: dict) -> None:
+    columns = stats["columns"]
+    referenced = list(spec.get("group_by") or [])
+    for condition in spec.get("filters") or []:
+        referenced.append(condition.get("column"))
+        if condition.get("op") not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter operator: {condition.get('op')}")
+    for aggregation in spec.get("aggregations") or []:
+        if aggregation.get("func") not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation: {aggregation.get('func')}")
+        if aggregation.get("column") != "*" or aggregation["func"] != "count":
+            referenced.append(aggregation.get("column"))
+    referenced += list(spec.get("select") or [])
+    unknown = [col for col in referenced if col not in columns]
+    if unknown:
+        raise ValueError(f"Unknown columns: {unknown}")
+
+
+def run_table_query(table_id: str, spec: dict, max_rows: int = TABLE_QUERY_MAX_ROWS) -> dict:
+    """
+    Runs a structured query on a stored table. Only the referenced columns are read, and the
+    comparison filters are pushed down into the Parquet reader.
+
+    Args:
+        table_id (str): Table to query
+        spec (dict): {"filters": [{"column", "op", "value"}], "group_by": [...],
+                      "aggregations": [{"column" (or "*" for count), "func"}], "select": [...],
+                      "order_by": {"column", "descending"}, "limit": int}
+        max_rows (int): Rows returned at most; the result reports whether it was truncated
+
+    Returns:
+        dict: {"columns", "rows", "row_count", "truncated"}
+    """
+    import pandas as pd
+    import pyarrow.parquet as pq
+    stats = get_table_stats(table_id)
+    if stats is None:
+        raise FileNotFoundError("Table not found; it may still be processing")
+    _validate(spec, stats)
+    columns = stats["columns"]
+    filters = spec.get("filters") or []
+    group_by = list(spec.get("group_by") or [])
+    aggregations = spec.get("aggregations") or []
+
+    needed = set(group_by) | set(spec.get("select") or []) | {condition["column"] for condition in filters}
+    needed |= {aggregation["column"] for aggregation in aggregations if aggregation["column"] != "*"}
+    if not (aggregations or group_by or spec.get("select")):
+        # Without a selection the whole filtered rows are returned, not only the filtered columns
+        needed = set(columns)
+    pushdown = [
+        (condition["column"], "=" if condition["op"] == "==" else condition["op"], _coerce(condition["value"], columns[condition["column"]]))
+        for condition in filters if condition["op"] != "contains"
+    ]
+    path, _ = _paths(table_id)
+    df = pq.read_table(path, columns=[col for col in columns if col in needed], filters=pushdown or None).to_pandas()
+    for condition in filters:
+        if condition["op"] == "contains":
+            df = df[df[condition["column"]].astype(str).str.contains(str(condition["value"]), case=False, regex=False)]
+
+    if aggregations:
+        named = {}
+        for aggregation in aggregations:
+            column, func = aggregation["column"], aggregation["func"]
+            name = aggregation.get("as") or (f"{func}({column})")
+            named[name] = (group_by[0] if column == "*" and group_by else column, "size" if column == "*" else func)
+        if group_by:
+            result = df.groupby(group_by, sort=False, dropna=False).agg(**named).reset_index()
+        elif any(column == "*" for column, _ in named.values()):
+            result = pd.DataFrame([{
+                name: len(df) if column == "*" else df[column].agg(func) for name, (column, func) in named.items()
+            }])
+        else:
+            result = pd.DataFrame([{name: df[column].agg(func) for name, (column, func) in named.items()}])
+    else:
+        result = df[[col for col in (spec.get("select") or df.columns)]]
+
+    order_by = spec.get("order_by")
+    if order_by and order_by.get("column") in result.columns:
+        result = result.sort_values(order_by["column"], ascending=not order_by.get("descending", False))
+    limit = min(int(spec.get("limit") or max_rows), max_rows)
+    rows = [
+        [None if isinstance(value, float) and math.isnan(value) else value for value in row]
+        for row in result.head(limit).itertuples(index=False, name=None)
+    ]
+    return {
+        "columns": list(result.columns),
+        "rows": json.loads(json.dumps(rows, default=str)),  # numpy scalars and timestamps to plain JSON
+        "row_count": len(result),
+        "truncated": len(result) > limit,
+    }
+
+
+def format_result(result: dict) -> str:
+    """Renders a query result as a small markdown table for the LLM prompt."""
+    lines = ["| " + " | ".join(map(str, result["columns"])) + " |", "|" + "---|" * len(result["columns"])]
+    lines += ["| " + " | ".join(map(str, row)) + " |" for row in result["rows"]]
+    if result["truncated"]:
+        lines.append(f"(first {len(result['rows'])} of {result['row_count']} rows)")
+    return "\n".join(lines)
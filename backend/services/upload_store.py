@@ -0,0 +1,83 @@
+#this file stores uploads content-addressed on disk and keeps the upload directory within a size/age budget
+import os
+import re
+import time
+import hashlib
+import tempfile
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "temp_files")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+UPLOAD_MAX_AGE_SECONDS = int(os.getenv("UPLOAD_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+UPLOAD_MIN_AGE_SECONDS = 600  # never collect files this recent; a job may still be reading them
+
+# Only files written by save_upload are managed; anything else in the directory is left alone
+_managed_name = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]+)?$")
+
+
+def save_upload(file) -> tuple:
+    """
+    Streams an upload to disk in large chunks while hashing it, and stores it under its content hash.
+    A second upload of the same bytes reuses the stored file.
+
+    Args:
+        file (UploadFile): The uploaded file
+
+    Returns:
+        tuple: (sha256 hex digest, path of the stored file)
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix=".upload-", delete=False) as buffer:
+        try:
+            while True:
+                chunk = file.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                buffer.write(chunk)
+        except BaseException:
+            # Client disconnect, full disk, ...: do not leave the partial upload behind
+            buffer.close()
+            _remove(buffer.name)
+            raise
+    file_location = os.path.join(UPLOAD_DIR, digest.hexdigest() + extension)
+    try:
+        if os.path.exists(file_location):
+            os.utime(file_location)  # mark as recently used for garbage collection
+        else:
+            os.replace(buffer.name, file_location)
+    finally:
+        _remove(buffer.name)  # the duplicate bytes, or a no-op once moved into place
+    collect_garbage()
+    return digest.hexdigest(), file_location
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass  # already collected by another request or worker
+
+
+def collect_garbage() -> None:
+    """Deletes stored uploads older than UPLOAD_MAX_AGE_SECONDS, then the oldest ones until the directory fits UPLOAD_MAX_BYTES."""
+    now = time.time()
+    files = []
+    for entry in os.scandir(UPLOAD_DIR):
+        if not entry.is_file() or not _managed_name.match(entry.name):
+            continue
+        stat = entry.stat()
+        if now - stat.st_mtime > UPLOAD_MAX_AGE_SECONDS:
+            _remove(entry.path)
+        else:
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in sorted(files):
+        if total <= UPLOAD_MAX_BYTES:
+            break
+        if now - mtime < UPLOAD_MIN_AGE_SECONDS:
+            continue
+        _remove(path)
+        total -= size
@@ -0,0 +1,420 @@
+#this file selects the vector store backend (hosted Pinecone or the in-process NumPy engine)
+import os
+import uuid
+import threading
+import weakref
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from services.lru import LRUCache
+
+load_dotenv()
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()  # "pinecone", "local" or "segments"
+# Backend of the per-user namespaces; "segments" keeps each one in memory-mapped files instead of the hosted index
+PRIVATE_VECTOR_BACKEND = os.getenv("PRIVATE_VECTOR_BACKEND", VECTOR_BACKEND).lower()
+VECTOR_STORE_CACHE_SIZE = int(os.getenv("VECTOR_STORE_CACHE_SIZE", "256"))  # namespaces with a live store object
+VECTOR_SEGMENT_OPEN_NAMESPACES = int(os.getenv("VECTOR_SEGMENT_OPEN_NAMESPACES", "64"))  # on-disk namespaces kept open
+VECTOR_BACKENDS = ("pinecone", "local", "segments")
+# Backends whose vectors are only visible to the API process that ingested them
+PROCESS_LOCAL_BACKENDS = ("local",)
+API_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))  # uvicorn and gunicorn read it for their worker count
+
+_vector_stores = LRUCache(VECTOR_STORE_CACHE_SIZE)
+_segment_namespaces = LRUCache(VECTOR_SEGMENT_OPEN_NAMESPACES)  # strong references keep these open
+_open_segments = weakref.WeakValueDictionary()  # every open one, so a namespace is never opened twice
+
+
+def check_worker_backends(workers: int = None) -> None:
+    """
+    Refuses to serve several API workers from a backend that keeps vectors in one process: each worker
+    would only find the documents it ingested itself. "pinecone" and "segments" are shared by every worker.
+    """
+    workers = API_WORKERS if workers is None else workers
+    if workers <= 1:
+        return
+    for setting, backend in (("VECTOR_BACKEND", VECTOR_BACKEND), ("PRIVATE_VECTOR_BACKEND", PRIVATE_VECTOR_BACKEND)):
+        if backend in PROCESS_LOCAL_BACKENDS:
+            raise ValueError(
+                f"{setting}={backend} keeps vectors in the process that ingested them, so it cannot serve "
+                f"{workers} API workers; use 'pinecone' or set WEB_CONCURRENCY=1."
+            )
+
+
+def get_namespace(user_id: str = None, is_private: bool = False) -> str:
+    """
+    Resolves the namespace shared by every backend.
+    - Public RAG: "public"
+    - Private RAG: "user_<id>"
+    """
+    if is_private and not user_id:
+        raise ValueError("user_id must be provided for private namespaces!")
+    return "public" if not is_private else f"user_{user_id}"
+
+
+class NumpyNamespace:
+    """
+    Vectors of one namespace kept in a contiguous, row-normalized float32 matrix.
+    The matrix grows by doubling so appends are amortized O(1) per row.
+    """
+
+    def __init__(self, dimension: int = None):
+        self.dimension = dimension
+        self.matrix = np.empty((0, dimension or 0), dtype=np.float32)
+        self.count = 0
+        self.ids = []
+        self.rows = {}  # id -> row
+        self.texts = []
+        self.metadatas = []
+        self.lock = threading.Lock()
+
+    def add(self, ids: list, texts: list, metadatas: list, vectors) -> None:
+        """Appends vectors; ids that are already stored are replaced (upsert)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or not len(vectors):
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        with self.lock:
+            # Checked and replaced under the same lock hold, so concurrent batches with a shared id
+            # cannot both append it
+            if not self.rows.keys().isdisjoint(ids):
+                self._delete_locked(ids)
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self.matrix = np.empty((0, self.dimension), dtype=np.float32)
+            if vectors.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match namespace dimension {self.dimension}")
+            needed = self.count + len(vectors)
+            if needed > len(self.matrix):
+                grown = np.empty((max(needed, 2 * len(self.matrix), 64), self.dimension), dtype=np.float32)
+                grown[:self.count] = self.matrix[:self.count]
+                self.matrix = grown
+            self.matrix[self.count:needed] = vectors
+            self.rows.update((doc_id, row) for row, doc_id in enumerate(ids, start=self.count))
+            self.count = needed
+            self.ids.extend(ids)
+            self.texts.extend(texts)
+            self.metadatas.extend(metadatas)
+
+    def delete(self, ids: list) -> None:
+        with self.lock:
+            self._delete_locked(ids)
+
+    def _delete_locked(self, ids: list) -> None:
+        """delete() for callers that already hold self.lock."""
+        drop = set(ids)
+        keep = [i for i, doc_id in enumerate(self.ids) if doc_id not in drop]
+        if len(keep) == self.count:
+            return
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        self.count = len(keep)
+        self.ids = [self.ids[i] for i in keep]
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.texts = [self.texts[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+
+    def search(self, queries, k: int, include_vectors: bool = False) -> list:
+        """
+        Top-k cosine search for one or many queries with a single matrix product.
+
+        Returns:
+            list: For every query, a list of {"id", "text", "metadata", "score"} hits ordered by score,
+            plus the stored (normalized) "vector" with include_vectors
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1.0, norms)
+        with self.lock:
+            # delete() swaps in new arrays/lists, so these references stay consistent with each other
+            count = self.count
+            matrix = self.matrix[:count]
+            ids, texts, metadatas = self.ids, self.texts, self.metadatas
+        if count == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(k, count)
+        scores = queries @ matrix.T
+        if k < count:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(count), (len(queries), 1))
+        results = []
+        for row_scores, rows in zip(scores, top):
+            order = rows[np.argsort(-row_scores[rows])]
+            hits = [
+                {"id": ids[row], "text": texts[row], "metadata": metadatas[row], "score": float(row_scores[row])}
+                for row in order
+            ]
+            if include_vectors:
+                for hit, row in zip(hits, order):
+                    hit["vector"] = matrix[row].copy()
+            results.append(hits)
+        return results
+
+    def get_vectors(self, ids: list) -> dict:
+        """Stored (normalized) vectors of the given ids; ids that are not stored are left out."""
+        with self.lock:
+            return {doc_id: self.matrix[self.rows[doc_id]].copy() for doc_id in ids if doc_id in self.rows}
+
+
+_namespaces = {}
+_namespaces_lock = threading.Lock()
+
+
+def get_numpy_namespace(namespace: str, persistent: bool = False):
+    """
+    Returns the in-process store for a namespace, creating it on first use. Persistent namespaces
+    are on-disk segments (see vector_segments.py); only recently used ones are kept open.
+    """
+    if persistent:
+        from services.vector_segments import SegmentNamespace
+        with _namespaces_lock:
+            store = _open_segments.get(namespace)
+            if store is None:
+                store = _open_segments[namespace] = SegmentNamespace(namespace)
+        _segment_namespaces.put(namespace, store)
+        return store
+    with _namespaces_lock:
+        if namespace not in _namespaces:
+            _namespaces[namespace] = NumpyNamespace()
+        return _namespaces[namespace]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    LangChain vector store over the in-process NumPy engine.
+
+    Args:
+        embedding: Embedding model used for documents and queries
+        namespace (str): "public" or "user_<id>"
+        persistent (bool): Keep the vectors in on-disk, memory-mapped segments instead of RAM
+    """
+
+    def __init__(self, embedding, namespace: str = "public", persistent: bool = False):
+        self._embedding = embedding
+        self.namespace = namespace
+        self.persistent = persistent
+
+    @property
+    def store(self):
+        # Looked up on each use, so a namespace closed by the open-namespace cache is reopened, never duplicated
+        return get_numpy_namespace(self.namespace, self.persistent)
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> list:
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = kwargs.get("embeddings")
+        if vectors is None:
+            vectors = self._embedding.embed_documents(texts)
+        self.store.add(ids, texts, metadatas, vectors)
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        if ids:
+            self.store.delete(ids)
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4, **kwargs) -> list:
+        hits = self.store.search(embedding, k)[0]
+        return [(Document(id=hit["id"], page_content=hit["text"], metadata=dict(hit["metadata"])), hit["score"]) for hit in hits]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, namespace: str = "public", **kwargs):
+        store = cls(embedding, namespace=namespace)
+        store.add_texts(texts, metadatas=metadatas, **kwargs)
+        return store
+
+
+def get_vector_store(embedding, user_id: str = None, is_private: bool = False):
+    """
+    Returns the configured vector store for the public or per-user namespace.
+
+    Args:
+        embedding: Embedding model used by the store
+        user_id (str, optional): User ID for private RAG.
+        is_private (bool, optional): Whether to use private RAG.
+
+    Returns:
+        VectorStore: A LangChain vector store bound to the namespace
+    """
+    namespace = get_namespace(user_id, is_private)
+    backend = PRIVATE_VECTOR_BACKEND if is_private else VECTOR_BACKEND
+    if backend not in VECTOR_BACKENDS:
+        setting = "PRIVATE_VECTOR_BACKEND" if is_private else "VECTOR_BACKEND"
+        raise ValueError(f"Unknown {setting} '{backend}'. Use 'pinecone', 'local' or 'segments'.")
+    # The cached store keeps a reference to the embedding, so its id cannot be reused while cached
+    key = (backend, namespace, id(embedding))
+    return _vector_stores.get_or_create(key, lambda: _build_vector_store(embedding, user_id, is_private, namespace, backend))
+
+
+def _build_vector_store(embedding, user_id, is_private, namespace, backend=VECTOR_BACKEND):
+    if backend in ("local", "segments"):
+        return LocalVectorStore(embedding, namespace=namespace, persistent=backend == "segments")
+
+    # Imported here so the local backend runs without Pinecone credentials
+    from langchain_pinecone import Pinecone
+    from services.pinecone_init import create_pinecone_index
+
+    pinecone_info = create_pinecone_index(user_id, is_private)
+    return Pinecone(pinecone_info["index"], embedding, namespace=pinecone_info["namespace"])
+
+
+def _stale_handle(error: Exception) -> bool:
+    """
+    True for failures a fresh index handle may fix: connection errors, 404 (index deleted or moved)
+    and 5xx. Other 4xx errors are caused by the request itself and keep the handle.
+    """
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status == 404 or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    try:
+        from urllib3.exceptions import HTTPError
+    except ImportError:
+        return False
+    return isinstance(error, HTTPError)
+
+
+def _pinecone_call(vector_store, func):
+    """
+    Runs func(index) with the shared index handle, so a store built before a handle refresh picks up
+    the new one. A call that fails in a way a new handle may fix drops it; the next call resolves the
+    index again.
+    """
+    from services.pinecone_init import index_registry
+    try:
+        index = index_registry.get_index()
+        if vector_store._index is not index:
+            vector_store._index = index  # also used by the store's own search methods
+        return func(index)
+    except Exception as e:
+        if _stale_handle(e):
+            index_registry.invalidate()
+        raise
+
+
+def similarity_search(vector_store, query: str, k: int = 4) -> list:
+    """
+    Returns the k Documents closest to the query. Pinecone searches run through the shared index
+    handle like every other data-plane call; the query is embedded first, so an embedding failure
+    never drops the handle.
+    """
+    if isinstance(vector_store, LocalVectorStore):
+        return vector_store.similarity_search(query, k=k)
+    vector = vector_store.embeddings.embed_query(query)
+    hits = _pinecone_call(vector_store, lambda index: vector_store.similarity_search_by_vector_with_score(vector, k=k))
+    return [doc for doc, _ in hits]
+
+
+def search_by_vector(vector_store, query_vector, k: int = 4) -> list:
+    """
+    Returns the k hits closest to an already embedded query as (Document, vector) pairs. The vectors
+    are the stored ones (dequantized for segments), so callers can compare hits without embedding their
+    texts again. Documents carry their id.
+    """
+    if isinstance(vector_store, LocalVectorStore):
+        hits = vector_store.store.search(query_vector, k, include_vectors=True)[0]
+        return [(Document(id=hit["id"], page_content=hit["text"], metadata=dict(hit["metadata"])), hit["vector"]) for hit in hits]
+    vector = [float(value) for value in query_vector]
+    response = _pinecone_call(vector_store, lambda index: index.query(
+        vector=vector, top_k=k, include_values=True, include_metadata=True, namespace=vector_store._namespace,
+    ))
+    # langchain_pinecone keeps the chunk text in the metadata under its text key
+    text_key = getattr(vector_store, "_text_key", "text")
+    hits = []
+    for match in response.matches:
+        metadata = dict(match.metadata or {})
+        text = metadata.pop(text_key, None)
+        if text is None:
+            continue  # not written by this app
+        hits.append((Document(id=match.id, page_content=text, metadata=metadata), np.asarray(match.values, dtype=np.float32)))
+    return hits
+
+
+def fetch_vectors(vector_store, ids: list) -> dict:
+    """Returns the stored vectors of the given ids (id -> vector); ids that are not stored are left out."""
+    ids = [doc_id for doc_id in ids if doc_id]
+    if not ids:
+        return {}
+    if isinstance(vector_store, LocalVectorStore):
+        return vector_store.store.get_vectors(ids)
+    response = _pinecone_call(vector_store, lambda index: index.fetch(ids=ids, namespace=vector_store._namespace))
+    return {doc_id: np.asarray(record.values, dtype=np.float32) for doc_id, record in response.vectors.items()}
+
+
+def add_embeddings(vector_store, ids: list, documents: list, vectors: list) -> None:
+    """
+    Upserts documents whose embeddings were already computed, skipping the store's own embedding step.
+
+    Args:
+        vector_store: Store returned by get_vector_store()
+        ids (list): One id per document
+        documents (list): LangChain Documents
+        vectors (list): One embedding per document
+    """
+    if isinstance(vector_store, LocalVectorStore):
+        vector_store.store.add(ids, [doc.page_content for doc in documents], [dict(doc.metadata) for doc in documents], vectors)
+        return
+    # langchain_pinecone keeps the chunk text in the metadata under its text key
+    text_key = getattr(vector_store, "_text_key", "text")
+    records = []
+    for doc_id, doc, vector in zip(ids, documents, vectors):
+        metadata = dict(doc.metadata)
+        metadata[text_key] = doc.page_content
+        records.append((doc_id, list(vector), metadata))
+    _pinecone_call(vector_store, lambda index: index.upsert(vectors=records, namespace=vector_store._namespace))
+
+
+def get_store_namespace(vector_store) -> str:
+    """Returns the namespace a store returned by get_vector_store() is bound to."""
+    if isinstance(vector_store, LocalVectorStore):
+        return vector_store.namespace
+    return vector_store._namespace
+
+
+def list_ids(vector_store, prefix: str) -> set:
+    """Returns the ids stored in the store's namespace that start with prefix."""
+    if isinstance(vector_store, LocalVectorStore):
+        store = vector_store.store
+        with store.lock:
+            return {doc_id for doc_id in store.ids if doc_id.startswith(prefix)}
+    def list_pages(index):
+        ids = set()
+        # Index.list() pages through ids by prefix (serverless indexes)
+        for page in index.list(prefix=prefix, namespace=vector_store._namespace):
+            ids.update(page)
+        return ids
+    return _pinecone_call(vector_store, list_pages)
+
+
+def delete_ids(vector_store, ids) -> None:
+    """Deletes the given ids from the store's namespace."""
+    ids = list(ids)
+    if not ids:
+        return
+    if isinstance(vector_store, LocalVectorStore):
+        vector_store.store.delete(ids)
+        return
+    # Pinecone accepts at most 1000 ids per delete request
+    for start in range(0, len(ids), 1000):
+        batch = ids[start:start + 1000]
+        _pinecone_call(vector_store, lambda index: index.delete(ids=batch, namespace=vector_store._namespace))
@@ -0,0 +1,586 @@
+#this file stores namespace vectors on disk as append-only, quantized segments that are searched through memory maps
+import os
+import re
+import json
+import hashlib
+import threading
+from array import array
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: there is no inter-process lock, so only one process may use a namespace
+    fcntl = None
+
+VECTOR_SEGMENT_DIR = os.getenv("VECTOR_SEGMENT_DIR", "cache/vectors")
+VECTOR_SEGMENT_DTYPE = os.getenv("VECTOR_SEGMENT_DTYPE", "float16")  # "float16" (2x smaller) or "int8" (~4x smaller)
+VECTOR_SEGMENT_ROWS = int(os.getenv("VECTOR_SEGMENT_ROWS", "65536"))  # rows per segment before a new one is started
+VECTOR_SEGMENT_COMPACT_RATIO = float(os.getenv("VECTOR_SEGMENT_COMPACT_RATIO", "0.3"))  # deleted share that triggers compaction
+VECTOR_SEGMENT_COMPACT_MIN_ROWS = 64  # fewer deleted rows than this are never worth a rewrite
+SEARCH_BLOCK_ROWS = 32768  # rows dequantized at a time, bounds the temporary float32 memory of a search
+
+_dtypes = {"float16": np.float16, "int8": np.int8}
+_segment_file = re.compile(r"^seg-\d+-\d+\.(vec|scale|meta)$")
+
+
+def namespace_dir(namespace: str) -> str:
+    """Directory of a namespace: a readable prefix plus a hash, so any namespace string is a safe file name."""
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", namespace)[:40]
+    return os.path.join(VECTOR_SEGMENT_DIR, f"{safe}-{hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:12]}")
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> tuple:
+    """
+    Quantizes row-normalized float32 vectors.
+
+    Returns:
+        tuple: (quantized rows, per-row float32 scales or None). int8 rows are scaled so the largest
+        component maps to 127; a score is then (row @ query) * scale.
+    """
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+    raise ValueError(f"Unknown VECTOR_SEGMENT_DTYPE '{dtype}'. Use 'float16' or 'int8'.")
+
+
+def dequantize(rows, scales) -> np.ndarray:
+    """float32 vectors of stored rows; scales are the rows' int8 scales, or None for float16."""
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows if scales is None else rows * np.asarray(scales, dtype=np.float32)[..., None]
+
+
+def _write_atomic(path: str, text: str) -> None:
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class _Segment:
+    """
+    One append-only segment: <name>.vec (quantized rows), <name>.scale (int8 only) and <name>.meta,
+    a JSON-lines sidecar with the id, text and metadata of each row. Vectors are read through a memory
+    map and hit texts with pread, so an open segment keeps only ids, offsets and a live mask in RAM.
+    """
+
+    def __init__(self, directory: str, name: str, dtype: str, dimension: int):
+        self.name = name
+        self.dtype = dtype
+        self.dimension = dimension
+        self.vec_path = os.path.join(directory, name + ".vec")
+        self.scale_path = os.path.join(directory, name + ".scale")
+        self.meta_path = os.path.join(directory, name + ".meta")
+        self.ids = []
+        self.offsets = array("q", [0])  # start of each meta line, plus the end of the last one
+        self.live = np.zeros(0, dtype=bool)
+        self._map = None
+        self._scales = None
+        self._mapped_rows = 0
+        # Kept open for the segment's lifetime: hit texts are read with pread, and searches that started
+        # before a compaction can still read the sidecar after its file is removed
+        self._meta_fd = os.open(self.meta_path, os.O_RDONLY | os.O_CREAT, 0o644)
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    def load(self) -> int:
+        """
+        Reads rows appended since the last call (all rows on the first), e.g. by another process.
+        Called under the namespace file lock, so no append is in progress: rows missing from any file
+        were left by a crash mid-append and are cut off.
+
+        Returns:
+            int: Number of rows read
+        """
+        row_bytes = self.dimension * np.dtype(_dtypes[self.dtype]).itemsize
+        rows = os.path.getsize(self.vec_path) // row_bytes if os.path.exists(self.vec_path) else 0
+        if self.dtype == "int8":
+            rows = min(rows, os.path.getsize(self.scale_path) // 4 if os.path.exists(self.scale_path) else 0)
+        position = self.offsets[-1]
+        if rows == self.count and os.path.getsize(self.meta_path) == position:
+            return 0
+        first = self.count
+        with open(self.meta_path, "rb") as file:
+            file.seek(position)
+            for line in file:
+                if len(self.ids) == rows or not line.endswith(b"\n"):
+                    break
+                self.ids.append(json.loads(line)["id"])
+                position += len(line)
+                self.offsets.append(position)
+        rows = len(self.ids)
+        for path, size in ((self.vec_path, rows * row_bytes), (self.scale_path, rows * 4), (self.meta_path, position)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+        self.live = np.concatenate([self.live, np.ones(rows - first, dtype=bool)])
+        return rows - first
+
+    def append(self, ids: list, texts: list, metadatas: list, quantized: np.ndarray, scales) -> None:
+        lines = [
+            (json.dumps({"id": doc_id, "text": text, "metadata": metadata}, default=str) + "\n").encode("utf-8")
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        self.append_raw(ids, lines, quantized, scales)
+
+    def append_raw(self, ids: list, lines: list, quantized: np.ndarray, scales) -> None:
+        """Appends rows as stored: quantized vectors, their scales and encoded sidecar lines."""
+        with open(self.vec_path, "ab") as file:
+            file.write(quantized.tobytes())
+        if scales is not None:
+            with open(self.scale_path, "ab") as file:
+                file.write(scales.tobytes())
+        # The sidecar is written last: rows are only complete once their meta line exists
+        with open(self.meta_path, "ab") as file:
+            file.write(b"".join(lines))
+        for line in lines:
+            self.offsets.append(self.offsets[-1] + len(line))
+        self.ids.extend(ids)
+        self.live = np.concatenate([self.live, np.ones(len(ids), dtype=bool)])
+
+    def vectors(self) -> tuple:
+        """(memory-mapped rows, scales or None), re-mapped when rows were appended since the last call."""
+        if self._mapped_rows != self.count:
+            dtype = _dtypes[self.dtype]
+            self._map = np.memmap(self.vec_path, dtype=dtype, mode="r", shape=(self.count, self.dimension)) if self.count else None
+            if self.dtype == "int8" and self.count:
+                self._scales = np.memmap(self.scale_path, dtype=np.float32, mode="r", shape=(self.count,))
+            self._mapped_rows = self.count
+        return self._map, self._scales
+
+    def read_meta(self, row: int) -> dict:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return json.loads(os.pread(self._meta_fd, end - start, start))
+
+    def raw_rows(self, rows, vectors, scales) -> tuple:
+        """
+        Quantized rows, scales and sidecar lines of the given rows, for compaction (no re-quantization).
+        vectors and scales are maps from vectors(), taken under the namespace lock.
+        """
+        lines = []
+        with open(self.meta_path, "rb") as file:
+            for row in rows:
+                file.seek(self.offsets[row])
+                lines.append(file.read(self.offsets[row + 1] - self.offsets[row]))
+        return np.asarray(vectors[rows]), None if scales is None else np.asarray(scales[rows]), lines
+
+    def close(self) -> None:
+        if self._meta_fd is not None:
+            os.close(self._meta_fd)
+            self._meta_fd = None
+        self._map = self._scales = None
+        self._mapped_rows = 0
+
+    def __del__(self):
+        self.close()
+
+    def remove_files(self) -> None:
+        # Open maps and the sidecar descriptor stay valid after unlinking, for searches still running
+        for path in (self.vec_path, self.scale_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SegmentNamespace:
+    """
+    Vectors of one namespace in append-only on-disk segments (float16 or int8), with the same
+    add/delete/search interface as the in-memory NumpyNamespace. Deletes and upserts write
+    tombstones; once deleted rows pass VECTOR_SEGMENT_COMPACT_RATIO, a background thread rewrites
+    the live rows into new segments.
+
+    Several processes (API workers) may use the same namespace: writes hold an flock on the
+    namespace directory, and every operation first reads what other processes appended, deleted or
+    compacted since (see _sync).
+
+    Args:
+        namespace (str): Namespace name, e.g. "user_42"
+        dtype (str): Storage type of new namespaces; existing ones keep the type in their manifest
+    """
+
+    def __init__(self, namespace: str, dtype: str = VECTOR_SEGMENT_DTYPE):
+        self.namespace = namespace
+        self.directory = namespace_dir(namespace)
+        self.lock = threading.RLock()
+        self.dtype = dtype
+        self.dimension = None
+        self.generation = 0
+        self.segments = []
+        self.locations = {}  # id -> (segment, row)
+        self.deleted = 0
+        self._compacting = False
+        self._lock_fd = None
+        self._lock_depth = 0
+        self._manifest_key = None  # (inode, mtime, size) of the manifest last read
+        self._tombstone_inode = None
+        self._tombstones_read = 0  # bytes of the tombstone log applied so far
+        quantize(np.zeros((1, 1), dtype=np.float32), dtype)  # rejects unknown types up front
+        with self._locked():
+            pass
+
+    def __del__(self):
+        if getattr(self, "_lock_fd", None) is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    @property
+    def ids(self) -> list:
+        with self._locked():
+            return list(self.locations)
+
+    @property
+    def count(self) -> int:
+        with self._locked():
+            return len(self.locations)
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "manifest.json")
+
+    def _tombstone_path(self) -> str:
+        return os.path.join(self.directory, "tombstones.log")
+
+    @contextmanager
+    def _locked(self):
+        """
+        Holds self.lock and the namespace's file lock, and brings this instance up to date with the
+        files first. Re-entrant: only the outermost call takes the file lock and syncs.
+        """
+        with self.lock:
+            outermost = self._lock_depth == 0
+            locked = outermost and fcntl is not None and os.path.isdir(self.directory)
+            if locked:
+                if self._lock_fd is None:
+                    self._lock_fd = os.open(os.path.join(self.directory, "namespace.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                if outermost:
+                    self._sync()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if locked:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _compaction_lock(self):
+        """Tries to take the namespace's compaction flock without waiting; yields whether it was taken."""
+        if fcntl is None or not os.path.isdir(self.directory):
+            yield True
+            return
+        fd = os.open(os.path.join(self.directory, "compact.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _sync(self) -> None:
+        """
+        Catches up with changes other processes made to the files: segments added to the manifest,
+        rows appended to segments and new tombstones. A new generation (a compaction elsewhere)
+        reloads the namespace. Only a few stat calls when nothing changed.
+        """
+        try:
+            stat = os.stat(self._manifest_path())
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self._manifest_key:
+            with open(self._manifest_path()) as file:
+                manifest = json.load(file)
+            names = manifest["segments"]
+            if self.dimension is None or manifest["generation"] != self.generation or names[:len(self.segments)] != [segment.name for segment in self.segments]:
+                # Segment objects are dropped, not closed: searches still running keep reading them
+                self.segments, self.locations = [], {}
+                self._tombstone_inode, self._tombstones_read = None, 0
+                self.dtype, self.dimension, self.generation = manifest["dtype"], manifest["dimension"], manifest["generation"]
+                self._remove_orphans(set(names))
+            self.segments += [_Segment(self.directory, name, self.dtype, self.dimension) for name in names[len(self.segments):]]
+            self._manifest_key = key
+        for segment in self.segments:
+            if segment.count >= VECTOR_SEGMENT_ROWS:
+                continue  # full segments never grow
+            first = segment.count
+            segment.load()
+            for row in range(first, segment.count):
+                # A later row with the same id is an upsert of an earlier one
+                previous = self.locations.get(segment.ids[row])
+                if previous is not None:
+                    previous[0].live[previous[1]] = False
+                self.locations[segment.ids[row]] = (segment, row)
+        self._read_tombstones()
+        self.deleted = sum(segment.count for segment in self.segments) - len(self.locations)
+
+    def _read_tombstones(self) -> None:
+        """Applies tombstone log lines written since the last call; re-applying a line changes nothing."""
+        try:
+            stat = os.stat(self._tombstone_path())
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._tombstone_inode:
+            # Rewritten by a compaction
+            self._tombstone_inode, self._tombstones_read = stat.st_ino, 0
+        if stat.st_size <= self._tombstones_read:
+            return
+        with open(self._tombstone_path(), "rb") as file:
+            file.seek(self._tombstones_read)
+            data = file.read()
+        data = data[:data.rfind(b"\n") + 1]  # a torn last line is read again next time
+        by_name = {segment.name: segment for segment in self.segments}
+        for line in data.decode("utf-8").splitlines():
+            name, _, row = line.partition(" ")
+            segment = by_name.get(name)
+            if segment is None or not row.isdigit() or int(row) >= segment.count:
+                continue  # tombstone of a compacted segment
+            segment.live[int(row)] = False
+            if self.locations.get(segment.ids[int(row)]) == (segment, int(row)):
+                del self.locations[segment.ids[int(row)]]
+        self._tombstones_read += len(data)
+
+    def _remove_orphans(self, names: set) -> None:
+        """Deletes segment files the manifest does not name, e.g. left by a compaction that failed or crashed."""
+        with self._compaction_lock() as idle:
+            if not idle:
+                return  # a compaction is writing segments the manifest does not name yet
+            for file_name in os.listdir(self.directory):
+                stem, extension = os.path.splitext(file_name)
+                orphan = _segment_file.match(file_name) and stem not in names
+                if orphan or extension == ".tmp":
+                    os.remove(os.path.join(self.directory, file_name))
+
+    def _save_manifest(self, segments: list = None, generation: int = None) -> None:
+        _write_atomic(self._manifest_path(), json.dumps({
+            "dtype": self.dtype,
+            "dimension": self.dimension,
+            "generation": self.generation if generation is None else generation,
+            "segments": [segment.name for segment in (self.segments if segments is None else segments)],
+        }))
+
+    def _new_segment(self) -> _Segment:
+        name = f"seg-{self.generation:04d}-{len(self.segments):06d}"
+        segment = _Segment(self.directory, name, self.dtype, self.dimension)
+        self.segments.append(segment)
+        self._save_manifest()
+        return segment
+
+    def _tombstone(self, locations: list) -> None:
+        if not locations:
+            return
+        with open(self._tombstone_path(), "a") as file:
+            file.write("".join(f"{segment.name} {row}\n" for segment, row in locations))
+            # _sync read the log up to its end before this write, so all of it is applied now
+            self._tombstone_inode, self._tombstones_read = os.fstat(file.fileno()).st_ino, file.tell()
+        for segment, row in locations:
+            segment.live[row] = False
+        self.deleted += len(locations)
+
+    def add(self, ids: list, texts: list, metadatas: list, vectors) -> None:
+        """Appends vectors; ids that are already stored are replaced (upsert)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or not len(vectors):
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        quantized, scales = quantize(vectors, self.dtype)
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked():
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            if vectors.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match namespace dimension {self.dimension}")
+            self._tombstone([self.locations.pop(doc_id) for doc_id in dict.fromkeys(ids) if doc_id in self.locations])
+            start = 0
+            while start < len(ids):
+                segment = self.segments[-1] if self.segments and self.segments[-1].count < VECTOR_SEGMENT_ROWS else self._new_segment()
+                end = min(len(ids), start + VECTOR_SEGMENT_ROWS - segment.count)
+                first_row = segment.count
+                segment.append(ids[start:end], texts[start:end], metadatas[start:end],
+                               quantized[start:end], None if scales is None else scales[start:end])
+                for offset, doc_id in enumerate(ids[start:end]):
+                    previous = self.locations.get(doc_id)
+                    if previous is not None:
+                        # The same id twice in one batch: the last one wins
+                        self._tombstone([previous])
+                    self.locations[doc_id] = (segment, first_row + offset)
+                start = end
+        self._maybe_compact()
+
+    def delete(self, ids: list) -> None:
+        with self._locked():
+            locations = [self.locations.pop(doc_id) for doc_id in set(ids) if doc_id in self.locations]
+            self._tombstone(locations)
+        self._maybe_compact()
+
+    def search(self, queries, k: int, include_vectors: bool = False) -> list:
+        """
+        Top-k cosine search for one or many queries directly over the memory-mapped segments.
+
+        Returns:
+            list: For every query, a list of {"id", "text", "metadata", "score"} hits ordered by score,
+            plus the dequantized "vector" with include_vectors
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1.0, norms)
+        with self._locked():
+            # Compaction swaps in new segment objects, so these stay readable after the lock is released
+            segments = [(segment, *segment.vectors(), segment.live, segment.count) for segment in self.segments]
+        best = [[] for _ in range(len(queries))]  # per query: (score, segment, row) candidates
+        maps = {segment: (vectors, scales) for segment, vectors, scales, _, _ in segments}
+        for segment, vectors, scales, live, count in segments:
+            for start in range(0, count, SEARCH_BLOCK_ROWS):
+                end = min(start + SEARCH_BLOCK_ROWS, count)
+                scores = np.asarray(vectors[start:end], dtype=np.float32) @ queries.T
+                if scales is not None:
+                    scores *= np.asarray(scales[start:end])[:, None]
+                scores[~live[start:end]] = -np.inf
+                take = min(k, end - start)
+                for q in range(len(queries)):
+                    column = scores[:, q]
+                    rows = np.argpartition(-column, take - 1)[:take] if take < end - start else np.arange(end - start)
+                    best[q].extend((float(column[row]), segment, start + int(row)) for row in rows if column[row] > -np.inf)
+        results = []
+        for candidates in best:
+            candidates.sort(key=lambda hit: -hit[0])
+            hits = []
+            for score, segment, row in candidates[:k]:
+                meta = segment.read_meta(row)
+                hit = {"id": meta["id"], "text": meta["text"], "metadata": meta["metadata"], "score": score}
+                if include_vectors:
+                    vectors, scales = maps[segment]
+                    hit["vector"] = dequantize(vectors[row], None if scales is None else scales[row])
+                hits.append(hit)
+            results.append(hits)
+        return results
+
+    def get_vectors(self, ids: list) -> dict:
+        """Dequantized vectors of the given ids; ids that are not stored are left out."""
+        with self._locked():
+            found = {}
+            for doc_id in ids:
+                location = self.locations.get(doc_id)
+                if location is not None:
+                    segment, row = location
+                    vectors, scales = segment.vectors()
+                    found[doc_id] = dequantize(vectors[row], None if scales is None else scales[row])
+            return found
+
+    def _maybe_compact(self) -> None:
+        total = self.deleted + len(self.locations)
+        if self._compacting or self.deleted < VECTOR_SEGMENT_COMPACT_MIN_ROWS or self.deleted < total * VECTOR_SEGMENT_COMPACT_RATIO:
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name=f"compact-{self.namespace}", daemon=True).start()
+
+    def _copy_rows(self, segment: _Segment, rows, vectors, scales, targets: list, generation: int, moved: dict) -> None:
+        """
+        Appends rows of an old segment, as stored, to the newest target segment, starting new ones as
+        needed, and records where each row went in moved ((old segment, row) -> (new segment, row)).
+        """
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            block = rows[start:start + SEARCH_BLOCK_ROWS]
+            block_vectors, block_scales, lines = segment.raw_rows(block, vectors, scales)
+            position = 0
+            while position < len(lines):
+                target = targets[-1] if targets and targets[-1].count < VECTOR_SEGMENT_ROWS else None
+                if target is None:
+                    name = f"seg-{generation:04d}-{len(targets):06d}"
+                    # A compaction to this generation that failed earlier may have left files under this name
+                    for extension in (".vec", ".scale", ".meta"):
+                        path = os.path.join(self.directory, name + extension)
+                        if os.path.exists(path):
+                            os.remove(path)
+                    target = _Segment(self.directory, name, self.dtype, self.dimension)
+                    targets.append(target)
+                end = min(len(lines), position + VECTOR_SEGMENT_ROWS - target.count)
+                first_row = target.count
+                target.append_raw([json.loads(line)["id"] for line in lines[position:end]], lines[position:end],
+                                  block_vectors[position:end], None if block_scales is None else block_scales[position:end])
+                for offset, row in enumerate(block[position:end]):
+                    moved[(segment, int(row))] = (target, first_row + offset)
+                position = end
+
+    def compact(self) -> None:
+        """
+        Rewrites the live rows into segments of a new generation, then swaps the manifest and removes
+        the old files. Rows are copied as stored, so compaction adds no quantization error.
+
+        The bulk copy works on a snapshot without holding the lock, so writes and searches go on
+        meanwhile; the lock is only taken again to carry over what changed and swap the segments in.
+        Other processes keep writing too, and load the new generation on their next operation; a
+        separate flock keeps two of them from compacting the namespace at once.
+        Nothing in memory changes before the new manifest is written, so a failed compaction leaves the
+        namespace as it was (its files are removed now, or as orphans on the next load).
+        """
+        targets = []
+        try:
+            with self._compaction_lock() as idle:
+                if not idle:
+                    return  # another process is compacting this namespace
+                with self._locked():
+                    if not self.deleted:
+                        return
+                    generation = self.generation + 1
+                    snapshot = [(segment, segment.count, segment.live.copy(), *segment.vectors()) for segment in self.segments]
+                moved = {}
+                for segment, count, live, vectors, scales in snapshot:
+                    self._copy_rows(segment, np.flatnonzero(live[:count]), vectors, scales, targets, generation, moved)
+
+                with self._locked():
+                    old_segments = [segment for segment, *_ in snapshot]
+                    # Rows appended to the old segments meanwhile are copied too; segments started meanwhile are kept
+                    for segment, count, *_ in snapshot:
+                        if segment.count > count:
+                            rows = count + np.flatnonzero(segment.live[count:])
+                            self._copy_rows(segment, rows, *segment.vectors(), targets, generation, moved)
+                    kept = self.segments[len(old_segments):]
+                    # Rows deleted or replaced during the copy are dead in the copy as well
+                    for (segment, row), (target, new_row) in moved.items():
+                        if not segment.live[row]:
+                            target.live[new_row] = False
+                    locations = {doc_id: moved.get(location, location) for doc_id, location in self.locations.items()}
+                    segments = targets + kept
+                    # Tombstones are written for both manifests: entries of the current segments stay (the old
+                    # manifest may still be the one loaded) and the new segments' dead rows are added; entries
+                    # naming segments of neither, e.g. of an earlier failed compaction, are dropped
+                    current = {segment.name for segment in self.segments}
+                    entries = []
+                    if os.path.exists(self._tombstone_path()):
+                        with open(self._tombstone_path()) as file:
+                            entries = [line for line in file if line.endswith("\n") and line.partition(" ")[0] in current]
+                    entries += [f"{target.name} {row}\n" for target in targets for row in np.flatnonzero(~target.live)]
+                    _write_atomic(self._tombstone_path(), "".join(entries))
+                    stat = os.stat(self._tombstone_path())
+                    self._tombstone_inode, self._tombstones_read = stat.st_ino, stat.st_size
+                    # The new manifest is the commit point
+                    self._save_manifest(segments, generation)
+                    self.segments, self.generation, self.locations = segments, generation, locations
+                    self.deleted = sum(segment.count for segment in segments) - len(locations)
+                    targets = []
+                for segment in old_segments:
+                    segment.remove_files()
+        except Exception:
+            for target in targets:
+                target.close()
+                target.remove_files()
+            raise
+        finally:
+            self._compacting = False
+
+    def storage_bytes(self) -> int:
+        return sum(
+            os.path.getsize(path)
+            for segment in self.segments
+            for path in (segment.vec_path, segment.scale_path, segment.meta_path)
+            if os.path.exists(path)
+        )
@@ -1,33 +1,46 @@
 import os
+import threading
 from dotenv import load_dotenv
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from pinecone import Pinecone
-from services.pinecone_init import create_pinecone_index
+from services.vector_backend import get_vector_store
+from services.ingestion import ingest_documents
+from services.embedding_cache import CachedEmbeddings, get_embedding_cache
+from services.context_builder import ContextRetriever
 
 load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
-os.environ["PINECONE_API_KEY"] = os.getenv("PINECONE_API_KEY")
 
 retrieved_vector = None
+EMBEDDING_MODEL = "models/embedding-001"
+_embeddings = None
+_embeddings_lock = threading.Lock()
 
 #load the embeddings 
 def get_embeddings():
-    """Loads Google Generative AI embeddings."""
+    """
+    Loads Google Generative AI embeddings behind the on-disk embedding cache.
+    The client (and langchain_google_genai) is loaded on first use and built once per process,
+    so its connection is reused by every request.
+    """
+    global _embeddings
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            api_key=GOOGLE_API_KEY
-        )
-        return embeddings
+        with _embeddings_lock:
+            if _embeddings is None:
+                google_api_key = os.getenv("GOOGLE_API_KEY")
+                if not google_api_key:
+                    raise ValueError("GOOGLE_API_KEY is not set.")
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                embeddings = GoogleGenerativeAIEmbeddings(
+                    model=EMBEDDING_MODEL,
+                    api_key=google_api_key
+                )
+                _embeddings = CachedEmbeddings(embeddings, EMBEDDING_MODEL, get_embedding_cache())
+        return _embeddings
     except Exception as e:
         print(f"Error: {e}")
 
 #load the vector store
 def vector_store(final_texts, user_id=None, is_private=False): #pass the user_id and is_private from the database.py file
     """
-    Stores extracted text in Pinecone for retrieval.
+    Stores extracted text in the configured vector backend for retrieval.
 
     Args:
         final_texts (list): List of documents to store.
@@ -40,14 +53,10 @@ def vector_store(final_texts, user_id=None, is_private=False): #pass the user_id
     global retrieved_vector
     try:
         embedding = get_embeddings()
-        # Get Pinecone index and namespace
-        pinecone_info = create_pinecone_index(user_id, is_private)
-        index = pinecone_info["index"]
-        namespace = pinecone_info["namespace"]
-        # Initialize Pinecone vector store
-        vector_store = Pinecone(index, embedding, namespace=namespace)
-        # Store documents
-        vector_store.add_documents(final_texts)
+        # Initialize the vector store for the public or private namespace
+        vector_store = get_vector_store(embedding, user_id, is_private)
+        # Store documents in concurrent batches
+        ingest_documents(vector_store, final_texts)
         # Set retriever
         retrieved_vector = vector_store
         return {"message": "Vector store created successfully", "retrieved_vector": retrieved_vector}
@@ -62,7 +71,7 @@ def retriver_data(vector_store):
         print("vector store is not created")
         return None
     try:
-        retriever = vector_store.as_retriever(search_kwargs={"k": 2})
+        retriever = ContextRetriever(vector_store=vector_store)  # token-budgeted, diversified context
         return retriever
     except Exception as e:
         print(f"Error: {e}")
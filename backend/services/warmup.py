@@ -0,0 +1,57 @@
+#this file warms lazily loaded providers and libraries in the background and reports readiness
+import os
+import time
+import threading
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+_warmers = {}  # name -> callable
+_status = {}   # name -> {"state", "seconds", "error"}
+_lock = threading.Lock()
+_thread = None
+
+
+def register(name: str, func) -> None:
+    """Adds a warm-up step: func loads a library or builds a client, raising if it cannot."""
+    with _lock:
+        _warmers[name] = func
+        _status.setdefault(name, {"state": "cold"})
+
+
+def _run() -> None:
+    for name, func in list(_warmers.items()):
+        with _lock:
+            _status[name] = {"state": "warming"}
+        start = time.perf_counter()
+        try:
+            func()
+            status = {"state": "ready"}
+        except Exception as e:
+            # A missing credential only disables that provider; the other steps still run
+            status = {"state": "failed", "error": str(e) or type(e).__name__}
+        status["seconds"] = round(time.perf_counter() - start, 3)
+        with _lock:
+            _status[name] = status
+
+
+def start_warmup() -> bool:
+    """Starts warming every registered step on a background thread; False if it is already running."""
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        _thread = threading.Thread(target=_run, name="warmup", daemon=True)
+        _thread.start()
+    return True
+
+
+def readiness() -> dict:
+    """
+    Warm-up state per step. The server is ready once no step is still warming (and, with
+    WARMUP_ON_STARTUP, once warm-up has finished), so a load balancer can hold traffic until then.
+    """
+    with _lock:
+        status = {name: dict(value) for name, value in _status.items()}
+        running = _thread is not None and _thread.is_alive()
+    ready = not running and not (WARMUP_ON_STARTUP and any(value["state"] == "cold" for value in status.values()))
+    return {"ready": ready, "warming": running, "providers": status}
@@ -1,51 +1,193 @@
+import io
 import os
+import re
 import zipfile
-from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from datetime import datetime
+from services.chunks import chunk_text, CHUNK_OVERLAP
 
-def extract_whatsapp_chat(zip_path):
-    extracted_folder = "unzipped_chats"
-    os.makedirs(extracted_folder, exist_ok=True)
+WHATSAPP_DAYFIRST = os.getenv("WHATSAPP_DAYFIRST", "true").lower() == "true"  # 05/04/2024 is 5 April, unless the file shows otherwise
+WHATSAPP_WINDOW_MINUTES = int(os.getenv("WHATSAPP_WINDOW_MINUTES", "30"))  # a longer silence starts a new chunk
+WHATSAPP_CHUNK_CHARS = int(os.getenv("WHATSAPP_CHUNK_CHARS", "1000"))
 
-    # Extract ZIP file
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extracted_folder)
+# Android: "05/04/2024, 21:09 - Sender: text"   iOS: "[05/04/2024, 21:09:32] Sender: text"
+# Times may carry am/pm, often after a narrow no-break space; iOS lines may start with a left-to-right mark
+_time = r"(\d{1,2}:\d{2}(?::\d{2})?(?:[\s\u202f]*[APap]\.?[Mm]\.?)?)"
+_date = r"(\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4})"
+_header = re.compile(
+    r"^[\u200e\u200f]?(?:" + _date + r",?\s+" + _time + r"\s+-\s+"
+    r"|\[" + _date + r",?\s+" + _time + r"\]\s+)(.*)$"
+)
+_date_split = re.compile(r"[/.\-]")
 
-    chat_files = [f for f in os.listdir(extracted_folder) if f.endswith(".txt")]
-    if not chat_files:
-        print("No chat file found!")
-        return None
 
-    chat_file_path = os.path.join(extracted_folder, chat_files[0])
+def _header_dates(match):
+    return (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+
+
+def detect_dayfirst(lines, default=WHATSAPP_DAYFIRST) -> bool:
+    """
+    Decides the day/month order of a whole export from its first date with a component above 12
+    (e.g. 25/04/2024 is day first, 04/25/2024 month first). Every line of an export uses the same
+    order, so it must not be guessed line by line. Falls back to default when no date settles it.
+    """
+    for line in lines:
+        match = _header.match(line)
+        if not match:
+            continue
+        first, second, _ = (int(part) for part in _date_split.split(_header_dates(match)[0]))
+        if first > 12 >= second:
+            return True
+        if second > 12 >= first:
+            return False
+    return default
+
 
-    # Read WhatsApp chat file
+def _parse_timestamp(date_text, time_text, dayfirst=WHATSAPP_DAYFIRST):
+    """Parses a WhatsApp date/time pair into a datetime, or None if it is not a valid date."""
+    first, second, year = (int(part) for part in _date_split.split(date_text))
+    if year < 100:
+        year += 2000
+    time_text = time_text.replace("\u202f", " ").replace(".", "").strip().upper()
+    meridiem = time_text[-2:] if time_text.endswith(("AM", "PM")) else None
+    clock = [int(part) for part in time_text.rstrip("APM ").split(":")]
+    hour, minute, second_of_minute = clock[0], clock[1], clock[2] if len(clock) > 2 else 0
+    if meridiem == "PM" and hour < 12:
+        hour += 12
+    elif meridiem == "AM" and hour == 12:
+        hour = 0
+    day, month = (first, second) if dayfirst else (second, first)
     try:
-        with open(chat_file_path, "r", encoding="utf-8") as file:
-            chat_text = file.readlines()
-
-        # Apply Markdown formatting
-        formatted_content = []
-        for line in chat_text:
-            line = line.strip()
-            if line.startswith("[") and "]" in line:  
-                formatted_content.append(f"**{line}**")  
-            elif ":" in line:  
-                formatted_content.append(f"**{line.split(':', 1)[0]}**: {line.split(':', 1)[1]}")  
-            else:
-                formatted_content.append(f"- {line}")  
-        # Save the formatted content back to the original file
-        with open(chat_file_path, "w", encoding="utf-8") as file:
-            file.write("\n".join(formatted_content))
-
-        print(f"Chat formatted and saved: {chat_file_path}")
-
-        return [Document(page_content="\n".join(formatted_content))]
-
-    except UnicodeDecodeError:
-        print("Error decoding file. Try opening it with another encoding.")
+        return datetime(year, month, day, hour, minute, second_of_minute)
+    except ValueError:
         return None
 
-    
 
+def iter_whatsapp_messages(lines, dayfirst=WHATSAPP_DAYFIRST):
+    """
+    Single-pass parser over the lines of a WhatsApp export; only the current message is held in memory.
+    Lines without a timestamp header continue the previous (multi-line) message.
+
+    Args:
+        lines: Iterable of text lines, e.g. an open file
+        dayfirst (bool): Day/month order of the export's dates, see detect_dayfirst()
+
+    Yields:
+        dict: {"timestamp": datetime, "sender": str or None (system messages), "text": str}
+    """
+    message = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        match = _header.match(line)
+        timestamp = None
+        if match:
+            timestamp = _parse_timestamp(*_header_dates(match), dayfirst=dayfirst)
+        if timestamp is None:
+            if message is not None:
+                message["text"] += "\n" + line
+            continue
+        if message is not None:
+            yield message
+        body = match.group(5)
+        sender, separator, text = body.partition(": ")
+        if not separator:
+            sender, text = None, body
+        message = {"timestamp": timestamp, "sender": sender, "text": text.lstrip("\u200e")}
+    if message is not None:
+        yield message
+
+
+def group_messages(messages, chat_name="", window_minutes=WHATSAPP_WINDOW_MINUTES, max_chars=WHATSAPP_CHUNK_CHARS):
+    """
+    Groups consecutive messages into conversation chunks: a new chunk starts after a silence longer than
+    window_minutes or when the chunk would exceed max_chars. A single message longer than max_chars is
+    split with chunk_text() into chunks of its own, each starting with the message's time and sender.
+
+    Yields:
+        dict: {"text": ..., "metadata": {"source", "chat", "start_time", "end_time", "senders", "messages"}}
+    """
+    lines, senders, start, end, size = [], [], None, None, 0
 
+    def chunk():
+        return {
+            "text": "\n".join(lines),
+            "metadata": {
+                "source": "whatsapp",
+                "chat": chat_name,
+                "start_time": start.isoformat(),
+                "end_time": end.isoformat(),
+                # epoch seconds so range filters work in the vector store
+                "start_ts": start.timestamp(),
+                "end_ts": end.timestamp(),
+                "senders": senders,
+                "messages": len(lines),
+            },
+        }
+
+    for message in messages:
+        sender = message["sender"] or "system"
+        header = f"[{message['timestamp']:%Y-%m-%d %H:%M}] {sender}: "
+        line = header + message["text"]
+        gap = (message["timestamp"] - end).total_seconds() / 60 if end else 0
+        if lines and (gap > window_minutes or size + len(line) > max_chars):
+            yield chunk()
+            lines, senders, size = [], [], 0
+        if len(line) > max_chars:
+            start = end = message["timestamp"]
+            piece_size = max(max_chars - len(header), 1)
+            for piece in chunk_text(message["text"], piece_size, min(CHUNK_OVERLAP, piece_size // 5), unit="chars"):
+                lines, senders = [header + piece], [sender]
+                yield chunk()
+            lines, senders, size = [], [], 0
+            continue
+        if not lines:
+            start = message["timestamp"]
+        lines.append(line)
+        if sender not in senders:
+            senders.append(sender)
+        size += len(line) + 1
+        end = message["timestamp"]
+    if lines:
+        yield chunk()
+
+
+def _chat_chunks(open_chat, chat_name):
+    """Parses one chat file in two streaming passes: the first only settles the date format."""
+    with open_chat() as lines:
+        dayfirst = detect_dayfirst(lines)
+    with open_chat() as lines:
+        return list(group_messages(iter_whatsapp_messages(lines, dayfirst=dayfirst), chat_name=chat_name))
+
+
+def extract_whatsapp_chat(zip_path, upload_name=None):
+    """
+    Parses the chats in a WhatsApp export into conversation chunks. The .txt chat members are
+    streamed straight out of the ZIP; media files are never read or extracted.
+
+    Args:
+        zip_path (str): Path to the exported ZIP file (a bare chat .txt also works)
+        upload_name (str, optional): The file name the user uploaded; names a bare .txt chat, since
+            the stored file is named after its content hash
+
+    Returns:
+        list: Chunk dicts with text and sender/time metadata, or None if no chat was found
+    """
+    # Undecodable bytes are replaced rather than failing the whole chat
+    if not zipfile.is_zipfile(zip_path):
+        open_chat = lambda: open(zip_path, "r", encoding="utf-8-sig", errors="replace")
+        return _chat_chunks(open_chat, os.path.splitext(os.path.basename(upload_name or zip_path))[0]) or None
+
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        chat_members = [
+            info for info in zip_ref.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(".txt")
+        ]
+        if not chat_members:
+            print("No chat file found!")
+            return None
 
+        chunks = []
+        for info in chat_members:
+            chat_name = os.path.splitext(os.path.basename(info.filename))[0]
+            open_chat = lambda: io.TextIOWrapper(zip_ref.open(info), encoding="utf-8-sig", errors="replace")
+            chunks.extend(_chat_chunks(open_chat, chat_name))
+    return chunks
@@ -1,22 +1,18 @@
-from dotenv import load_dotenv
-import os
-from youtube_transcript_api import YouTubeTranscriptApi
-
-load_dotenv()
-
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
-os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY")
+from services import metrics
 
 
 def extract_transcript(youtube_url):
     """Extracts transcript text from a YouTube video."""
     try:
+        from youtube_transcript_api import YouTubeTranscriptApi
         video_id = youtube_url.split("=")[1]
-        transcript = YouTubeTranscriptApi.get_transcript(video_id)
+        with metrics.stage("youtube_transcript"):
+            transcript = YouTubeTranscriptApi.get_transcript(video_id)
         transcript_text = ""
         for i in transcript:
             transcript_text += i['text']
         return transcript_text
     except Exception as e:
+        metrics.upstream_error("youtube")
         print(f"Error: {e}")
 
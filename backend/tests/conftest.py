@@ -0,0 +1,18 @@
+#this file points every store at a scratch directory and selects the local backends before the services are imported
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_workdir = tempfile.mkdtemp(prefix="insightify-tests-")
+os.environ.update({
+    "VECTOR_BACKEND": "local",
+    "EMBEDDING_CACHE_PATH": os.path.join(_workdir, "embeddings.sqlite3"),
+    "SESSION_STORE_PATH": os.path.join(_workdir, "sessions.sqlite3"),
+    "LEXICAL_INDEX_PATH": os.path.join(_workdir, "lexical.sqlite3"),
+    "UPLOAD_DIR": os.path.join(_workdir, "uploads"),
+    "TABLE_DIR": os.path.join(_workdir, "tables"),
+    "VECTOR_SEGMENT_DIR": os.path.join(_workdir, "vectors"),
+})
@@ -0,0 +1,50 @@
+import numpy as np
+from services.answer_cache import SemanticAnswerCache
+from services.session_store import bump_namespace_generation
+
+QUERY = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+NEAR_QUERY = np.array([1.0, 0.05, 0.0], dtype=np.float32)
+
+
+def test_near_duplicate_query_hits_within_its_scope():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("answers_scope", QUERY, "cached", token_budget=100)
+
+    assert cache.lookup("answers_scope", NEAR_QUERY, token_budget=100) == "cached"
+    assert cache.lookup("answers_scope", NEAR_QUERY, token_budget=200) is None
+    assert cache.lookup("answers_scope", np.array([0.0, 1.0, 0.0]), token_budget=100) is None
+
+
+def test_invalidate_drops_answers_in_every_worker():
+    writer, other_worker = SemanticAnswerCache(), SemanticAnswerCache()
+    for cache in (writer, other_worker):
+        cache.store("answers_ingest", QUERY, "before ingest")
+        assert cache.lookup("answers_ingest", QUERY) == "before ingest"
+
+    writer.invalidate("answers_ingest")
+
+    # The other cache only sees the bumped generation in the shared session store
+    assert other_worker.lookup("answers_ingest", QUERY) is None
+    assert writer.lookup("answers_ingest", QUERY) is None
+
+
+def test_answer_retrieved_before_an_ingest_is_not_stored():
+    cache = SemanticAnswerCache()
+    generation = cache.generation("answers_race")
+    bump_namespace_generation("answers_race")  # another worker ingests while the answer is generated
+
+    cache.store("answers_race", QUERY, "outdated", generation=generation)
+    assert cache.lookup("answers_race", QUERY) is None
+
+    cache.store("answers_race", QUERY, "current", generation=cache.generation("answers_race"))
+    assert cache.lookup("answers_race", QUERY) == "current"
+
+
+def test_other_namespaces_keep_their_answers():
+    cache = SemanticAnswerCache()
+    cache.store("answers_kept", QUERY, "kept")
+    cache.store("answers_changed", QUERY, "dropped")
+
+    cache.invalidate("answers_changed")
+    assert cache.lookup("answers_kept", QUERY) == "kept"
+    assert cache.lookup("answers_changed", QUERY) is None
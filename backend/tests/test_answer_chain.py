@@ -0,0 +1,42 @@
+import pytest
+from langchain_core.documents import Document
+import main
+from benchmarks.fakes import FakeChatModel
+from services.chunks import count_tokens
+
+
+class _FixedRetriever:
+    token_budget = 100
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def select(self, query, query_vector=None):
+        return {"documents": self.docs, "context_tokens": 3, "candidates": len(self.docs)}
+
+
+@pytest.fixture
+def chat_model(monkeypatch):
+    model = FakeChatModel(answer_tokens=5)
+    monkeypatch.setattr(main, "Model", model)
+    return model
+
+
+def test_prompt_tokens_count_the_chat_messages_sent(chat_model):
+    docs = [Document(page_content="alpha beta gamma"), Document(page_content="delta epsilon")]
+    result = main.retrieval_chain("what is alpha?", _FixedRetriever(docs))
+
+    prompt, _ = main.stuff_chain()
+    messages = prompt.format_messages(context="alpha beta gamma\n\ndelta epsilon", question="what is alpha?")
+    assert [message.type for message in messages] == ["system", "human"]
+    assert result["usage"]["prompt_tokens"] == sum(count_tokens(message.content) for message in messages)
+    assert result["result"] and len(result["sources"]) == 2
+
+
+def test_streaming_uses_the_same_chain(chat_model):
+    docs = [Document(page_content="alpha beta gamma")]
+    answer = main.retrieval_chain("what is alpha?", _FixedRetriever(docs))
+    events = list(main.stream_retrieval_chain("what is alpha?", _FixedRetriever(docs)))
+
+    assert events[1] == ("usage", answer["usage"])
+    assert "".join(text for kind, text in events if kind == "token").split() == answer["result"].split()
@@ -0,0 +1,85 @@
+import random
+import sys
+import threading
+import time
+import types
+import pytest
+from services import chunks
+from services.chunks import _spans, _token_offsets, chunk_text
+
+
+def _text(seed, paragraphs=30):
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "x" * 40, "epsilon,", "zeta.", "eta"]
+    return "\n\n".join(
+        "\n".join(" ".join(rng.choice(words) for _ in range(rng.randint(1, 25))) for _ in range(rng.randint(1, 4)))
+        for _ in range(paragraphs)
+    )
+
+
+def _units(text, start, end, unit):
+    if unit == "chars":
+        return end - start
+    return sum(1 for offset in _token_offsets(text) if start <= offset < end)
+
+
+@pytest.mark.parametrize("unit, size, overlap", [("chars", 200, 40), ("chars", 50, 0), ("tokens", 60, 12), ("tokens", 8, 3)])
+@pytest.mark.parametrize("seed", range(5))
+def test_span_invariants(unit, size, overlap, seed):
+    text = "  \n" + _text(seed) + "\n  "
+    spans = list(_spans(text, size, overlap, unit))
+    assert spans
+
+    covered = [False] * len(text)
+    for i, (start, end) in enumerate(spans):
+        assert 0 <= start < end <= len(text)
+        assert _units(text, start, end, unit) <= size
+        # Chunks never start or end on whitespace
+        assert not text[start].isspace() and not text[end - 1].isspace()
+        if i:
+            previous_start, previous_end = spans[i - 1]
+            assert start > previous_start and end > previous_end
+            # Consecutive chunks share at most overlap units
+            assert _units(text, start, previous_end, unit) <= overlap
+        for position in range(start, end):
+            covered[position] = True
+    # No text is lost between chunks
+    assert all(covered[position] or char.isspace() for position, char in enumerate(text))
+
+
+def test_hard_cut_without_break_points():
+    text = "y" * 250
+    # No word boundary to step back to, so hard cuts do not overlap
+    assert list(_spans(text, 100, 10, "chars")) == [(0, 100), (100, 200), (200, 250)]
+
+
+@pytest.mark.parametrize("size, overlap", [(0, 0), (100, 100), (100, -1)])
+def test_invalid_budgets_are_rejected(size, overlap):
+    with pytest.raises(ValueError):
+        chunk_text("some text", size, overlap, "chars")
+
+
+def test_unknown_unit_is_rejected():
+    with pytest.raises(ValueError, match="Unknown chunk unit"):
+        chunk_text("some text", 10, 0, "lines")
+
+
+def test_encoding_is_loaded_once_by_concurrent_callers(monkeypatch):
+    loads = []
+
+    def get_encoding(name):
+        loads.append(name)
+        time.sleep(0.05)  # a download would keep the other callers waiting here
+        raise OSError("offline")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", types.SimpleNamespace(get_encoding=get_encoding))
+    monkeypatch.setattr(chunks, "_encoding", None)
+    threads = [threading.Thread(target=chunks._get_encoding) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1 and chunks._encoding is False
+    with pytest.raises(RuntimeError, match="offline"):
+        chunks.load_tokenizer()
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from benchmarks.fakes import FakeEmbeddings
+from services.chunks import chunk_documents, count_tokens
+from services.context_builder import ContextRetriever, _trim_overlap, build_context, mmr_order
+from services.ingestion import document_key, sync_documents
+from services.vector_backend import LocalVectorStore, get_numpy_namespace
+
+TEXT = "".join(f"sentence {i} about topic {i % 7}. " for i in range(200))
+
+
+def _chunk(start, end, source="report.pdf"):
+    return Document(page_content=TEXT[start:end], metadata={"source": source, "start_offset": start, "end_offset": end, "chunk_index": 0})
+
+
+@pytest.mark.parametrize("spans, expected", [
+    ([], (100, 200)),
+    ([(0, 150)], (150, 200)),  # the head is covered
+    ([(150, 300)], (100, 150)),  # the tail is covered
+    ([(0, 120), (180, 300)], (120, 180)),  # both ends are covered
+    ([(50, 250)], None),  # covered entirely
+    ([(0, 100), (200, 300)], (100, 200)),  # neighbours that only touch it
+])
+def test_trim_overlap(spans, expected):
+    trimmed = _trim_overlap(_chunk(100, 200), spans)
+    if expected is None:
+        assert trimmed is None
+    else:
+        assert trimmed == (TEXT[expected[0]:expected[1]], *expected)
+
+
+def test_trim_overlap_accepts_float_offsets():
+    doc = _chunk(100, 200)
+    doc.metadata.update(start_offset=100.0, end_offset=200.0)  # as Pinecone returns them
+    assert _trim_overlap(doc, [(0, 150)]) == (TEXT[150:200], 150, 200)
+
+
+def test_mmr_prefers_a_diverse_second_pick():
+    relevance = [1.0, 0.95, 0.6]
+    similarity = np.array([[1.0, 0.99, 0.1], [0.99, 1.0, 0.1], [0.1, 0.1, 1.0]], dtype=np.float32)
+    assert mmr_order(relevance, similarity, lambda_mult=0.5) == [0, 2, 1]
+    assert mmr_order(relevance, similarity, lambda_mult=1.0) == [0, 1, 2]
+
+
+def test_overlapping_chunks_are_packed_once_within_the_budget():
+    candidates = [_chunk(0, 400), _chunk(300, 700), _chunk(600, 1000), _chunk(0, 400, source="other.pdf")]
+    budget = count_tokens(TEXT[0:700]) + 5
+    result = build_context(candidates, token_budget=budget)
+
+    texts = [doc.page_content for doc in result["documents"]]
+    assert texts[:2] == [TEXT[0:400], TEXT[400:700]]
+    assert result["documents"][1].metadata["start_offset"] == 400
+    assert result["context_tokens"] <= budget
+    # The copy from the other file repeats the first chunk word for word
+    assert result["dropped_duplicates"] >= 1 and TEXT[0:400] not in texts[2:]
+
+
+def test_oversized_best_chunk_is_truncated_rather_than_dropped():
+    result = build_context([_chunk(0, 2000)], token_budget=20)
+    (doc,) = result["documents"]
+    assert result["context_tokens"] <= 20 and TEXT.startswith(doc.page_content)
+    assert doc.metadata["end_offset"] == len(doc.page_content)
+
+
+def test_selection_reuses_stored_vectors_and_the_query_vector():
+    embeddings = FakeEmbeddings()
+    store = LocalVectorStore(embeddings, namespace="test_context_vectors")
+    chunks = chunk_documents([{"text": TEXT, "metadata": {"source": "pdf"}}], chunk_size=300, chunk_overlap=60)
+    sync_documents(store, {document_key("pdf", "d" * 64): [Document(page_content=chunk["text"], metadata=chunk["metadata"]) for chunk in chunks]})
+    query = "sentence 12 about topic 5"
+    query_vector = embeddings.embed_query(query)
+    calls, texts = embeddings.calls, embeddings.texts
+
+    result = ContextRetriever(vector_store=store, token_budget=300).select(query, query_vector=query_vector)
+    assert result["documents"]
+    assert (embeddings.calls, embeddings.texts) == (calls, texts)
+
+
+def test_stored_vectors_come_back_with_hits_and_by_id():
+    store = get_numpy_namespace("test_vectors_by_id")
+    vectors = np.random.default_rng(0).normal(size=(3, 8)).astype(np.float32)
+    store.add(["a", "b", "c"], ["a", "b", "c"], [{}, {}, {}], vectors)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    (hit, *_), = store.search(vectors[1], 3, include_vectors=True)
+    assert hit["id"] == "b" and np.allclose(hit["vector"], normalized[1])
+    found = store.get_vectors(["c", "missing"])
+    assert list(found) == ["c"] and np.allclose(found["c"], normalized[2])
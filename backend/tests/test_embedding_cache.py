@@ -0,0 +1,23 @@
+from services import embedding_cache
+from services.embedding_cache import EmbeddingCache
+
+
+def test_repeated_hits_do_not_write(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    cache.put_many({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+    changes = cache._conn.total_changes
+
+    assert cache.get_many(["a", "b", "c"]) == {"a": [1.0, 2.0], "b": [3.0, 4.0]}
+    assert cache._conn.total_changes == changes
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_stale_entries_are_refreshed_and_the_oldest_evicted(tmp_path, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_entries=2)
+    cache.put_many({"old": [1.0]})
+    cache.put_many({"newer": [2.0]})
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_TOUCH_SECONDS", 0)
+    cache.get_many(["old"])  # now the most recently used
+
+    cache.put_many({"newest": [3.0]})
+    assert set(cache.get_many(["old", "newer", "newest"])) == {"old", "newest"}
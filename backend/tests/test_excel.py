@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from services import excel
+from services.excel import iter_clean_batches
+
+
+def _reference(file_path):
+    """Cleans the whole file in memory with pandas: the rules iter_clean_batches applies batch by batch."""
+    df = pd.read_csv(file_path)
+    df = df.dropna(thresh=0.2 * len(df), axis=1)
+    df = df.fillna(df.mean(numeric_only=True))
+    for col in df.select_dtypes(exclude="number").columns:
+        df[col] = df[col].fillna(df[col].mode()[0])
+    return df.drop_duplicates()
+
+
+def _write_table(path, rows=600, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "amount": rng.integers(0, 50, rows).astype(float),
+        # a heavy hitter among many rare values, so the mode survives the pruned counters
+        "city": np.where(rng.random(rows) < 0.3, "Lagos", [f"city-{i}" for i in rng.integers(0, 400, rows)]),
+        "sparse": np.where(rng.random(rows) < 0.9, np.nan, 1.0),
+        "flag": rng.choice(["yes", "no"], rows),
+    })
+    df.loc[rng.choice(rows, 60, replace=False), "amount"] = np.nan
+    df.loc[rng.choice(rows, 60, replace=False), "city"] = None
+    df = pd.concat([df, df.iloc[:150]], ignore_index=True)  # duplicates spread over later batches
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(excel, "EXCEL_MODE_CANDIDATES", 20)
+    monkeypatch.setattr(excel, "EXCEL_DEDUPE_MEMORY_ROWS", 64)
+
+
+def test_batches_match_whole_file_cleaning(tmp_path, small_limits, monkeypatch):
+    path = _write_table(str(tmp_path / "table.csv"))
+    spill_dirs = []
+    spill = excel._SeenRows._spill
+
+    def recording_spill(self, run):
+        spilled = spill(self, run)
+        spill_dirs.append(self._spill_dir)
+        return spilled
+
+    monkeypatch.setattr(excel._SeenRows, "_spill", recording_spill)
+    cleaned = pd.concat(list(iter_clean_batches(path, batch_rows=70)))
+
+    expected = _reference(path)
+    assert list(cleaned.columns) == ["amount", "city", "flag"]
+    assert cleaned["city"].isna().sum() == 0 and (cleaned["city"] == "Lagos").sum() == (expected["city"] == "Lagos").sum()
+    pd.testing.assert_frame_equal(cleaned.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+    # Hashes beyond the memory limit went to temporary files, which are removed afterwards
+    assert spill_dirs and not any(os.path.exists(directory) for directory in spill_dirs)
+
+
+def test_value_counts_stay_bounded_and_keep_heavy_hitters():
+    counts = excel._ValueCounts(capacity=5)
+    for batch in range(20):
+        counts.update(pd.Series(["common"] * 10 + [f"rare-{batch}-{i}" for i in range(10)]))
+    assert len(counts.counts) <= 5 and not counts.exact
+    assert counts.mode() == "common"
+
+
+def test_seen_rows_finds_hashes_across_runs():
+    seen = excel._SeenRows(memory_rows=8)
+    added = np.arange(0, 100, 2, dtype=np.uint64)
+    for start in range(0, len(added), 5):
+        seen.add(added[start:start + 5])
+    probe = np.arange(100, dtype=np.uint64)
+    try:
+        assert (seen.contains(probe) == (probe % 2 == 0)).all()
+        assert any(isinstance(run, np.memmap) for run in seen.runs)
+    finally:
+        seen.close()
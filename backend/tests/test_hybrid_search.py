@@ -0,0 +1,59 @@
+import pytest
+from langchain_core.documents import Document
+from benchmarks.fakes import FakeEmbeddings
+from services.hybrid_search import hybrid_search, is_keyword_query, reciprocal_rank_fusion
+from services.ingestion import document_key, sync_documents
+from services.vector_backend import LocalVectorStore
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("INV-2024-0012", True),
+    ("INV-2024-0012 2024-03-01", True),
+    ("AAPL", True),
+    ('"late payment fee"', True),
+    ("late fees", False),
+    ("who paid INV-2024-0012", False),
+    ("Apple", False),
+    ('"', False),
+    ("   ", False),
+])
+def test_is_keyword_query(query, expected):
+    assert is_keyword_query(query) is expected
+
+
+def _docs(*texts):
+    return [Document(page_content=text) for text in texts]
+
+
+def test_rrf_rewards_documents_ranked_by_both_lists():
+    keyword = _docs("a", "b", "c")
+    vector = _docs("c", "d", "a")
+    fused = reciprocal_rank_fusion([keyword, vector], k=60)
+
+    assert [doc.page_content for doc, _ in fused] == ["a", "c", "b", "d"]
+    scores = dict((doc.page_content, score) for doc, score in fused)
+    assert scores["a"] == pytest.approx(1 / 61 + 1 / 63)
+    assert scores["b"] == pytest.approx(1 / 62)
+
+
+def test_rrf_keeps_the_first_copy_of_a_document():
+    first, second = Document(page_content="same", metadata={"from": "keyword"}), Document(page_content="same", metadata={"from": "vector"})
+    ((doc, score),) = reciprocal_rank_fusion([[first], [second]], k=1)
+    assert doc.metadata == {"from": "keyword"} and score == pytest.approx(1.0)
+
+
+def test_keyword_queries_skip_the_embedding_call():
+    embeddings = FakeEmbeddings()
+    store = LocalVectorStore(embeddings, namespace="test_hybrid")
+    sync_documents(store, {document_key("pdf", "c" * 64): _docs(
+        "invoice INV-2024-0012 was paid late", "the warehouse roof got solar panels", "late fees apply after thirty days",
+    )})
+    calls = embeddings.calls
+
+    assert [doc.page_content for doc in hybrid_search(store, "INV-2024-0012", k=1)] == ["invoice INV-2024-0012 was paid late"]
+    assert embeddings.calls == calls
+
+    # Natural-language queries are embedded and their vector hits fused with the keyword hits
+    hits = hybrid_search(store, "solar panels roof", k=2)
+    assert hits[0].page_content == "the warehouse roof got solar panels"
+    assert embeddings.calls == calls + 1
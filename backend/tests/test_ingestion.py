@@ -0,0 +1,57 @@
+from langchain_core.documents import Document
+from benchmarks.fakes import FakeEmbeddings
+from services.ingestion import sync_documents, document_key
+from services.vector_backend import LocalVectorStore, list_ids
+
+REPORT_A = ["quarterly revenue grew in the northern region", "the board approved the hiring plan"]
+REPORT_B = ["solar panels were installed on the warehouse roof", "the cafeteria menu changed in spring"]
+
+
+def _documents(texts):
+    return [Document(page_content=text, metadata={"source": "pdf"}) for text in texts]
+
+
+def _top_hit(store, query):
+    return store.similarity_search(query, k=1)[0].page_content
+
+
+def test_second_document_keeps_the_first_searchable():
+    store = LocalVectorStore(FakeEmbeddings(), namespace="test_two_documents")
+    first = sync_documents(store, {document_key("pdf", "a" * 64): _documents(REPORT_A)})
+    second = sync_documents(store, {document_key("pdf", "b" * 64): _documents(REPORT_B)})
+
+    assert first["added"] == 2 and second["added"] == 2 and second["deleted"] == 0
+    assert len(list_ids(store, "pdf#")) == 4
+    assert _top_hit(store, "revenue in the northern region") == REPORT_A[0]
+    assert _top_hit(store, "solar panels on the roof") == REPORT_B[0]
+
+
+def test_reingesting_a_document_only_replaces_its_own_chunks():
+    store = LocalVectorStore(FakeEmbeddings(), namespace="test_reingest")
+    key_a, key_b = document_key("pdf", "a" * 64), document_key("pdf", "b" * 64)
+    sync_documents(store, {key_a: _documents(REPORT_A)})
+    sync_documents(store, {key_b: _documents(REPORT_B)})
+
+    again = sync_documents(store, {key_a: _documents(REPORT_A)})
+    assert again["added"] == 0 and again["unchanged"] == 2 and again["deleted"] == 0
+
+    changed = sync_documents(store, {key_a: _documents(REPORT_A[:1])})
+    assert changed["deleted"] == 1
+    assert len(list_ids(store, f"{key_a}#")) == 1
+    assert len(list_ids(store, f"{key_b}#")) == 2
+
+
+class _FailingEmbeddings(FakeEmbeddings):
+    def embed_documents(self, texts):
+        raise RuntimeError("rate limited")
+
+
+def test_failed_ingest_keeps_the_stored_chunks():
+    store = LocalVectorStore(FakeEmbeddings(), namespace="test_failed_ingest")
+    key = document_key("pdf", "a" * 64)
+    sync_documents(store, {key: _documents(REPORT_A)})
+
+    failing = LocalVectorStore(_FailingEmbeddings(), namespace="test_failed_ingest")
+    stats = sync_documents(failing, {key: _documents(["a rewritten first page"])}, max_retries=0)
+    assert stats["failed_batches"] and stats["deleted"] == 0
+    assert len(list_ids(store, f"{key}#")) == 2
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+from services import session_store
+from services.jobs import complete_job, get_job
+from services.session_store import (
+    create_job, fail_orphaned_jobs, finish_job, get_job_record, set_cached_result, set_job_status,
+)
+
+
+def test_job_polls_leave_out_the_result():
+    set_cached_result("pdf:digest-1", [{"text": "page one"}])
+    job_id = complete_job("pdf", "pdf:digest-1")
+
+    assert "result" not in get_job(job_id)
+    assert get_job(job_id, include_result=True)["result"] == [{"text": "page one"}]
+    # Stored once, in the extraction cache: the job keeps only the key
+    rows = session_store._execute("SELECT result, result_key FROM jobs WHERE job_id = ?", (job_id,))
+    assert rows == [(None, "pdf:digest-1")]
+
+
+def test_small_results_are_kept_with_the_job():
+    create_job("embedding-job", "embedding")
+    finish_job("embedding-job", result={"stored": 3})
+    assert get_job_record("embedding-job", include_result=True)["result"] == {"stored": 3}
+
+
+def test_jobs_of_a_dead_process_are_failed():
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    create_job("orphan", "pdf")
+    create_job("alive", "pdf")
+    set_job_status("orphan", "running")
+    session_store._execute("UPDATE jobs SET owner_pid = ? WHERE job_id = 'orphan'", (dead.pid,))
+
+    assert fail_orphaned_jobs() == 1
+    orphan = get_job_record("orphan")
+    assert orphan["status"] == "failed" and orphan["error"]
+    assert get_job_record("alive")["status"] == "queued"
+    assert os.getpid() == session_store._execute("SELECT owner_pid FROM jobs WHERE job_id = 'alive'")[0][0]
+
+
+def test_eviction_keeps_results_a_live_session_refers_to():
+    set_cached_result("pdf:referenced", ["kept"])
+    set_cached_result("pdf:unreferenced", ["dropped"])
+    session_store.set_session_values("live-session", {"pdf_text_result": "pdf:referenced"})
+    session_store._execute("UPDATE extraction_results SET updated = 0 WHERE key IN ('pdf:referenced', 'pdf:unreferenced')")
+
+    session_store.evict_expired(force=True)
+    assert session_store.get_cached_result("pdf:referenced") == ["kept"]
+    assert session_store.get_cached_result("pdf:unreferenced") is None
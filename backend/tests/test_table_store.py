@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+from services.table_store import TableWriter, get_table_stats, run_table_query
+
+
+@pytest.fixture(scope="module")
+def sales():
+    writer = TableWriter("sales_test", source="sales.csv")
+    writer.write(pd.DataFrame({
+        "region": ["north", "south", "north", "east"],
+        "amount": [10.0, 20.5, 30.0, 5.0],
+        "account": [2 ** 53 + 1, 7, 8, 9],
+    }))
+    writer.write(pd.DataFrame({"region": ["south", "north"], "amount": [4.5, 1.0], "account": [10, 11]}))
+    writer.close()
+    return "sales_test"
+
+
+@pytest.mark.parametrize("spec, message", [
+    ({"filters": [{"column": "region", "op": "like", "value": "n"}]}, "Unsupported filter operator"),
+    ({"aggregations": [{"column": "amount", "func": "drop"}]}, "Unsupported aggregation"),
+    ({"group_by": ["country"]}, "Unknown columns: \\['country'\\]"),
+    ({"filters": [{"column": "price", "op": ">", "value": 1}]}, "Unknown columns"),
+    ({"aggregations": [{"column": "*", "func": "sum"}]}, "Unknown columns"),
+    ({"select": ["region", "secret"]}, "Unknown columns: \\['secret'\\]"),
+])
+def test_invalid_specs_are_rejected(sales, spec, message):
+    with pytest.raises(ValueError, match=message):
+        run_table_query(sales, spec)
+
+
+def test_group_by_aggregates_over_every_batch(sales):
+    result = run_table_query(sales, {
+        "group_by": ["region"],
+        "aggregations": [{"column": "amount", "func": "sum"}, {"column": "*", "func": "count"}],
+        "order_by": {"column": "sum(amount)", "descending": True},
+    })
+    assert result["columns"] == ["region", "sum(amount)", "count(*)"]
+    assert result["rows"] == [["north", 41.0, 3], ["south", 25.0, 2], ["east", 5.0, 1]]
+
+
+def test_filters_coerce_values_to_the_column_type(sales):
+    result = run_table_query(sales, {"filters": [{"column": "amount", "op": ">=", "value": "10"}], "select": ["region"]})
+    assert sorted(row[0] for row in result["rows"]) == ["north", "north", "south"]
+
+    # Integers above 2**53 must match exactly, not through a rounded float
+    result = run_table_query(sales, {"filters": [{"column": "account", "op": "==", "value": str(2 ** 53 + 1)}]})
+    assert result["row_count"] == 1 and result["rows"][0][0] == "north"
+
+    result = run_table_query(sales, {"filters": [{"column": "region", "op": "contains", "value": "OUT"}]})
+    assert result["row_count"] == 2
+
+
+def test_results_are_truncated_to_max_rows(sales):
+    result = run_table_query(sales, {"select": ["account"], "limit": 100}, max_rows=4)
+    assert len(result["rows"]) == 4 and result["row_count"] == 6 and result["truncated"]
+
+
+def test_missing_table(sales):
+    assert get_table_stats("not_written") is None
+    with pytest.raises(FileNotFoundError):
+        run_table_query("not_written", {})
+    with pytest.raises(ValueError, match="Invalid table id"):
+        run_table_query("../sales_test", {})
+
+
+def test_count_without_columns_reads_no_column(sales):
+    result = run_table_query(sales, {"filters": [{"column": "amount", "op": "<", "value": 6}], "aggregations": [{"column": "*", "func": "count"}]})
+    assert result["rows"] == [[3]]
@@ -0,0 +1,39 @@
+import time
+import threading
+import numpy as np
+import pytest
+from services import vector_backend
+from services.vector_backend import NumpyNamespace
+
+
+def test_concurrent_upserts_of_one_id_keep_a_single_row(monkeypatch):
+    store = NumpyNamespace()
+    store.add(["shared"], ["first"], [{}], np.ones((1, 4), dtype=np.float32))
+    norm = np.linalg.norm
+
+    def slow_norm(*args, **kwargs):
+        time.sleep(0.05)  # widens the window between the upsert check and the append
+        return norm(*args, **kwargs)
+
+    monkeypatch.setattr(vector_backend.np.linalg, "norm", slow_norm)
+    threads = [
+        threading.Thread(target=store.add, args=(["shared"], [f"batch {i}"], [{}], np.ones((1, 4), dtype=np.float32)))
+        for i in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.ids == ["shared"] and store.count == 1
+
+
+def test_process_local_backends_refuse_several_workers(monkeypatch):
+    monkeypatch.setattr(vector_backend, "VECTOR_BACKEND", "pinecone")
+    monkeypatch.setattr(vector_backend, "PRIVATE_VECTOR_BACKEND", "local")
+    vector_backend.check_worker_backends(workers=1)
+    with pytest.raises(ValueError, match="PRIVATE_VECTOR_BACKEND=local"):
+        vector_backend.check_worker_backends(workers=4)
+
+    monkeypatch.setattr(vector_backend, "PRIVATE_VECTOR_BACKEND", "segments")
+    vector_backend.check_worker_backends(workers=4)
@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+import numpy as np
+import pytest
+from services import vector_segments
+from services.vector_segments import SegmentNamespace, namespace_dir
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    # Several segments per namespace, and compaction only when a test asks for it
+    monkeypatch.setattr(vector_segments, "VECTOR_SEGMENT_ROWS", 50)
+    monkeypatch.setattr(vector_segments, "VECTOR_SEGMENT_COMPACT_MIN_ROWS", 10 ** 9)
+
+
+def _vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, 8)).astype(np.float32)
+
+
+def _fill(name, count=120, dtype="float16"):
+    store = SegmentNamespace(name, dtype)
+    vectors = _vectors(count)
+    ids = [f"doc-{i}" for i in range(count)]
+    store.add(ids, [f"text {i}" for i in range(count)], [{"n": i} for i in range(count)], vectors)
+    return store, ids, vectors
+
+
+def _top_hit(store, vector):
+    return store.search(vector, 1)[0][0]
+
+
+def test_reload_after_upsert():
+    store, ids, vectors = _fill("segments_upsert")
+    store.add(["doc-3"], ["replaced"], [{"n": -1}], vectors[3:4])
+
+    reloaded = SegmentNamespace("segments_upsert")
+    assert reloaded.count == len(ids)
+    hit = _top_hit(reloaded, vectors[3])
+    assert hit["id"] == "doc-3" and hit["text"] == "replaced" and hit["metadata"] == {"n": -1}
+
+
+def test_reload_after_delete():
+    store, ids, vectors = _fill("segments_delete")
+    store.delete(ids[:30])
+
+    reloaded = SegmentNamespace("segments_delete")
+    assert sorted(reloaded.ids) == sorted(ids[30:])
+    assert _top_hit(reloaded, vectors[0])["id"] not in ids[:30]
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_reload_after_compaction(dtype):
+    name = f"segments_compact_{dtype}"
+    store, ids, vectors = _fill(name, dtype=dtype)
+    store.delete(ids[::2])
+    old_names = [segment.name for segment in store.segments]
+
+    store.compact()
+    assert store.deleted == 0 and store.generation == 1
+    assert not any(os.path.exists(os.path.join(namespace_dir(name), old + ".vec")) for old in old_names)
+
+    reloaded = SegmentNamespace(name)
+    assert sorted(reloaded.ids) == sorted(ids[1::2])
+    assert reloaded.deleted == 0
+    for i in (1, 51, 119):
+        assert _top_hit(reloaded, vectors[i])["id"] == f"doc-{i}"
+
+
+def test_writes_during_compaction_are_kept(monkeypatch):
+    store, ids, vectors = _fill("segments_concurrent")
+    store.delete(ids[:60])
+    copy_rows = SegmentNamespace._copy_rows
+    writes = []
+
+    def copy_and_write(self, *args):
+        copy_rows(self, *args)
+        if not writes:
+            # The lock is not held while rows are copied, so writers go on meanwhile
+            writes.append(True)
+            self.delete(["doc-100"])
+            self.add(["doc-101", "new"], ["updated", "new"], [{}, {}], _vectors(2, seed=1))
+
+    monkeypatch.setattr(SegmentNamespace, "_copy_rows", copy_and_write)
+    store.compact()
+
+    for current in (store, SegmentNamespace("segments_concurrent")):
+        assert sorted(current.ids) == sorted([f"doc-{i}" for i in range(60, 120) if i != 100] + ["new"])
+        assert _top_hit(current, _vectors(2, seed=1)[0])["text"] == "updated"
+        assert _top_hit(current, vectors[100])["id"] != "doc-100"
+
+
+def test_failed_compaction_leaves_the_namespace_unchanged(monkeypatch):
+    name = "segments_failed"
+    store, ids, vectors = _fill(name)
+    store.delete(ids[:40])
+    segments, generation = list(store.segments), store.generation
+    save_manifest, copy_rows = SegmentNamespace._save_manifest, SegmentNamespace._copy_rows
+
+    def failing_save(self, segments=None, generation=None):
+        if generation is not None:
+            raise OSError("disk full")
+        save_manifest(self, segments, generation)
+
+    def copy_and_delete(self, *args):
+        copy_rows(self, *args)
+        # Leaves a tombstone for row 5 of the attempt's first segment, which held doc-45
+        self.delete(["doc-45"])
+
+    monkeypatch.setattr(SegmentNamespace, "_save_manifest", failing_save)
+    monkeypatch.setattr(SegmentNamespace, "_copy_rows", copy_and_delete)
+    with pytest.raises(OSError):
+        store.compact()
+    monkeypatch.setattr(SegmentNamespace, "_save_manifest", save_manifest)
+    monkeypatch.setattr(SegmentNamespace, "_copy_rows", copy_rows)
+
+    expected = sorted(doc_id for doc_id in ids[40:] if doc_id != "doc-45")
+    assert store.segments == segments and store.generation == generation and store.deleted == 41
+    assert _top_hit(store, vectors[80])["id"] == "doc-80"
+    assert not any(file_name.startswith("seg-0001-") for file_name in os.listdir(namespace_dir(name)))
+    assert sorted(SegmentNamespace(name).ids) == expected
+
+    # The next compaction reuses the generation's segment names; the failed attempt's tombstones must not apply
+    store.compact()
+    again = SegmentNamespace(name)
+    assert sorted(again.ids) == expected
+    assert _top_hit(again, vectors[46])["id"] == "doc-46"
+
+
+def test_load_removes_orphaned_segment_files():
+    name = "segments_orphans"
+    _fill(name)
+    orphan = os.path.join(namespace_dir(name), "seg-0007-000000.vec")
+    with open(orphan, "wb") as file:
+        file.write(b"\0" * 64)
+
+    reloaded = SegmentNamespace(name)
+    assert not os.path.exists(orphan)
+    assert reloaded.count == 120
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_stored_vectors_come_back_dequantized(dtype):
+    store, ids, vectors = _fill(f"segments_vectors_{dtype}", dtype=dtype)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    hit = store.search(vectors[70], 1, include_vectors=True)[0][0]
+    assert hit["id"] == "doc-70" and np.allclose(hit["vector"], normalized[70], atol=0.02)
+    found = store.get_vectors(["doc-3", "missing"])
+    assert list(found) == ["doc-3"] and np.allclose(found["doc-3"], normalized[3], atol=0.02)
+
+
+def test_two_instances_share_a_namespace():
+    # As two API workers would: separate objects on one directory, each writing in turn
+    name = "segments_shared"
+    first = SegmentNamespace(name)
+    vectors = _vectors(4)
+    first.add(["a1"], ["a1 text"], [{}], vectors[0:1])
+    second = SegmentNamespace(name)
+    first.add(["a2"], ["a2 text"], [{}], vectors[1:2])
+    second.add(["b1"], ["b1 text"], [{}], vectors[2:3])
+
+    for store in (first, second):
+        assert sorted(store.ids) == ["a1", "a2", "b1"]
+        assert [_top_hit(store, vectors[i])["text"] for i in range(3)] == ["a1 text", "a2 text", "b1 text"]
+
+    second.add(["a1"], ["a1 replaced"], [{}], vectors[0:1])
+    second.delete(["a2"])
+    assert sorted(first.ids) == ["a1", "b1"] and _top_hit(first, vectors[0])["text"] == "a1 replaced"
+
+    # A compaction by one instance is picked up by the other
+    first.compact()
+    second.add(["b2"], ["b2 text"], [{}], vectors[3:4])
+    for store in (first, second):
+        assert store.generation == 1 and sorted(store.ids) == ["a1", "b1", "b2"]
+        assert _top_hit(store, vectors[3])["text"] == "b2 text"
+
+
+def _add_from_process(name, prefix):
+    store = SegmentNamespace(name)
+    for i in range(0, 60, 3):
+        store.add([f"{prefix}-{j}" for j in range(i, i + 3)], [f"{prefix} {j}" for j in range(i, i + 3)], [{}] * 3, _vectors(3, seed=i))
+
+
+def test_processes_append_to_one_namespace_concurrently():
+    name = "segments_processes"
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_add_from_process, args=(name, prefix)) for prefix in ("a", "b")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    store = SegmentNamespace(name)
+    assert sorted(store.ids) == sorted(f"{prefix}-{j}" for prefix in "ab" for j in range(60))
+    hits = store.search(_vectors(3, seed=30)[1], 2)[0]
+    assert sorted(hit["text"] for hit in hits) == ["a 31", "b 31"]
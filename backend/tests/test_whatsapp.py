@@ -0,0 +1,59 @@
+from datetime import datetime
+import pytest
+from services.whatsapp import detect_dayfirst, group_messages, iter_whatsapp_messages
+
+
+@pytest.mark.parametrize("line, timestamp, sender, text", [
+    ("05/04/2024, 21:09 - Alice: hello", datetime(2024, 4, 5, 21, 9), "Alice", "hello"),
+    ("[05/04/2024, 21:09:32] Bob: hi there", datetime(2024, 4, 5, 21, 9, 32), "Bob", "hi there"),
+    ("\u200e[05/04/24, 9:09:32\u202fPM] Bob: \u200eimage omitted", datetime(2024, 4, 5, 21, 9, 32), "Bob", "image omitted"),
+    ("5.4.24, 12:05 a.m. - Carol: late", datetime(2024, 4, 5, 0, 5), "Carol", "late"),
+    ("05-04-2024 21:09 - Alice created group \"Trip\"", datetime(2024, 4, 5, 21, 9), None, "Alice created group \"Trip\""),
+])
+def test_header_formats(line, timestamp, sender, text):
+    (message,) = iter_whatsapp_messages([line], dayfirst=True)
+    assert message == {"timestamp": timestamp, "sender": sender, "text": text}
+
+
+def test_lines_without_a_header_continue_the_message():
+    lines = [
+        "05/04/2024, 21:09 - Alice: first line\n",
+        "second line: with a colon\n",
+        "05/04/2024, 21:10 - Bob: reply\n",
+        "31/02/2024, 21:11 - not a date, so still Bob's message\n",
+    ]
+    messages = list(iter_whatsapp_messages(lines, dayfirst=True))
+    assert [message["text"] for message in messages] == [
+        "first line\nsecond line: with a colon",
+        "reply\n31/02/2024, 21:11 - not a date, so still Bob's message",
+    ]
+
+
+def test_detect_dayfirst_uses_the_first_unambiguous_date():
+    assert detect_dayfirst(["05/04/2024, 21:09 - A: x", "25/04/2024, 08:00 - A: y"], default=False) is True
+    assert detect_dayfirst(["[04/05/2024, 21:09:00] A: x", "[04/25/2024, 08:00:00] A: y"], default=True) is False
+    # Later dates do not override the order settled by the first one
+    assert detect_dayfirst(["13/01/2024, 10:00 - A: x", "01/13/2024, 10:00 - A: y"], default=False) is True
+
+
+def test_detect_dayfirst_falls_back_when_nothing_settles_it():
+    lines = ["05/04/2024, 21:09 - A: x", "continued text 25/04/2024", "06/04/2024, 08:00 - A: y"]
+    assert detect_dayfirst(lines, default=True) is True
+    assert detect_dayfirst(lines, default=False) is False
+
+
+def test_month_first_exports_parse_every_line_the_same_way():
+    lines = ["04/05/2024, 21:09 - A: x", "04/25/2024, 08:00 - A: y"]
+    messages = list(iter_whatsapp_messages(lines, dayfirst=detect_dayfirst(lines)))
+    assert [message["timestamp"].date() for message in messages] == [datetime(2024, 4, 5).date(), datetime(2024, 4, 25).date()]
+
+
+def test_silence_starts_a_new_chunk():
+    lines = [
+        "05/04/2024, 21:00 - Alice: one",
+        "05/04/2024, 21:10 - Bob: two",
+        "05/04/2024, 23:00 - Alice: three",
+    ]
+    chunks = list(group_messages(iter_whatsapp_messages(lines, dayfirst=True), chat_name="trip", window_minutes=30))
+    assert [chunk["metadata"]["messages"] for chunk in chunks] == [2, 1]
+    assert chunks[0]["metadata"]["senders"] == ["Alice", "Bob"] and chunks[0]["metadata"]["chat"] == "trip"
@@ -1,3 +1,6 @@
+import time
+import json
+import uuid
 import streamlit as st
 import requests
 
@@ -29,6 +32,44 @@ if rag_mode == "Private RAG":
 else:
     st.session_state.username = None  # Clear username for Public RAG
 
+# HTTP session that tags every request with this browser session's id, so the backend keeps
+# each user's uploads and active namespace separate (and reuses the connection)
+def backend():
+    if "backend" not in st.session_state:
+        session = requests.Session()
+        session.headers["X-Session-Id"] = str(uuid.uuid4())
+        st.session_state.backend = session
+    return st.session_state.backend
+
+# Function to wait for a background ingestion job and return its final status
+def wait_for_job(response, label):
+    job_id = response.json().get("job_id")
+    if not job_id:
+        return None
+    progress_text = st.empty()
+    with st.spinner(f"⏳ Processing {label}..."):
+        while True:
+            job = backend().get(f"{BACKEND_URL}/jobs/{job_id}").json()
+            if job.get("status") in ("done", "failed", None):
+                break
+            progress = job.get("progress") or {}
+            counters = ", ".join(f"{key}: {value}" for key, value in progress.items() if key != "started")
+            progress_text.write(f"Status: {job.get('status')} {counters}")
+            time.sleep(1)
+        if job.get("status") == "done":
+            # Polls return status and progress only; the extracted result is fetched once
+            job = backend().get(f"{BACKEND_URL}/jobs/{job_id}", params={"include_result": "true"}).json()
+    progress_text.empty()
+    return job
+
+# Function to describe why an upload failed: the job's error, or the backend's response when no job ran
+def failure_reason(response, job):
+    if job is not None:
+        return job.get("error") or "the job finished without a result"
+    if response.status_code != 200:
+        return f"status code {response.status_code}: {response.text}"
+    return response.json().get("error") or "no job was started"
+
 # Function to upload files
 def upload_files():
     st.header("📤 Upload Files")
@@ -43,15 +84,16 @@ def upload_files():
             files = {"file": pdf_file.getvalue()}
             if rag_mode == "Private RAG" and st.session_state.username:
                 files["username"] = st.session_state.username  # Include username for Private RAG
-            response = requests.post(f"{BACKEND_URL}/pdf", files=files)
-            if response.status_code == 200:
+            response = backend().post(f"{BACKEND_URL}/pdf", files=files)
+            job = wait_for_job(response, "PDF") if response.status_code == 200 else None
+            if job and job.get("status") == "done":
                 st.success("✅ PDF processed successfully!")
-                result = response.json()
+                result = {"text": job.get("result")}
                 st.session_state.uploaded_files["pdf"] = result  # Save PDF data in session state
                 st.write("📝 Extracted Text and Metadata:")
                 st.text_area("Extracted Text", value=result.get("text", ""), height=300)
             else:
-                st.error("❌ Failed to process PDF.")
+                st.error(f"❌ Failed to process PDF: {failure_reason(response, job)}")
 
     elif file_type == "WhatsApp Chat":
         whatsapp_file = st.file_uploader("Upload a WhatsApp chat ZIP file", type=["zip"])
@@ -59,15 +101,16 @@ def upload_files():
             files = {"file": whatsapp_file.getvalue()}
             if rag_mode == "Private RAG" and st.session_state.username:
                 files["username"] = st.session_state.username  # Include username for Private RAG
-            response = requests.post(f"{BACKEND_URL}/embedding_vector_store_whatsapp", files=files)
-            if response.status_code == 200:
+            response = backend().post(f"{BACKEND_URL}/embedding_vector_store_whatsapp", files=files)
+            job = wait_for_job(response, "WhatsApp chat") if response.status_code == 200 else None
+            if job and job.get("status") == "done":
                 st.success("✅ WhatsApp chat processed successfully!")
-                result = response.json()
+                result = {"text": job.get("result")}
                 st.session_state.uploaded_files["whatsapp"] = result  # Save WhatsApp data in session state
                 st.write("📝 Extracted Text:")
                 st.text_area("Extracted Text", value=result, height=300)
             else:
-                st.error("❌ Failed to process WhatsApp chat.")
+                st.error(f"❌ Failed to process WhatsApp chat: {failure_reason(response, job)}")
 
     elif file_type == "Excel":
         excel_file = st.file_uploader("Upload an Excel file", type=["xlsx", "csv"])
@@ -75,15 +118,16 @@ def upload_files():
             files = {"file": excel_file.getvalue()}
             if rag_mode == "Private RAG" and st.session_state.username:
                 files["username"] = st.session_state.username  # Include username for Private RAG
-            response = requests.post(f"{BACKEND_URL}/excel", files=files)
-            if response.status_code == 200:
+            response = backend().post(f"{BACKEND_URL}/excel", files=files)
+            job = wait_for_job(response, "Excel file") if response.status_code == 200 else None
+            if job and job.get("status") == "done":
                 st.success("✅ Excel file processed successfully!")
-                result = response.json()
+                result = {"text": job.get("result")}
                 st.session_state.uploaded_files["excel"] = result  # Save Excel data in session state
                 st.write("📊 Extracted Data:")
                 st.json(result)
             else:
-                st.error("❌ Failed to process Excel file.")
+                st.error(f"❌ Failed to process Excel file: {failure_reason(response, job)}")
 
     elif file_type == "YouTube URL":
         youtube_url = st.text_input("Enter YouTube URL")
@@ -91,7 +135,7 @@ def upload_files():
             payload = {"url": youtube_url}
             if rag_mode == "Private RAG" and st.session_state.username:
                 payload["username"] = st.session_state.username  # Include username for Private RAG
-            response = requests.post(f"{BACKEND_URL}/youtube", data=payload)
+            response = backend().post(f"{BACKEND_URL}/youtube", data=payload)
             if response.status_code == 200:
                 st.success("✅ YouTube transcript processed successfully!")
                 result = response.json()
@@ -115,7 +159,7 @@ def create_embeddings():
         if rag_mode == "Private RAG" and st.session_state.username:
             payload["username"] = st.session_state.username  # Include username for Private RAG
         
-        response = requests.post(
+        response = backend().post(
             f"{BACKEND_URL}/embedding_vector_store_final_text",
             data=payload
         )
@@ -125,19 +169,64 @@ def create_embeddings():
         else:
             st.error("❌ Failed to create embeddings.")
 
+# Function to read server-sent events from a streaming response as (event, data) pairs
+def read_events(response):
+    event = "message"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            event = "message"
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            yield event, json.loads(line[len("data:"):].strip())
+
+# Function to show the answer token by token as the backend generates it
+def stream_answer(payload):
+    response = backend().post(f"{BACKEND_URL}/retrieval_chat_stream", data=payload, stream=True)
+    if response.status_code != 200 or not response.headers.get("content-type", "").startswith("text/event-stream"):
+        st.error(f"❌ Failed to process query. Status code: {response.status_code}")
+        st.write("Error details:", response.text)
+        return
+    events = read_events(response)
+
+    def tokens():
+        for event, data in events:
+            if event == "sources":
+                with st.expander(f"📚 Sources ({len(data)})"):
+                    for source in data:
+                        st.write(source.get("text", ""))
+                st.write("📄 Retrieved Result:")
+            elif event == "usage":
+                st.caption(f"🧾 Prompt tokens: {data['prompt_tokens']} ({data['chunks']} chunks, {data['context_tokens']} context tokens)")
+            elif event == "token":
+                yield data
+            elif event == "error":
+                st.error(f"❌ An error occurred: {data}")
+            elif event == "done":
+                break
+
+    st.write_stream(tokens())
+
 # Function to query the retriever
 def query_retriever():
     st.header("🔍 Query Retriever")
     
     query = st.text_input("❓ Enter your query")
+    stream = st.checkbox("⚡ Stream the answer", value=True)
+    table = st.checkbox("📊 Compute over the uploaded spreadsheet (totals, averages, filters)")
+    token_budget = st.number_input("🧮 Context token budget", min_value=200, max_value=8000, value=1500, step=100)
     if st.button("🚀 Submit Query"):
         try:
-            payload = {"query": query}
+            payload = {"query": query, "token_budget": int(token_budget)}
             if rag_mode == "Private RAG" and st.session_state.username:
                 payload["username"] = st.session_state.username  # Include username for Private RAG
+
+            if stream and not table:
+                stream_answer(payload)
+                return
             
-            response = requests.post(
-                f"{BACKEND_URL}/retrieval_chat",
+            response = backend().post(
+                f"{BACKEND_URL}/table_query" if table else f"{BACKEND_URL}/retrieval_chat",
                 data=payload  # Use `data` to send form data
             )
             if response.status_code == 200:
@@ -149,6 +238,12 @@ def query_retriever():
                     retrieved_result = result["retriever"]["result"]
                     st.write("📄 Retrieved Result:")
                     st.write(retrieved_result)  # Display only the "result" field
+                    usage = result["retriever"].get("usage")
+                    if usage:
+                        st.caption(f"🧾 Prompt tokens: {usage['prompt_tokens']} ({usage['chunks']} chunks, {usage['context_tokens']} context tokens)")
+                    if "table" in result["retriever"]:
+                        rows = result["retriever"]["table"]
+                        st.dataframe([dict(zip(rows["columns"], row)) for row in rows["rows"]])
                 else:
                     st.error("❌ The 'result' field is missing in the response.")
             else: